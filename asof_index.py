@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+内存as-of索引
+功能：
+1. 一次性加载trade.Clsprc、shares.Nshrttl等按日期变化的序列
+2. 以(股票序号, 日期)组合键排序后存为NumPy数组
+3. 通过二分查找回答“某股票在日期D当日或之前的最新值”，支持单次查询和向量化批量查询
+"""
+
+import logging
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# 组合键 = 股票序号 << 32 | (距1970-01-01天数 + 2^31)，保证1970年以前的日期也为非负
+_DAY_BITS = 32
+_DAY_OFFSET = 1 << 31
+
+
+def _to_days(dates) -> np.ndarray:
+    """将日期字符串/日期对象序列转换为距1970-01-01的天数，无法解析的日期为NaT"""
+    d = pd.to_datetime(pd.Series(np.asarray(dates).ravel()), errors='coerce').to_numpy(dtype='datetime64[D]')
+    return d
+
+
+class AsOfIndex:
+    """按股票分组、按日期升序排列的as-of查询索引类"""
+
+    def __init__(self, codes, dates, values):
+        """
+        初始化as-of索引
+
+        Args:
+            codes: 股票代码序列
+            dates: 日期序列，与codes等长
+            values: 数值序列，与codes等长
+        """
+        codes = np.asarray(codes, dtype=str)
+        days = _to_days(dates)
+        values = pd.to_numeric(pd.Series(np.asarray(values, dtype=object)), errors='coerce').to_numpy(dtype='float64')
+        valid = ~np.isnat(days)
+        codes, days, values = codes[valid], days[valid], values[valid]
+
+        self.codes, code_idx = np.unique(codes, return_inverse=True)
+        self.code_pos = {code: i for i, code in enumerate(self.codes.tolist())}
+        keys = self._make_keys(code_idx.astype('int64'), days.astype('int64'))
+        order = np.argsort(keys, kind='mergesort')
+        self.keys = keys[order]
+        self.values = values[order]
+
+    @staticmethod
+    def _make_keys(code_idx: np.ndarray, days: np.ndarray) -> np.ndarray:
+        return (code_idx << _DAY_BITS) + (days + _DAY_OFFSET)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    @classmethod
+    def from_frame(cls, df: pd.DataFrame, date_column: str, value_column: str) -> 'AsOfIndex':
+        """由包含Stkcd、日期列和数值列的DataFrame构建索引"""
+        if df.empty:
+            return cls([], [], [])
+        return cls(df['Stkcd'].to_numpy(), df[date_column].to_numpy(), df[value_column].to_numpy())
+
+    @classmethod
+    def from_repository(cls, repo, table: str, date_column: str, value_column: str) -> 'AsOfIndex':
+        """
+        从数据库一次性读取整列数据构建索引
+
+        Args:
+            repo: FinancialDataRepository实例
+            table: 表名，如trade、shares
+            date_column: 日期列名，如Trddt、Reptdt
+            value_column: 数值列名，如Clsprc、Nshrttl
+
+        Returns:
+            AsOfIndex: as-of索引
+        """
+        sql = f"SELECT Stkcd, {date_column}, {value_column} FROM {table}"
+        index = cls.from_frame(repo._fetch_frame(sql), date_column, value_column)
+        logger.info(f"已加载{table}.{value_column}的as-of索引，共 {len(index)} 行")
+        return index
+
+    @classmethod
+    def from_snapshot(cls, store, table: str, value_column: str) -> 'AsOfIndex':
+        """
+        从本地快照构建索引
+
+        Args:
+            store: snapshot_store.SnapshotStore实例
+            table: 表名
+            value_column: 数值列名
+
+        Returns:
+            AsOfIndex: as-of索引
+        """
+        date_column = store.read_meta(table)['date_column']
+        df = store.read_table(table)[['Stkcd', date_column, value_column]]
+        return cls.from_frame(df, date_column, value_column)
+
+    def lookup(self, stock_code: str, date) -> float:
+        """
+        查询单只股票在date当日或之前的最新值
+
+        Args:
+            stock_code: 股票代码
+            date: 日期，格式为'YYYY-MM-DD'
+
+        Returns:
+            float: 最新值，不存在时返回NaN
+        """
+        i = self.code_pos.get(stock_code)
+        if i is None:
+            return np.nan
+        try:
+            day = np.datetime64(date, 'D').astype('int64')
+        except ValueError:
+            return np.nan
+        key = (i << _DAY_BITS) + (day + _DAY_OFFSET)
+        pos = int(np.searchsorted(self.keys, key, side='right')) - 1
+        if pos < 0 or (int(self.keys[pos]) >> _DAY_BITS) != i:
+            return np.nan
+        return float(self.values[pos])
+
+    def lookup_many(self, codes: List[str], dates) -> np.ndarray:
+        """
+        批量查询多个(股票, 日期)对的最新值
+
+        Args:
+            codes: 股票代码序列
+            dates: 日期序列，与codes等长；也可以是单个日期，对所有股票使用同一日期
+
+        Returns:
+            np.ndarray: float64数组，不存在时为NaN
+        """
+        codes = list(codes)
+        if np.ndim(dates) == 0:
+            dates = [dates] * len(codes)
+        code_idx = np.array([self.code_pos.get(code, -1) for code in codes], dtype='int64')
+        days = _to_days(dates)
+        result = np.full(len(codes), np.nan)
+        ok = (code_idx >= 0) & ~np.isnat(days)
+        if not ok.any() or len(self.keys) == 0:
+            return result
+        keys = self._make_keys(code_idx[ok], days[ok].astype('int64'))
+        pos = np.searchsorted(self.keys, keys, side='right') - 1
+        hit = (pos >= 0) & ((self.keys[np.maximum(pos, 0)] >> _DAY_BITS) == code_idx[ok])
+        out = np.full(len(keys), np.nan)
+        out[hit] = self.values[pos[hit]]
+        result[ok] = out
+        return result
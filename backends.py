@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据库后端
+功能：
+1. 按配置中的backend字段（mysql或sqlite）创建连接，默认mysql
+2. SQLite连接包装为与pymysql一致的接口：cursor()可作为上下文管理器、使用%s占位符、
+   默认返回dict行（DictCursor），传入SSCursor等元组游标类时返回元组行
+3. 为SQLite注册MySQL查询中用到的year()、pow()、crc32()、concat_ws()函数，使仓库、策略执行器和导入脚本的SQL在两种后端上通用
+
+SQLite配置示例：
+    SQLITE_CONFIG = {'backend': 'sqlite', 'path': 'stock.db'}
+"""
+
+import re
+import math
+import zlib
+import sqlite3
+import logging
+
+import numpy as np
+import pymysql
+
+from columnar_fetch import FAST_CONVERSIONS
+
+logger = logging.getLogger(__name__)
+
+# pymysql风格的占位符：%s为参数，%%为字面量%
+_PLACEHOLDER = re.compile(r"%([%s])")
+
+# NumPy标量作为参数写入SQLite
+sqlite3.register_adapter(np.int64, int)
+sqlite3.register_adapter(np.int32, int)
+sqlite3.register_adapter(np.float32, float)
+sqlite3.register_adapter(np.bool_, bool)
+
+
+def _sqlite_year(value):
+    if value is None:
+        return None
+    try:
+        return int(str(value)[:4])
+    except ValueError:
+        return None
+
+
+def _sqlite_crc32(value):
+    if value is None:
+        return None
+    return zlib.crc32(str(value).encode('utf-8'))
+
+
+def _sqlite_concat_ws(sep, *values):
+    return str(sep).join(str(v) for v in values if v is not None)
+
+
+def _sqlite_pow(x, y):
+    if x is None or y is None:
+        return None
+    try:
+        return math.pow(x, y)
+    except (ValueError, OverflowError):
+        return None
+
+
+class SQLiteCursor:
+    """SQLite游标包装类，接口与pymysql游标一致"""
+
+    def __init__(self, cursor: sqlite3.Cursor, as_dict: bool = True):
+        self._cursor = cursor
+        self._as_dict = as_dict
+
+    @staticmethod
+    def translate(sql: str, has_params: bool) -> str:
+        """将pymysql的%s占位符转换为SQLite的?；与pymysql一致，只有传入参数时才处理%%"""
+        if not has_params:
+            return sql
+        return _PLACEHOLDER.sub(lambda m: '?' if m.group(1) == 's' else '%', sql)
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self) -> int:
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    def _row(self, row):
+        if row is None or not self._as_dict:
+            return row
+        return {desc[0]: value for desc, value in zip(self._cursor.description, row)}
+
+    def execute(self, sql: str, params=None) -> int:
+        self._cursor.execute(self.translate(sql, params is not None), tuple(params) if params is not None else ())
+        return self._cursor.rowcount
+
+    def executemany(self, sql: str, seq_of_params) -> int:
+        self._cursor.executemany(self.translate(sql, True), [tuple(p) for p in seq_of_params])
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+
+    def fetchmany(self, size: int = None):
+        rows = self._cursor.fetchmany(size) if size is not None else self._cursor.fetchmany()
+        return [self._row(r) for r in rows] if self._as_dict else rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        return [self._row(r) for r in rows] if self._as_dict else rows
+
+    def close(self):
+        self._cursor.close()
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class SQLiteConnection:
+    """SQLite连接包装类，接口与pymysql连接一致"""
+
+    def __init__(self, path: str):
+        """
+        打开SQLite数据库文件
+
+        Args:
+            path: 数据库文件路径
+        """
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.create_function('year', 1, _sqlite_year, deterministic=True)
+        self._conn.create_function('pow', 2, _sqlite_pow, deterministic=True)
+        self._conn.create_function('crc32', 1, _sqlite_crc32, deterministic=True)
+        self._conn.create_function('concat_ws', -1, _sqlite_concat_ws, deterministic=True)
+
+    def cursor(self, cursorclass=None) -> SQLiteCursor:
+        """
+        创建游标
+
+        Args:
+            cursorclass: pymysql游标类，为None或DictCursor系列时返回dict行，否则返回元组行
+        """
+        as_dict = cursorclass is None or issubclass(cursorclass, pymysql.cursors.DictCursorMixin)
+        return SQLiteCursor(self._conn.cursor(), as_dict)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def ping(self, reconnect: bool = True):
+        self._conn.execute("SELECT 1")
+
+    def close(self):
+        self._conn.close()
+
+
+class MySQLBackend:
+    """MySQL后端"""
+
+    name = 'mysql'
+    # 连接断开时抛出的异常，仓库和连接池据此丢弃连接并重试
+    disconnect_errors = (pymysql.err.OperationalError,)
+
+    def __init__(self, db_config: dict):
+        self.db_config = db_config
+
+    def connect(self):
+        """新建一个数据库连接，DECIMAL解码为float、日期保持为字符串"""
+        return pymysql.connect(
+            host=self.db_config.get('host', 'localhost'),
+            port=self.db_config.get('port', 3306),
+            user=self.db_config.get('user', 'root'),
+            password=self.db_config.get('password', ''),
+            database=self.db_config.get('database', 'stock'),
+            charset='utf8mb4',
+            cursorclass=pymysql.cursors.DictCursor,
+            conv=FAST_CONVERSIONS
+        )
+
+    def table_exists(self, cursor, table: str) -> bool:
+        cursor.execute("SHOW TABLES LIKE %s", (table,))
+        return cursor.fetchone() is not None
+
+
+class SQLiteBackend:
+    """SQLite后端，数据库为本地单个文件"""
+
+    name = 'sqlite'
+    disconnect_errors = ()
+
+    def __init__(self, db_config: dict):
+        self.db_config = db_config
+        self.path = db_config.get('path', 'stock.db')
+
+    def connect(self) -> SQLiteConnection:
+        return SQLiteConnection(self.path)
+
+    def table_exists(self, cursor, table: str) -> bool:
+        cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = %s", (table,))
+        return cursor.fetchone() is not None
+
+
+BACKENDS = {
+    MySQLBackend.name: MySQLBackend,
+    SQLiteBackend.name: SQLiteBackend,
+}
+
+
+def create_backend(db_config: dict):
+    """
+    按配置创建数据库后端
+
+    Args:
+        db_config: 数据库配置字典，backend字段为mysql（默认）或sqlite
+
+    Returns:
+        MySQLBackend或SQLiteBackend: 数据库后端
+    """
+    name = db_config.get('backend', 'mysql')
+    if name not in BACKENDS:
+        raise ValueError(f"不支持的数据库后端: {name}")
+    return BACKENDS[name](db_config)
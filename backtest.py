@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多日期回测引擎
+功能：
+1. 一次性加载回测区间内全部报表历史、年报现金流以及收盘价、股本、TTM利润的as-of索引
+2. 按日期顺序推进，每只股票最近12个季度的滚动窗口只在有新的Accper变为可见时增量更新
+3. 报表窗口和市场平均值所在报告期都没有变化时直接复用上一次的选股结果
+4. 买入评估的基本面输入（净资产、TTM净利润、TTM自由现金流、折现值）按报表窗口和年份缓存，
+   每天只重新计算依赖股价的pb、市盈率、市现率和市值/折现值
+5. trigger模式下为候选股票解出买入条件成立的价格区间，之后用收盘价比较区间，不再计算估值指标；
+   市场平均pb、股本、TTM利润或往年股价变化的股票重新求解，结果与buy模式一致
+6. 每个日期的结果可选地通过ResultWriter写入sel_stocks、trade_stocks表；执行器设置了进度账本时，
+   每个日期提交后记录进度，接续运行时跳过已完成的日期
+
+用法：
+    python backtest.py sel 2023-12-31 2025-09-30 --freq Q
+    python backtest.py buy 2024-01-01 2024-03-30
+    python backtest.py trigger 2024-01-01 2024-03-30
+"""
+
+import time
+import logging
+import argparse
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+from batch_engine import (evaluate_selection_batch, buy_fundamentals_batch, evaluate_buy_prices,
+                          buy_trigger_inputs, buy_price_triggers, classify_prices)
+from miller_value import FinancialDataRepository, MillerStrategyRunner
+
+logger = logging.getLogger(__name__)
+
+
+class RollingPanel:
+    """单张报表的滚动面板：每只股票保留截止日期前最近last_n个季度，随日期推进增量更新"""
+
+    def __init__(self, history: pd.DataFrame, last_n: int = 12):
+        """
+        初始化滚动面板
+
+        Args:
+            history: get_statement_history返回的全部报表数据
+            last_n: 每只股票保留的季度数量
+        """
+        self.last_n = last_n
+        if history.empty:
+            self._rows = history
+            self._accper = np.array([], dtype=str)
+        else:
+            self._rows = history.sort_values('Accper', kind='stable').reset_index(drop=True)
+            self._accper = self._rows['Accper'].to_numpy(dtype=str)
+        self._cursor = 0  # _rows中已经可见的行数
+        self._window = self._rows.iloc[:0]
+        self.panel = pd.DataFrame()
+        self.end_date = None
+
+    def advance(self, end_date: str) -> bool:
+        """
+        推进到end_date，把Accper <= end_date的新行并入窗口
+
+        Args:
+            end_date: 日期（格式：YYYY-MM-DD），必须不早于上一次推进的日期
+
+        Returns:
+            bool: 窗口发生变化时返回True
+        """
+        if self.end_date is not None and end_date < self.end_date:
+            raise ValueError(f"回测日期必须递增: {end_date} < {self.end_date}")
+        self.end_date = end_date
+        stop = int(np.searchsorted(self._accper, end_date, side='right'))
+        if stop == self._cursor:
+            return False
+        new_rows = self._rows.iloc[self._cursor:stop]
+        self._cursor = stop
+        window = pd.concat([self._window, new_rows], ignore_index=True)
+        window = window.sort_values(['Stkcd', 'Accper'], ascending=[True, False], kind='stable')
+        self._window = window.groupby('Stkcd', sort=False).head(self.last_n)
+        self.panel = self._window.set_index(['Stkcd', 'Accper'])
+        return True
+
+
+class BacktestEngine:
+    """回测引擎类，在一组递增的日期上复用已加载的历史数据执行选股和买入评估"""
+
+    def __init__(self, runner: MillerStrategyRunner, write: bool = True):
+        """
+        初始化回测引擎
+
+        Args:
+            runner: 策略执行器，使用其仓库、策略和结果写入器
+            write: 是否把每个日期的结果写入sel_stocks、trade_stocks表
+        """
+        self.runner = runner
+        self.repo = runner.repo
+        self.strategy = runner.strategy
+        self.write = write
+        self.panels: Dict[str, RollingPanel] = {}
+        self.cash_annual = None
+        self.stock_codes = None
+        self._version = 0  # 报表窗口每变化一次加1
+        self._selection_key = None
+        self._selection = None
+        self._fundamentals_key = None
+        self._fundamentals = None
+        self._triggers = None
+        self._trigger_market = None  # 求解价格区间时的(市场平均pb, 存款利率, 通胀率)
+        self._trigger_inputs = None  # 求解价格区间时每只股票的buy_trigger_inputs
+
+    def load(self, end_date: str):
+        """
+        一次性加载截止到回测最后一天的报表历史和as-of索引
+
+        Args:
+            end_date: 回测的最后一个日期
+        """
+        start = time.perf_counter()
+        for table in self.repo.STATEMENT_TABLES:
+            columns = self.strategy.required_columns(table)
+            self.panels[table] = RollingPanel(self.repo.get_statement_history(table, end_date, columns))
+        self.cash_annual = self.repo.get_annual_cash_flows()
+        self.repo.load_asof_indexes()
+        self.stock_codes = self.runner.get_stock_codes()
+        self._selection_key = None
+        self._fundamentals_key = None
+        logger.info(f"回测数据加载完成, 截止日期={end_date}, 耗时{time.perf_counter() - start:.2f}秒")
+
+    def _commit(self, stock_codes: List[str], end_date: str) -> bool:
+        """提交end_date的结果，成功后在进度账本中记录这些股票已完成，失败时计入runner.unfinished"""
+        if not self.runner.writer.commit():
+            self.runner.unfinished += len(stock_codes)
+            return False
+        if self.runner.ledger is not None:
+            self.runner.ledger.mark(stock_codes, end_date)
+        return True
+
+    def advance(self, end_date: str) -> bool:
+        """
+        把各报表窗口推进到end_date
+
+        Args:
+            end_date: 日期（格式：YYYY-MM-DD），必须不早于上一次推进的日期，否则RollingPanel.advance抛出ValueError
+
+        Returns:
+            bool: 任一报表窗口发生变化时返回True
+        """
+        changed = any([panel.advance(end_date) for panel in self.panels.values()])
+        if changed:
+            self._version += 1
+        return changed
+
+    def buy_fundamentals(self, stock_codes: List[str], end_date: str) -> pd.DataFrame:
+        """
+        返回候选股票的买入基本面输入，报表窗口和年份都未变化时只为新出现的股票计算
+
+        Args:
+            stock_codes: 股票代码列表
+            end_date: 日期（格式：YYYY-MM-DD），调用前已推进到该日期
+
+        Returns:
+            pd.DataFrame: buy_fundamentals_batch的结果，行顺序与stock_codes一致
+        """
+        key = (self._version, end_date[:4])
+        if key != self._fundamentals_key:
+            self._fundamentals = None
+            self._triggers = None
+            self._fundamentals_key = key
+        known = self._fundamentals.index if self._fundamentals is not None else pd.Index([])
+        missing = [str(c) for c in stock_codes if str(c) not in known]
+        if missing or self._fundamentals is None:
+            computed = buy_fundamentals_batch(
+                missing, end_date, self.panels['profit'].panel, self.panels['balance'].panel,
+                self.panels['cash_flow'].panel, self.cash_annual, self.repo.get_discount_rate())
+            self._fundamentals = computed if self._fundamentals is None else pd.concat([self._fundamentals, computed])
+        return self._fundamentals.loc[[str(c) for c in stock_codes]]
+
+    def select(self, end_date: str) -> pd.DataFrame:
+        """
+        推进到end_date并评估选股条件，报表窗口和报告期都未变化时复用上一次的结果
+
+        Args:
+            end_date: 日期（格式：YYYY-MM-DD）
+
+        Returns:
+            pd.DataFrame: 与MillerValueStrategy.evaluate_selection_batch相同的条件矩阵
+        """
+        changed = self.advance(end_date)
+        key = self.repo.resolve_quarter(end_date)
+        if changed or self._selection is None or key != self._selection_key:
+            self._selection = evaluate_selection_batch(
+                self.panels['profit'].panel, self.panels['balance'].panel, self.repo.get_roc_avg(end_date),
+                self.repo.get_deposit_rate(), self.repo.get_rooc_avg(end_date),
+                self.repo.get_avg_inventory_turnover(end_date), codes=self.stock_codes)
+            self._selection_key = key
+        if self.write:
+            for stock_code in self._selection.index[self._selection['selected']]:
+                self.runner.writer.add_sel_stock(stock_code, end_date)
+            self._commit(self.stock_codes, end_date)
+        return self._selection
+
+    def buy(self, end_date: str, stock_codes: List[str] = None) -> pd.DataFrame:
+        """
+        推进到end_date并评估候选股票的买入条件，基本面输入取自缓存，只重新计算依赖股价的部分
+
+        Args:
+            end_date: 日期（格式：YYYY-MM-DD）
+            stock_codes: 候选股票，默认取sel_stocks表中end_date之前最近一期的入选股票
+
+        Returns:
+            pd.DataFrame: 与MillerValueStrategy.evaluate_buy_batch相同的估值指标和条件矩阵
+        """
+        self.advance(end_date)
+        if stock_codes is None:
+            stock_codes = self.runner.get_sel_codes(end_date)
+        result = evaluate_buy_prices(
+            self.buy_fundamentals(stock_codes, end_date), end_date, self.repo.price_index, self.repo.shares_index,
+            self.repo.profit_ttm_index, self.repo.get_pb_avg(end_date), self.repo.get_deposit_rate(end_date),
+            self.repo.get_inflation_rate(end_date))
+        if self.write:
+            for stock_code, row in result.iterrows():
+                if row['count'] >= 3:
+                    self.runner.writer.add_trade_stock(stock_code, end_date, row['price'], '1', int(row['count']))
+                elif row['count'] <= 1:
+                    self.runner.writer.add_trade_stock(stock_code, end_date, row['price'], '0', int(row['count']))
+            self._commit(list(result.index), end_date)
+        return result
+
+    def buy_triggers(self, stock_codes: List[str], end_date: str) -> pd.DataFrame:
+        """
+        返回候选股票在end_date的买入价格区间
+
+        区间依赖的市场平均pb、利率、股本、TTM利润和往年股价每天按as-of重新查询，与上次求解时不同的股票
+        （以及新出现的股票）重新求解，其余复用；报表窗口或年份变化时全部重新求解
+
+        Args:
+            stock_codes: 股票代码列表
+            end_date: 日期（格式：YYYY-MM-DD），调用前已推进到该日期
+
+        Returns:
+            pd.DataFrame: buy_price_triggers的结果，行顺序与stock_codes一致
+        """
+        fundamentals = self.buy_fundamentals(stock_codes, end_date)
+        codes = list(dict.fromkeys(fundamentals.index))
+        market = np.array([self.repo.get_pb_avg(end_date), self.repo.get_deposit_rate(end_date),
+                           self.repo.get_inflation_rate(end_date)], dtype='float64')
+        inputs = buy_trigger_inputs(codes, end_date, self.repo.price_index, self.repo.shares_index,
+                                    self.repo.profit_ttm_index)
+        if self._triggers is None or not np.array_equal(market, self._trigger_market, equal_nan=True):
+            self._triggers = None
+            self._trigger_inputs = None
+            stale = np.ones(len(codes), dtype=bool)
+        else:
+            cached = self._trigger_inputs.reindex(inputs.index).to_numpy()
+            current = inputs.to_numpy()
+            same = (cached == current) | (np.isnan(cached) & np.isnan(current))
+            stale = ~inputs.index.isin(self._trigger_inputs.index) | ~same.all(axis=1)
+        if stale.any() or self._triggers is None:
+            stale_codes = inputs.index[stale]
+            solved = buy_price_triggers(
+                fundamentals.loc[stale_codes], end_date, self.repo.price_index, self.repo.shares_index,
+                self.repo.profit_ttm_index, market[0], market[1], market[2], inputs=inputs.loc[stale_codes])
+            if self._triggers is None:
+                self._triggers, self._trigger_inputs = solved, inputs.loc[stale_codes]
+            else:
+                self._triggers = pd.concat([self._triggers.drop(stale_codes, errors='ignore'), solved])
+                self._trigger_inputs = pd.concat([self._trigger_inputs.drop(stale_codes, errors='ignore'),
+                                                  inputs.loc[stale_codes]])
+            self._trigger_market = market
+        return self._triggers.loc[fundamentals.index]
+
+    def buy_by_triggers(self, end_date: str, stock_codes: List[str] = None) -> pd.DataFrame:
+        """
+        推进到end_date并用价格区间评估候选股票：区间的输入未变化时复用，之后只查收盘价做比较
+
+        Args:
+            end_date: 日期（格式：YYYY-MM-DD）
+            stock_codes: 候选股票，默认取sel_stocks表中end_date之前最近一期的入选股票
+
+        Returns:
+            pd.DataFrame: 以股票代码为索引，包含price、count、buy_below、sell_from
+        """
+        self.advance(end_date)
+        if stock_codes is None:
+            stock_codes = self.runner.get_sel_codes(end_date)
+        triggers = self.buy_triggers(stock_codes, end_date)
+        price = self.repo.price_index.lookup_many(list(triggers.index), end_date)
+        result = pd.DataFrame({'price': price, 'count': classify_prices(triggers, price),
+                               'buy_below': triggers['buy_below'], 'sell_from': triggers['sell_from']},
+                              index=triggers.index)
+        if self.write:
+            for stock_code, row in result.iterrows():
+                if row['count'] >= 3:
+                    self.runner.writer.add_trade_stock(stock_code, end_date, row['price'], '1', int(row['count']))
+                elif row['count'] <= 1:
+                    self.runner.writer.add_trade_stock(stock_code, end_date, row['price'], '0', int(row['count']))
+            self._commit(list(result.index), end_date)
+        return result
+
+    def run(self, dates: List[str], mode: str = 'sel', stock_codes: List[str] = None) -> Dict[str, pd.DataFrame]:
+        """
+        在一组日期上依次执行选股或买入评估
+
+        Args:
+            dates: 日期列表（格式：YYYY-MM-DD），按升序执行
+            mode: sel为选股评估，buy为买入评估，trigger为按价格区间的买入评估
+            stock_codes: 买入评估的候选股票，默认每个日期从sel_stocks表读取
+
+        Returns:
+            Dict[str, pd.DataFrame]: 每个日期的评估结果；提交失败的股票数累加到runner.unfinished
+        """
+        if mode not in ('sel', 'buy', 'trigger'):
+            raise ValueError(f"不支持的回测模式: {mode}")
+        dates = sorted(dates)
+        if not dates:
+            return {}
+        self.load(dates[-1])
+        results = {}
+        start = time.perf_counter()
+        ledger = self.runner.ledger if self.write else None
+        for end_date in dates:
+            if ledger is not None and ledger.done(end_date):
+                # 接续运行时跳过已完成的日期：选股按全部股票判断，买入评估的日期有记录即视为完成
+                codes = self.stock_codes if mode == 'sel' else stock_codes
+                if codes is None or not ledger.pending(codes, end_date):
+                    logger.info(f"跳过已完成的日期: {end_date}")
+                    continue
+            if mode == 'sel':
+                results[end_date] = self.select(end_date)
+            elif mode == 'buy':
+                results[end_date] = self.buy(end_date, stock_codes)
+            else:
+                results[end_date] = self.buy_by_triggers(end_date, stock_codes)
+        logger.info(f"回测完成: 模式={mode}, {len(dates)}个日期, 耗时{time.perf_counter() - start:.2f}秒, "
+                    f"未完成{self.runner.unfinished}只")
+        return results
+
+
+def main():
+    """主函数：按日期区间执行回测"""
+    from config import DB_CONFIG
+
+    parser = argparse.ArgumentParser(description='米勒策略多日期回测')
+    parser.add_argument('mode', choices=['sel', 'buy', 'trigger'],
+                        help='sel为选股评估，buy为买入评估，trigger为按价格区间的买入评估')
+    parser.add_argument('start', help='开始日期，格式YYYY-MM-DD')
+    parser.add_argument('end', help='结束日期，格式YYYY-MM-DD')
+    parser.add_argument('--freq', default='D', help='日期频率（pandas频率字符串），默认D为每天')
+    parser.add_argument('--dry-run', action='store_true', help='只计算不写入结果表')
+    args = parser.parse_args()
+
+    repo = FinancialDataRepository(DB_CONFIG)
+    if not repo.connect():
+        return
+    try:
+        dates = [d.strftime('%Y-%m-%d') for d in pd.date_range(args.start, args.end, freq=args.freq)]
+        engine = BacktestEngine(MillerStrategyRunner(repo), write=not args.dry_run)
+        engine.run(dates, args.mode)
+    finally:
+        repo.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,558 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量（向量化）计算引擎
+功能：
+1. 由预加载的股价、股本、利润序列批量计算五年平均市盈率，支持一组股票在单个日期或整个日期网格上计算
+2. 由全市场报表面板一次计算所有股票的季度roc、rooc、存货周转率及选股条件A-G
+3. 由报表面板和as-of索引一次计算候选股票的pb、TTM市盈率、TTM市现率、五年平均市盈率、折现比及买入条件A-E；
+   只随报告期变化的基本面输入（净资产、TTM净利润、TTM自由现金流、折现值）与依赖股价的部分分两步计算
+"""
+
+import logging
+from typing import List
+
+import numpy as np
+import pandas as pd
+
+from asof_index import AsOfIndex
+
+logger = logging.getLogger(__name__)
+
+
+def shift_years(date: str, years: int) -> str:
+    """
+    将'YYYY-MM-DD'格式的日期向前平移若干年
+
+    非闰年没有2月29日，此时返回2月28日；对按字符串比较的as-of查询两者等价
+
+    Args:
+        date: 日期，格式为'YYYY-MM-DD'
+        years: 向前平移的年数
+
+    Returns:
+        str: 平移后的日期
+    """
+    year = int(date[:4]) - years
+    month_day = date[5:]
+    if month_day == '02-29' and not (year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)):
+        month_day = '02-28'
+    return f"{year}-{month_day}"
+
+
+def build_ttm_index(profit: pd.DataFrame, column: str = 'ParNetProfit', n: int = 4) -> AsOfIndex:
+    """
+    构建TTM利润的as-of索引：每个(Stkcd, Accper)对应该报告期及之前共n个季度的利润之和
+
+    与SQL中“order by Accper desc limit 4”后sum的口径一致：不足n个季度时对已有季度求和，NULL不计入
+
+    Args:
+        profit: 利润表数据，包含Stkcd、Accper和column列
+        column: 利润列名
+        n: 季度数
+
+    Returns:
+        AsOfIndex: 查询某日期的TTM利润时，取该日期当日或之前最近报告期的值
+    """
+    if profit.empty:
+        return AsOfIndex([], [], [])
+    df = profit[['Stkcd', 'Accper', column]].copy()
+    df['Accper'] = df['Accper'].astype(str)
+    df[column] = pd.to_numeric(df[column], errors='coerce')
+    df = df.sort_values(['Stkcd', 'Accper'], kind='mergesort').reset_index(drop=True)
+    ttm = df.groupby('Stkcd', sort=False)[column].rolling(n, min_periods=1).sum().reset_index(level=0, drop=True)
+    return AsOfIndex(df['Stkcd'].to_numpy(), df['Accper'].to_numpy(), ttm.sort_index().to_numpy())
+
+
+def five_year_avg_pe(codes: List[str], end_dates, price_index: AsOfIndex, shares_index: AsOfIndex,
+                     ttm_index: AsOfIndex) -> np.ndarray:
+    """
+    批量计算五年平均市盈率：最近五年同月同日的市值/TTM利润的平均值
+
+    与FinancialDataRepository.get_five_year_avg_pe口径一致：任一年缺少市值或利润、或利润为0时结果为NaN
+
+    Args:
+        codes: 股票代码序列
+        end_dates: 与codes等长的日期序列，或对所有股票使用的单个日期
+        price_index: 收盘价as-of索引
+        shares_index: 总股本as-of索引
+        ttm_index: build_ttm_index构建的TTM利润索引
+
+    Returns:
+        np.ndarray: 与codes等长的五年平均市盈率
+    """
+    codes = list(codes)
+    if isinstance(end_dates, str):
+        end_dates = [end_dates] * len(codes)
+    end_dates = [str(d) for d in end_dates]
+    pe = np.zeros(len(codes))
+    for year in range(5):
+        dates = [shift_years(d, year) for d in end_dates]
+        cap = price_index.lookup_many(codes, dates) * shares_index.lookup_many(codes, dates)
+        profit = ttm_index.lookup_many(codes, dates)
+        pe = pe + cap / np.where(profit == 0, np.nan, profit)
+    return pe / 5
+
+
+def five_year_avg_pe_grid(codes: List[str], dates: List[str], price_index: AsOfIndex, shares_index: AsOfIndex,
+                          ttm_index: AsOfIndex) -> pd.DataFrame:
+    """
+    在日期网格上批量计算五年平均市盈率
+
+    Args:
+        codes: 股票代码列表
+        dates: 日期列表
+        price_index: 收盘价as-of索引
+        shares_index: 总股本as-of索引
+        ttm_index: TTM利润索引
+
+    Returns:
+        pd.DataFrame: 行为日期、列为股票代码的五年平均市盈率
+    """
+    codes = list(codes)
+    dates = list(dates)
+    flat_codes = np.tile(np.asarray(codes, dtype=object), len(dates))
+    flat_dates = np.repeat(np.asarray(dates, dtype=object), len(codes))
+    values = five_year_avg_pe(flat_codes, flat_dates, price_index, shares_index, ttm_index)
+    return pd.DataFrame(values.reshape(len(dates), len(codes)), index=dates, columns=codes)
+
+
+# 选股条件A-G
+SELECTION_CRITERIA = ['A', 'B', 'C', 'D', 'E', 'F', 'G']
+
+# 各季度指标用到的利润表、资产负债表列，与MillerValueStrategy.compute_*_quarterly一致
+_ROC_PROFIT = ['OpProfit', 'IncomeTax', 'ProfitBefTax']
+_ROC_BALANCE = ['ParOwnEquity', 'ShortBorrow', 'NonCurLia1Y', 'LTBorrow', 'BondPay']
+_ROOC_BALANCE = ['AcctRecNet', 'PrepayNet', 'InventNet', 'NotesRecNet',
+                 'AcctPay', 'AdvFromCust', 'NotesPay', 'EmpBenefitPay', 'TaxPay']
+_IT_PROFIT = ['OpCost']
+_IT_BALANCE = ['InventNet']
+
+
+def _ranked_panel(panel: pd.DataFrame, columns: List[str]) -> pd.DataFrame:
+    """
+    将面板数据展开为(Stkcd, rank)行，rank为股票内按面板顺序（Accper降序）的位置，缺失列为NaN
+
+    逐只股票评估时slice_panel返回的DataFrame以位置为索引，利润表和资产负债表按位置对齐，这里用rank复现该对齐方式
+    """
+    if panel is None or panel.empty:
+        return pd.DataFrame({'Stkcd': pd.Series(dtype=object), 'rank': pd.Series(dtype='int64')})
+    df = panel.reset_index()
+    out = pd.DataFrame({'Stkcd': df['Stkcd'].astype(str).to_numpy(),
+                        'rank': df.groupby('Stkcd', sort=False).cumcount().to_numpy()})
+    for col in columns:
+        if col in df.columns:
+            out[col] = pd.to_numeric(df[col], errors='coerce').to_numpy(dtype='float64')
+    return out
+
+
+def _window_reduce(values: np.ndarray, codes: np.ndarray, rank: np.ndarray, length: np.ndarray,
+                   start: np.ndarray, stop: np.ndarray, how: str) -> pd.Series:
+    """按股票对rank落在[start, stop)内的非NaN值求min或max，窗口内没有值时为NaN"""
+    mask = (rank >= start) & (rank < stop) & (rank < length)
+    s = pd.Series(np.where(mask, values, np.nan))
+    grouped = s.groupby(codes, sort=False)
+    return grouped.min() if how == 'min' else grouped.max()
+
+
+def evaluate_selection_batch(profit_panel: pd.DataFrame, balance_panel: pd.DataFrame, avg_roc: float,
+                             deposit: float, avg_rooc: float, industry_it: float,
+                             codes: List[str] = None) -> pd.DataFrame:
+    """
+    对全部股票一次计算选股条件A-G
+
+    与MillerValueStrategy.evaluate_selection逐只股票的结果完全一致：
+    利润表与资产负债表按股票内位置对齐，近四季取最后4个位置，5~8季取tail(8).head(4)
+
+    Args:
+        profit_panel: get_statement_panel('profit', ...)返回的面板数据
+        balance_panel: get_statement_panel('balance', ...)返回的面板数据
+        avg_roc: 市场平均roc
+        deposit: 一年期存款利率
+        avg_rooc: 市场平均rooc
+        industry_it: 市场平均存货周转率
+        codes: 需要评估的股票代码，默认为两个面板中出现的全部股票
+
+    Returns:
+        pd.DataFrame: 以股票代码为索引，列为A-G各条件及最终结果selected的布尔矩阵
+    """
+    p = _ranked_panel(profit_panel, _ROC_PROFIT + _IT_PROFIT)
+    b = _ranked_panel(balance_panel, _ROC_BALANCE + _ROOC_BALANCE)
+    if codes is None:
+        codes = list(dict.fromkeys(p['Stkcd'].tolist() + b['Stkcd'].tolist()))
+    codes = [str(c) for c in codes]
+
+    # 资产负债表内按位置取上一行存货（与Series.shift(1)一致）
+    if 'InventNet' in b.columns:
+        b['PrevInventNet'] = b.groupby('Stkcd', sort=False)['InventNet'].shift(1)
+    m = p.merge(b, on=['Stkcd', 'rank'], how='outer')
+    n_profit = p.groupby('Stkcd').size()
+    n_balance = b.groupby('Stkcd').size()
+    stk = m['Stkcd'].to_numpy()
+    rank = m['rank'].to_numpy(dtype='int64')
+
+    def col(name):
+        return m[name].to_numpy(dtype='float64') if name in m.columns else np.full(len(m), np.nan)
+
+    def length(profit_cols, balance_cols):
+        # 逐只股票计算时，只有用到的列存在才占据该表的行数
+        n = n_profit if any(c in p.columns for c in profit_cols) else n_profit * 0
+        k = n_balance if any(c in b.columns for c in balance_cols) else n_balance * 0
+        total = pd.concat([n, k], axis=1).fillna(0).max(axis=1)
+        return total.reindex(stk).fillna(0).to_numpy(dtype='int64')
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        total_profit = col('ProfitBefTax')
+        tax_rate = np.clip(col('IncomeTax') / np.where(total_profit == 0, np.nan, total_profit), 0.0, 1.0)
+        nopat = col('OpProfit') * (1.0 - tax_rate)
+        invested = col('ParOwnEquity') + col('ShortBorrow') + col('NonCurLia1Y') + col('LTBorrow') + col('BondPay')
+        roc = nopat / np.where(invested == 0, np.nan, invested)
+        nowc = ((col('AcctRecNet') + col('PrepayNet') + col('InventNet') + col('NotesRecNet'))
+                - (col('AcctPay') + col('AdvFromCust') + col('NotesPay') + col('EmpBenefitPay') + col('TaxPay')))
+        rooc = nopat / np.where(nowc == 0, np.nan, nowc)
+        avg_inv = (col('PrevInventNet') + col('InventNet')) / 2.0
+        it = col('OpCost') / np.where(avg_inv == 0, np.nan, avg_inv)
+
+    metrics = {}
+    for name, values, profit_cols, balance_cols in (
+            ('roc', roc, _ROC_PROFIT, _ROC_BALANCE),
+            ('rooc', rooc, _ROC_PROFIT, _ROOC_BALANCE),
+            ('it', it, _IT_PROFIT, _IT_BALANCE)):
+        L = length(profit_cols, balance_cols)
+        prev_start = np.maximum(0, L - 8)
+        prev_stop = prev_start + np.minimum(4, np.minimum(8, L))
+        metrics[f'{name}_4_min'] = _window_reduce(values, stk, rank, L, L - 4, L, 'min')
+        metrics[f'{name}_5_8_max'] = _window_reduce(values, stk, rank, L, prev_start, prev_stop, 'max')
+    stats = pd.DataFrame(metrics).reindex(codes)
+
+    def value(x):
+        return np.nan if x is None else x
+
+    with np.errstate(invalid='ignore'):
+        result = pd.DataFrame({
+            'A': stats['roc_4_min'] > value(avg_roc),
+            'B': stats['roc_4_min'] > value(deposit),
+            'C': stats['roc_4_min'] > stats['roc_5_8_max'],
+            'D': stats['rooc_4_min'] > value(avg_rooc),
+            'E': stats['rooc_4_min'] > stats['rooc_5_8_max'],
+            'F': stats['it_4_min'] > value(industry_it),
+            'G': stats['it_4_min'] > stats['it_5_8_max'],
+        }, index=codes)
+    result['selected'] = result[SELECTION_CRITERIA].all(axis=1)
+    return result
+
+
+# 买入条件A-E
+BUY_CRITERIA = ['A', 'B', 'C', 'D', 'E']
+
+
+def _last_values(panel: pd.DataFrame, values: pd.Series, codes: List[str], k: int) -> np.ndarray:
+    """
+    取每只股票面板中最后k个位置（即Accper降序排列时最早的k个季度）的值，与Series.tail(k)一致
+
+    Returns:
+        np.ndarray: 形状为(len(codes), k)的矩阵，按位置顺序排列，不足k个时前面用NaN补齐
+    """
+    out = np.full((len(codes), k), np.nan)
+    if panel is None or panel.empty or values is None:
+        return out
+    stk = panel.index.get_level_values('Stkcd').astype(str)
+    stk_series = pd.Series(stk)
+    rank = stk_series.groupby(stk_series, sort=False).cumcount().to_numpy()
+    count = stk_series.map(stk_series.value_counts()).to_numpy()
+    row = pd.Index(codes).get_indexer(stk)
+    slot = rank - (count - k)
+    keep = (row >= 0) & (slot >= 0)
+    out[row[keep], slot[keep]] = np.asarray(values, dtype='float64')[keep]
+    return out
+
+
+def _ttm_sum(matrix: np.ndarray) -> np.ndarray:
+    """按位置顺序累加非NaN值，全部为NaN时为NaN，与逐只股票的_ttm_sum一致"""
+    total = np.zeros(matrix.shape[0])
+    for j in range(matrix.shape[1]):
+        total = total + np.where(np.isnan(matrix[:, j]), 0.0, matrix[:, j])
+    return np.where(np.isnan(matrix).all(axis=1), np.nan, total)
+
+
+def _panel_column(panel: pd.DataFrame, column: str):
+    if panel is None or panel.empty or column not in panel.columns:
+        return None
+    return pd.to_numeric(panel[column], errors='coerce')
+
+
+def discounted_fcf_batch(cash_annual: pd.DataFrame, codes: List[str], end_date: str,
+                         discount_rate: float, growth_rate: float = 0.0) -> np.ndarray:
+    """
+    批量计算自由现金流折现值，口径与FinancialDataRepository.get_discounted_10y_fcf一致
+
+    Args:
+        cash_annual: 年报现金流量数据，包含Stkcd、Accper、NetOpCF、AssetPurchase列
+        codes: 股票代码列表
+        end_date: 截止日期
+        discount_rate: 折现率
+        growth_rate: 增长率
+
+    Returns:
+        np.ndarray: 与codes等长的折现值，没有年报数据时为NaN
+    """
+    if cash_annual is None or cash_annual.empty:
+        return np.full(len(codes), np.nan)
+    df = cash_annual[cash_annual['Accper'].astype(str).str.endswith('12-31')]
+    years = int(end_date[:4]) - df['Accper'].astype(str).str[:4].astype(int).to_numpy()
+    fcf = (pd.to_numeric(df['NetOpCF'], errors='coerce').to_numpy(dtype='float64')
+           - pd.to_numeric(df['AssetPurchase'], errors='coerce').to_numpy(dtype='float64'))
+    fcf = fcf * np.power(1.0 + growth_rate, years) / np.power(1.0 + discount_rate, years)
+    total = pd.Series(fcf).groupby(df['Stkcd'].astype(str).to_numpy()).sum(min_count=1)
+    return total.reindex([str(c) for c in codes]).to_numpy(dtype='float64')
+
+
+def buy_fundamentals_batch(codes: List[str], end_date: str, profit_panel: pd.DataFrame, balance_panel: pd.DataFrame,
+                           cash_panel: pd.DataFrame, cash_annual: pd.DataFrame, discount_rate: float) -> pd.DataFrame:
+    """
+    计算买入评估中只随报告期（折现值随年份）变化的基本面输入，回测中可按报告期缓存复用
+
+    Args:
+        codes: 股票代码列表
+        end_date: 截止日期，只用于折现年数
+        profit_panel: 利润表面板数据，需包含ParNetProfit
+        balance_panel: 资产负债表面板数据，需包含ParOwnEquity
+        cash_panel: 现金流量表面板数据，需包含NetOpCF、AssetPurchase
+        cash_annual: 全部年报现金流量数据，用于折现值
+        discount_rate: 折现率
+
+    Returns:
+        pd.DataFrame: 以股票代码为索引，包含equity、np_ttm、fcf_ttm、dcf_10y列
+    """
+    codes = [str(c) for c in codes]
+    equity = _last_values(balance_panel, _panel_column(balance_panel, 'ParOwnEquity'), codes, 1)[:, 0]
+    np_ttm = _ttm_sum(_last_values(profit_panel, _panel_column(profit_panel, 'ParNetProfit'), codes, 4))
+    cfo = _panel_column(cash_panel, 'NetOpCF')
+    capex = _panel_column(cash_panel, 'AssetPurchase')
+    fcf = cfo - capex if cfo is not None and capex is not None else None
+    fcf_ttm = _ttm_sum(_last_values(cash_panel, fcf, codes, 4))
+    dcf = discounted_fcf_batch(cash_annual, codes, end_date, discount_rate, 0.0)
+    return pd.DataFrame({'equity': equity, 'np_ttm': np_ttm, 'fcf_ttm': fcf_ttm, 'dcf_10y': dcf}, index=codes)
+
+
+def evaluate_buy_prices(fundamentals: pd.DataFrame, end_date: str, price_index: AsOfIndex, shares_index: AsOfIndex,
+                        ttm_index: AsOfIndex, market_pb_avg: float, deposit: float, inflation: float) -> pd.DataFrame:
+    """
+    由基本面输入和end_date的股价、股本计算依赖股价的估值指标和买入条件A-E
+
+    Args:
+        fundamentals: buy_fundamentals_batch的结果
+        end_date: 截止日期
+        price_index: 收盘价as-of索引
+        shares_index: 总股本as-of索引
+        ttm_index: build_ttm_index构建的TTM利润索引
+        market_pb_avg: 市场平均pb
+        deposit: 一年期存款利率
+        inflation: 通货膨胀率
+
+    Returns:
+        pd.DataFrame: 以股票代码为索引，包含price、market_cap、pb、pe_ttm、pfcf_ttm、five_year_pe、dcf_10y、
+                      A-E各条件及满足条件数count的结果
+    """
+    codes = list(fundamentals.index)
+    price = price_index.lookup_many(codes, end_date)
+    shares = shares_index.lookup_many(codes, end_date)
+    market_cap = price * shares
+    equity = fundamentals['equity'].to_numpy(dtype='float64')
+    np_ttm = fundamentals['np_ttm'].to_numpy(dtype='float64')
+    fcf_ttm = fundamentals['fcf_ttm'].to_numpy(dtype='float64')
+    dcf = fundamentals['dcf_10y'].to_numpy(dtype='float64')
+
+    def value(x):
+        return np.nan if x is None else float(x)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        bvps = equity / np.where(shares == 0, np.nan, shares)
+        pb = price / np.where(bvps == 0, np.nan, bvps)
+        pe_ttm = market_cap / np.where(np_ttm == 0, np.nan, np_ttm)
+        pfcf_ttm = market_cap / np.where(fcf_ttm == 0, np.nan, fcf_ttm)
+        five_year_pe = five_year_avg_pe(codes, end_date, price_index, shares_index, ttm_index)
+
+        deposit, inflation, market_pb_avg = value(deposit), value(inflation), value(market_pb_avg)
+        result = pd.DataFrame({
+            'price': price, 'market_cap': market_cap, 'pb': pb, 'pe_ttm': pe_ttm, 'pfcf_ttm': pfcf_ttm,
+            'five_year_pe': five_year_pe, 'dcf_10y': dcf,
+            'A': pb < 2.0 * market_pb_avg,
+            'B': (pe_ttm < 1.0 / deposit) if deposit > 0 else np.zeros(len(codes), dtype=bool),
+            'C': pb < five_year_pe,
+            'D': (pfcf_ttm < 1.0 / inflation) if inflation > 0 else np.zeros(len(codes), dtype=bool),
+            'E': (dcf > 0) & (market_cap / np.where(dcf > 0, dcf, np.nan) < 1.0),
+        }, index=codes)
+    result['count'] = result[BUY_CRITERIA].sum(axis=1).astype(int)
+    return result
+
+
+def evaluate_buy_batch(codes: List[str], end_date: str, profit_panel: pd.DataFrame, balance_panel: pd.DataFrame,
+                       cash_panel: pd.DataFrame, cash_annual: pd.DataFrame, price_index: AsOfIndex,
+                       shares_index: AsOfIndex, ttm_index: AsOfIndex, market_pb_avg: float, deposit: float,
+                       inflation: float, discount_rate: float) -> pd.DataFrame:
+    """
+    对一组股票一次计算买入条件A-E，口径与MillerValueStrategy.evaluate_buy一致，
+    等价于buy_fundamentals_batch之后调用evaluate_buy_prices
+
+    Args:
+        codes: 股票代码列表
+        end_date: 截止日期
+        profit_panel: 利润表面板数据，需包含ParNetProfit
+        balance_panel: 资产负债表面板数据，需包含ParOwnEquity
+        cash_panel: 现金流量表面板数据，需包含NetOpCF、AssetPurchase
+        cash_annual: 全部年报现金流量数据，用于折现值
+        price_index: 收盘价as-of索引
+        shares_index: 总股本as-of索引
+        ttm_index: build_ttm_index构建的TTM利润索引
+        market_pb_avg: 市场平均pb
+        deposit: 一年期存款利率
+        inflation: 通货膨胀率
+        discount_rate: 折现率
+
+    Returns:
+        pd.DataFrame: 见evaluate_buy_prices
+    """
+    fundamentals = buy_fundamentals_batch(codes, end_date, profit_panel, balance_panel, cash_panel,
+                                          cash_annual, discount_rate)
+    return evaluate_buy_prices(fundamentals, end_date, price_index, shares_index, ttm_index,
+                               market_pb_avg, deposit, inflation)
+
+
+def _condition_interval(coef: np.ndarray, bound: np.ndarray):
+    """
+    把条件price * coef < bound解为价格区间(low, high)：coef>0时为价格上限，coef<0时为价格下限，
+    coef为0时与价格无关；系数或边界为NaN时条件恒不成立，区间为空(-inf, -inf)
+    """
+    low = np.full(coef.shape, -np.inf)
+    high = np.full(coef.shape, -np.inf)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = bound / coef
+    valid = ~np.isnan(coef) & ~np.isnan(bound)
+    upper = valid & (coef > 0)
+    lower = valid & (coef < 0)
+    always = valid & (coef == 0) & (bound > 0)
+    high[upper] = t[upper]
+    low[lower] = t[lower]
+    high[lower | always] = np.inf
+    return low, high
+
+
+def buy_trigger_inputs(codes: List[str], end_date: str, price_index: AsOfIndex, shares_index: AsOfIndex,
+                       ttm_index: AsOfIndex) -> pd.DataFrame:
+    """
+    取求解买入价格区间时随日期变化的as-of输入：当日股本、当日TTM利润和五年平均市盈率中往年四项之和
+
+    往年四项取end_date向前平移1~4年当日或之前的股价，因此每个交易日都可能变化
+
+    Args:
+        codes: 股票代码列表
+        end_date: 日期
+        price_index: 收盘价as-of索引
+        shares_index: 总股本as-of索引
+        ttm_index: build_ttm_index构建的TTM利润索引
+
+    Returns:
+        pd.DataFrame: 以股票代码为索引，包含shares、ttm_now、past_pe列
+    """
+    codes = [str(c) for c in codes]
+    past_pe = np.zeros(len(codes))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for year in range(1, 5):
+            dates = shift_years(end_date, year)
+            cap = price_index.lookup_many(codes, dates) * shares_index.lookup_many(codes, dates)
+            profit = ttm_index.lookup_many(codes, dates)
+            past_pe = past_pe + cap / np.where(profit == 0, np.nan, profit)
+    return pd.DataFrame({'shares': shares_index.lookup_many(codes, end_date),
+                         'ttm_now': ttm_index.lookup_many(codes, end_date),
+                         'past_pe': past_pe}, index=codes)
+
+
+def buy_price_triggers(fundamentals: pd.DataFrame, end_date: str, price_index: AsOfIndex, shares_index: AsOfIndex,
+                       ttm_index: AsOfIndex, market_pb_avg: float, deposit: float, inflation: float,
+                       inputs: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    基本面、股本、市场平均pb和往年市盈率固定时，买入条件A-E都是股价的线性不等式，
+    直接解出每个条件成立的价格区间，以及满足条件数跨过3（买入）和1（卖出）的价格
+
+    五年平均市盈率中当年一项含当前股价，条件C按pb - 当年市盈率/5 < 往年四项之和/5求解。
+    解出的区间只对end_date有效：市场平均pb、股本、TTM利润或往年股价变化后需重新求解
+
+    Args:
+        fundamentals: buy_fundamentals_batch的结果
+        end_date: 求解所用的日期，股本、往年市盈率取该日期的值
+        price_index: 收盘价as-of索引，只用于往年市盈率
+        shares_index: 总股本as-of索引
+        ttm_index: build_ttm_index构建的TTM利润索引
+        market_pb_avg: 市场平均pb
+        deposit: 一年期存款利率
+        inflation: 通货膨胀率
+        inputs: buy_trigger_inputs的结果，行与fundamentals对应；默认按end_date现场查询
+
+    Returns:
+        pd.DataFrame: 以股票代码为索引，A_low、A_high ... E_low、E_high为各条件成立的开区间；
+                      monotone为各条件都只有价格上限时为True，此时股价 < buy_below即满足3项及以上，
+                      股价 >= sell_from即满足1项及以下；monotone为False时两列为NaN，需用classify_prices按区间计数
+    """
+    codes = list(fundamentals.index)
+    if inputs is None:
+        inputs = buy_trigger_inputs(codes, end_date, price_index, shares_index, ttm_index)
+    shares = inputs['shares'].to_numpy(dtype='float64')
+    ttm_now = inputs['ttm_now'].to_numpy(dtype='float64')
+    past_pe = inputs['past_pe'].to_numpy(dtype='float64')
+    equity = fundamentals['equity'].to_numpy(dtype='float64')
+    np_ttm = fundamentals['np_ttm'].to_numpy(dtype='float64')
+    fcf_ttm = fundamentals['fcf_ttm'].to_numpy(dtype='float64')
+    dcf = fundamentals['dcf_10y'].to_numpy(dtype='float64')
+    n = len(codes)
+
+    def value(x):
+        return np.nan if x is None else float(x)
+
+    deposit, inflation, market_pb_avg = value(deposit), value(inflation), value(market_pb_avg)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # pb = price * shares / equity，股本为0或净资产为0时pb为NaN
+        pb_coef = np.where((shares == 0) | (equity == 0), np.nan, shares / equity)
+        # 五年平均市盈率的当年一项为price * shares / TTM利润
+        pe_now_coef = shares / np.where(ttm_now == 0, np.nan, ttm_now)
+        conditions = {
+            'A': (pb_coef, np.full(n, 2.0 * market_pb_avg)),
+            'B': (shares / np.where(np_ttm == 0, np.nan, np_ttm), np.full(n, 1.0 / deposit if deposit > 0 else np.nan)),
+            'C': (pb_coef - pe_now_coef / 5, past_pe / 5),
+            'D': (shares / np.where(fcf_ttm == 0, np.nan, fcf_ttm),
+                  np.full(n, 1.0 / inflation if inflation > 0 else np.nan)),
+            'E': (shares / np.where(dcf > 0, dcf, np.nan), np.ones(n)),
+        }
+    result = pd.DataFrame(index=codes)
+    lows, highs = [], []
+    for name in BUY_CRITERIA:
+        low, high = _condition_interval(*conditions[name])
+        result[f'{name}_low'] = low
+        result[f'{name}_high'] = high
+        lows.append(low)
+        highs.append(high)
+    monotone = (np.vstack(lows) == -np.inf).all(axis=0) if n else np.zeros(0, dtype=bool)
+    # 只有上限时满足条件数随股价单调不增：第3高的上限以下满足3项及以上，第2高的上限及以上满足不超过1项
+    ordered = -np.sort(-np.vstack(highs), axis=0) if n else np.zeros((5, 0))
+    result['monotone'] = monotone
+    result['buy_below'] = np.where(monotone, ordered[2], np.nan)
+    result['sell_from'] = np.where(monotone, ordered[1], np.nan)
+    return result
+
+
+def classify_prices(triggers: pd.DataFrame, prices) -> np.ndarray:
+    """
+    由buy_price_triggers的价格区间计算给定股价下满足的条件数，不再计算任何估值指标
+
+    Args:
+        triggers: buy_price_triggers的结果
+        prices: 与triggers行对应的股价数组，NaN时条件数为0
+
+    Returns:
+        np.ndarray: 满足的条件数
+    """
+    prices = np.asarray(prices, dtype='float64')
+    count = np.zeros(len(prices), dtype=int)
+    for name in BUY_CRITERIA:
+        count += (prices > triggers[f'{name}_low'].to_numpy()) & (prices < triggers[f'{name}_high'].to_numpy())
+    return count
@@ -7,16 +7,45 @@
 2. 从stock.balance表获取Stkcd列的全部值
 3. 使用akshare获取每个股票代码的现金流量表数据
 4. 筛选报告日以'0930'结尾的行并写入stock.cash_flow表
+5. 多个线程并发抓取，共享的令牌桶限速器控制总请求速率，遇到限流时自动降速；数据库写入在主线程中进行
+6. 按代码段推断交易所前缀，并在本地记录请求成功的前缀，每只股票通常只需一次请求
+7. 原始响应缓存在本地（response_cache.ResponseCache），有效期内重复运行不再下载；--offline只从缓存读取
+8. 每只股票的列名只解析一次，按列取出写入行，缺失值写为NULL；跨股票累积后分批executemany写入，
+   整批写入失败时改为逐只股票写入，出错的股票不影响同批的其他股票
+9. 按(Stkcd, Accper)主键幂等写入，内容哈希未变化的行不再重写；--incremental时一次查询各股票已有的最大Accper，
+   按报告期日历跳过还不可能有新报告的股票，只写入新的报告期
+10. 内容哈希文件记录所属的数据库和表，换库后不再使用；每次运行前按cash_flow表中实际存在的行清理哈希，
+    表被清空、迁移或删除了部分行时这些行会重新写入
 """
 
+import os
+import json
 import pymysql
-import akshare as ak
+import numpy as np
 import pandas as pd
-import time
 import logging
+import argparse
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from typing import List, Optional
+from config import AKSHARE_CONFIG, FETCH_CONFIG, PROCESS_CONFIG
 from miller_value import FinancialDataRepository, MillerStrategyRunner
+from exchange_resolver import ExchangeResolver
+from rate_limiter import TokenBucket, ThroughputMeter, call_with_timeout, is_throttled
+from response_cache import ResponseCache, CacheMiss
+from schema import build_upsert_sql
+
+try:
+    import akshare as ak
+except ImportError:
+    # 离线模式只从响应缓存读取，不需要akshare
+    ak = None
+
+# 现金流量表接口及其参数，作为响应缓存的键
+REPORT_ENDPOINT = 'stock_financial_report_sina'
+REPORT_PARAMS = {'symbol': '现金流量表'}
+# akshare解析不存在的代码的响应时抛出的异常，说明前缀可能不对
+SYMBOL_NOT_FOUND_ERRORS = (KeyError, IndexError, TypeError, ValueError)
 
 # 配置日志
 logging.basicConfig(
@@ -29,18 +58,145 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+CASH_FLOW_COLUMNS = ['Stkcd', 'Accper', 'NetOpCF', 'AssetPurchase']
+# filter_data保留的报告期（报告日的月日）
+INGEST_PERIODS = ('0331', '0930')
+
+
+def normalize_accper(value) -> str:
+    """把报告日统一为YYYYMMDD字符串，兼容akshare的'20230930'和数据库DATE列的'2023-09-30'或date对象"""
+    return str(value).replace('-', '')[:8]
+
+
+def next_report_period(accper: str) -> str:
+    """返回accper之后第一个INGEST_PERIODS中的报告期（YYYYMMDD）"""
+    accper = normalize_accper(accper)
+    year = int(accper[:4])
+    for candidate_year in (year, year + 1):
+        for period in INGEST_PERIODS:
+            candidate = f"{candidate_year}{period}"
+            if candidate > accper:
+                return candidate
+    return f"{year + 2}{INGEST_PERIODS[0]}"
+
+
+def may_have_new_report(watermark: Optional[str], today: str) -> bool:
+    """
+    按报告期日历判断股票是否可能有新报告：报告只能在报告期结束后披露
+
+    Args:
+        watermark: 库中该股票已有的最大Accper，没有数据时为None
+        today: 当前日期，YYYYMMDD或YYYY-MM-DD
+
+    Returns:
+        bool: 已有数据之后的下一个报告期已经结束时返回True
+    """
+    if watermark is None:
+        return True
+    return next_report_period(watermark) < normalize_accper(today)
+
+
+def is_symbol_not_found(error: Exception) -> bool:
+    """判断请求异常是否表示该前缀下没有这只股票；离线缓存未命中、超时、连接中断等与前缀无关的错误不算"""
+    return isinstance(error, SYMBOL_NOT_FOUND_ERRORS) and not isinstance(error, CacheMiss)
+
+
+def resolve_cash_flow_columns(columns) -> Optional[tuple]:
+    """
+    在akshare现金流量表的列名中找出报告日、经营活动现金流量净额和购建长期资产支付的现金三列，同名多列时取最后一列
+
+    Returns:
+        tuple: (报告日列, 经营活动现金流列, 购建长期资产列或None)，缺少前两列时返回None
+    """
+    report_date_col = None
+    net_op_cf_col = None
+    asset_purchase_col = None
+    for col in columns:
+        if '报告日' in col:
+            report_date_col = col
+        elif '经营活动产生的现金流量' in col:
+            net_op_cf_col = col
+        elif '购建固定资产、无形资产和其他长期资产支付的现金' in col:
+            asset_purchase_col = col
+    if report_date_col is None or net_op_cf_col is None:
+        return None
+    return report_date_col, net_op_cf_col, asset_purchase_col
+
+
+def _text(values: pd.Series) -> pd.Series:
+    """把值转换为字符串，缺失值和空字符串为None（写入数据库时为NULL，而不是'nan'）"""
+    text = values.astype(str).str.strip()
+    return text.where(values.notna() & (text != ''), None)
+
+
+def build_cash_flow_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    按列取出一只股票现金流量表的Stkcd、Accper、NetOpCF、AssetPurchase，列名只解析一次，值转换为字符串，
+    缺失值为None；缺少购建长期资产列时AssetPurchase为'0'，报告日缺失的行丢弃
+
+    Args:
+        df: get_cash_flow_data返回并经filter_data筛选的数据，含stock_code列
+
+    Returns:
+        pd.DataFrame: 列为CASH_FLOW_COLUMNS，找不到报告日或经营活动现金流列时为空
+    """
+    columns = resolve_cash_flow_columns(df.columns)
+    if columns is None or df.empty:
+        return pd.DataFrame(columns=CASH_FLOW_COLUMNS)
+    report_date_col, net_op_cf_col, asset_purchase_col = columns
+    if asset_purchase_col is not None:
+        asset_purchase = _text(df[asset_purchase_col])
+    else:
+        asset_purchase = pd.Series('0', index=df.index)
+    frame = pd.DataFrame({'Stkcd': df['stock_code'], 'Accper': _text(df[report_date_col]),
+                          'NetOpCF': _text(df[net_op_cf_col]), 'AssetPurchase': asset_purchase})
+    return frame[frame['Accper'].notna()]
+
+
+def build_cash_flow_rows(df: pd.DataFrame) -> List[tuple]:
+    """返回build_cash_flow_frame的(Stkcd, Accper, NetOpCF, AssetPurchase)元组列表"""
+    return list(build_cash_flow_frame(df).itertuples(index=False, name=None))
+
+
+def row_digests(frame: pd.DataFrame) -> List[str]:
+    """返回每行内容的64位哈希（16位十六进制），用于判断同一(Stkcd, Accper)的数据是否变化"""
+    if frame.empty:
+        return []
+    hashes = pd.util.hash_pandas_object(frame[CASH_FLOW_COLUMNS].astype(str), index=False).to_numpy()
+    return [format(h, '016x') for h in hashes.tolist()]
+
+
 class StockCashFlowProcessor:
     """股票现金流量表数据处理类"""
     
-    def __init__(self, db_config: dict):
+    def __init__(self, db_config: dict, limiter: TokenBucket = None, resolver: ExchangeResolver = None,
+                 cache: ResponseCache = None):
         """
         初始化数据库连接
         
         Args:
             db_config: 数据库连接配置字典
+            limiter: 可选的限速器，提供时每次请求akshare前先取令牌；process_all_stocks会按delay重新创建
+            resolver: 交易所前缀解析器，默认使用EXCHANGE_CONFIG['path']中已确认的前缀
+            cache: 可选的原始响应缓存，提供时先从缓存读取，未命中时才请求akshare
         """
         self.db_config = db_config
         self.connection = None
+        self.limiter = limiter
+        self.timeout = AKSHARE_CONFIG['timeout']  # 单次akshare请求的超时时间（秒）
+        self.resolver = resolver or ExchangeResolver()
+        self.cache = cache
+        self.batch_size = PROCESS_CONFIG['insert_batch_size']
+        self._rows = []  # 跨股票累积的(Stkcd, Accper, NetOpCF, AssetPurchase)写入缓冲
+        self._pending_digests = []  # 写入缓冲中各行的(Stkcd, Accper, 内容哈希)，写入成功后并入digests
+        self.inserted_rows = 0  # 已成功写入的行数
+        self.unchanged_rows = 0  # 内容哈希未变化而跳过的行数
+        self.failed_stocks = set()  # 最近一次写入中逐只写入仍失败的股票
+        # 按(Stkcd, Accper)主键幂等写入，重复运行不会产生重复行
+        self.insert_sql = build_upsert_sql('cash_flow', CASH_FLOW_COLUMNS, db_config.get('backend', 'mysql'))
+        self.digest_path = PROCESS_CONFIG['digest_path']
+        self.digest_scope = self._digest_scope()
+        self.digests = self._load_digests()  # 股票代码 -> {Accper: 已写入行的内容哈希}
         
     def connect_to_mysql(self) -> bool:
         """连接MySQL数据库"""
@@ -75,24 +231,59 @@ class StockCashFlowProcessor:
             logger.error(f"获取股票代码失败: {e}")
             return []
     
-    def get_cash_flow_data(self, stock_code: str) -> Optional[pd.DataFrame]:
-        """使用akshare获取指定股票代码的现金流量表数据"""
+    def _request_report(self, stock: str) -> pd.DataFrame:
+        """经限速器请求一次akshare现金流量表接口，超时或失败时抛出异常，被限流时通知限速器降速"""
+        if ak is None:
+            raise ImportError("akshare未安装，只能使用离线模式")
+        if self.limiter is not None:
+            self.limiter.acquire()
         try:
-            # 使用akshare获取现金流量表数据
-            df = ak.stock_financial_report_sina(stock=stock_code, symbol="现金流量表")
+            df = call_with_timeout(ak.stock_financial_report_sina, self.timeout, stock=stock, **REPORT_PARAMS)
         except Exception as e:
+            if self.limiter is not None and is_throttled(e):
+                self.limiter.throttled()
+            raise
+        if self.limiter is not None:
+            self.limiter.succeeded()
+        return df
+
+    def _fetch_report(self, stock: str) -> pd.DataFrame:
+        """获取一次现金流量表：有缓存时先读缓存，未命中时请求并写入缓存；离线模式未命中时抛出CacheMiss"""
+        if self.cache is None:
+            return self._request_report(stock)
+        return self.cache.fetch(REPORT_ENDPOINT, stock, REPORT_PARAMS, lambda: self._request_report(stock))
+
+    def get_cash_flow_data(self, stock_code: str) -> Optional[pd.DataFrame]:
+        """
+        使用akshare获取指定股票代码的现金流量表数据；请求代码的交易所前缀由解析器给出，
+        已确认的股票只需一次请求；返回空表或代码不存在的错误时才依次回退到其余前缀
+
+        Returns:
+            pd.DataFrame: 现金流量表数据；每个前缀都没有数据时返回空表，
+                          请求失败（超时、限流、连接中断、离线缓存未命中等）时返回None，调用方不应记录进度
+        """
+        last_error = None
+        for symbol in self.resolver.candidates(stock_code):
             try:
-                df = ak.stock_financial_report_sina(stock="sh"+ stock_code, symbol="现金流量表")
+                # 使用akshare获取现金流量表数据
+                df = self._fetch_report(symbol)
             except Exception as e:
-                try:
-                    df = ak.stock_financial_report_sina(stock="sz"+ stock_code, symbol="现金流量表")
-                except Exception as e:
+                # 限流、超时、连接中断、缓存未命中与前缀无关，不再尝试其他前缀
+                if not is_symbol_not_found(e):
                     logger.error(f"获取股票代码 {stock_code} 的现金流量表数据失败: {e}")
                     return None
-        
-        if df.empty:
+                last_error = e
+                continue
+            # 前缀不对时接口也可能返回空表，只记录取到数据的前缀
+            if not df.empty:
+                self.resolver.learn(stock_code, symbol)
+                break
+        else:
+            if last_error is not None:
+                logger.error(f"获取股票代码 {stock_code} 的现金流量表数据失败: {last_error}")
+                return None
             logger.warning(f"股票代码 {stock_code} 的现金流量表数据为空")
-            return None
+            return pd.DataFrame()
         try:
             # 添加股票代码列
             df['stock_code'] = stock_code
@@ -120,7 +311,7 @@ class StockCashFlowProcessor:
             
             # 筛选以'0930'或'0331'结尾的报告日
             date_str = df[date_column].astype(str)
-            filtered_df = df[date_str.str.endswith('0930') | date_str.str.endswith('0331')]
+            filtered_df = df[date_str.str.endswith(INGEST_PERIODS)]
             
             logger.info(f"筛选出 {len(filtered_df)} 条报告日以'0930'或'0331'结尾的数据")
             return filtered_df
@@ -129,88 +320,263 @@ class StockCashFlowProcessor:
             logger.error(f"筛选数据失败: {e}")
             return pd.DataFrame()
     
-    def insert_cash_flow_data(self, df: pd.DataFrame):
-        """将现金流量表数据插入到数据库"""
+    def _digest_scope(self) -> str:
+        """内容哈希所属的目标表，如mysql://host:3306/stock/cash_flow"""
+        if self.db_config.get('backend') == 'sqlite':
+            target = f"sqlite://{os.path.abspath(self.db_config.get('path', 'stock.db'))}"
+        else:
+            target = (f"mysql://{self.db_config.get('host', 'localhost')}:{self.db_config.get('port', 3306)}"
+                      f"/{self.db_config.get('database', 'stock')}")
+        return f"{target}/cash_flow"
+
+    def _load_digests(self) -> dict:
+        if not self.digest_path or not os.path.exists(self.digest_path):
+            return {}
+        try:
+            with open(self.digest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取内容哈希文件失败，全部行视为已变化: {e}")
+            return {}
+        if data.get('scope') != self.digest_scope:
+            logger.info(f"内容哈希文件属于{data.get('scope')}，与当前目标{self.digest_scope}不同，全部行视为已变化")
+            return {}
+        return data.get('digests', {})
+
+    def _save_digests(self):
+        """先写临时文件再替换，中断时不破坏已有文件"""
+        if not self.digest_path:
+            return
+        tmp_path = f"{self.digest_path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'scope': self.digest_scope, 'digests': self.digests}, f, sort_keys=True)
+            os.replace(tmp_path, self.digest_path)
+        except OSError as e:
+            logger.error(f"保存内容哈希文件失败: {e}")
+
+    def reconcile_digests(self) -> int:
+        """
+        按cash_flow表中实际存在的(Stkcd, Accper)清理内容哈希：表被清空、迁移或删除了部分行时，
+        对应的哈希作废，这些行下次会重新写入
+
+        Returns:
+            int: 作废的哈希数；查询失败时清空全部哈希
+        """
+        total = sum(len(v) for v in self.digests.values())
+        if not total:
+            return 0
         try:
-            if df.empty:
-                return
-            
             with self.connection.cursor() as cursor:
-                # 批量插入数据
-                insert_sql = """
-                insert into cash_flow(Stkcd, Accper, NetOpCF, AssetPurchase) 
-                VALUES (%s, %s, %s, %s)
-                """
-                # 准备数据
-                data_to_insert = []
-                for _, row in df.iterrows():
-                    # 假设数据格式：需要根据akshare返回的实际格式调整
-                    # 这里需要根据akshare返回的列名进行调整
-                    report_date_col = None
-                    NetOpCF_col = None
-                    AssetPurchase_col = None
-                    
-                    # 尝试找到合适的列名
-                    for col in df.columns:
-                        if '报告日' in col:
-                            report_date_col = col
-                        elif '经营活动产生的现金流量' in col:
-                            NetOpCF_col = col
-                        elif '购建固定资产、无形资产和其他长期资产支付的现金' in col:
-                            AssetPurchase_col = col
-                    
-                    if report_date_col and NetOpCF_col:
-                        assetPurchase = '0'
-                        if AssetPurchase_col != None:
-                            assetPurchase = str(row[AssetPurchase_col])
-                        data_to_insert.append((
-                            row['stock_code'],
-                            str(row[report_date_col]),
-                            str(row[NetOpCF_col]),
-                            assetPurchase
-                        ))
-                
-                if data_to_insert:
-                    cursor.executemany(insert_sql, data_to_insert)
-                    self.connection.commit()
-                    logger.info(f"成功插入 {len(data_to_insert)} 条现金流量表数据")
+                cursor.execute("SELECT Stkcd, Accper FROM cash_flow")
+                existing = {(str(row['Stkcd']), normalize_accper(row['Accper'])) for row in cursor.fetchall()}
+        except Exception as e:
+            logger.error(f"查询cash_flow表已有的行失败，内容哈希全部作废: {e}")
+            existing = set()
+        digests = {}
+        for code, by_accper in self.digests.items():
+            kept = {accper: digest for accper, digest in by_accper.items()
+                    if (code, normalize_accper(accper)) in existing}
+            if kept:
+                digests[code] = kept
+        dropped = total - sum(len(v) for v in digests.values())
+        if dropped:
+            logger.info(f"cash_flow表中已不存在 {dropped} 行，对应的内容哈希作废")
+            self.digests = digests
+            self._save_digests()
+        return dropped
+
+    def get_watermarks(self) -> dict:
+        """一次查询cash_flow表中每只股票已有的最大Accper，返回股票代码 -> YYYYMMDD"""
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute("SELECT Stkcd, MAX(Accper) AS max_accper FROM cash_flow GROUP BY Stkcd")
+                results = cursor.fetchall()
+            return {row['Stkcd']: normalize_accper(row['max_accper']) for row in results if row['max_accper']}
+        except Exception as e:
+            logger.error(f"获取cash_flow表的最大Accper失败: {e}")
+            return {}
+
+    def insert_cash_flow_data(self, df: pd.DataFrame, watermark: str = None) -> bool:
+        """
+        将一只股票的现金流量表数据加入写入缓冲，缓冲达到batch_size行时写入数据库；
+        内容哈希与上次写入相同的行跳过
+
+        Args:
+            df: 经filter_data筛选的数据
+            watermark: 库中已有的最大Accper（YYYYMMDD），提供时只写入之后的新报告期
+
+        Returns:
+            bool: 本次触发的写入中有股票写入失败时返回False，失败的股票见failed_stocks
+        """
+        frame = build_cash_flow_frame(df)
+        if watermark is not None and not frame.empty:
+            frame = frame[frame['Accper'].map(normalize_accper) > watermark]
+        digests = row_digests(frame)
+        changed = [self.digests.get(code, {}).get(accper) != digest
+                   for code, accper, digest in zip(frame['Stkcd'], frame['Accper'], digests)]
+        self.unchanged_rows += len(changed) - sum(changed)
+        frame = frame[np.asarray(changed, dtype=bool)]
+        self._rows.extend(frame.itertuples(index=False, name=None))
+        self._pending_digests.extend(zip(frame['Stkcd'], frame['Accper'], np.asarray(digests)[changed]))
+        if len(self._rows) >= self.batch_size:
+            return self.flush_cash_flow_data()
+        return True
+
+    def _write_rows(self, rows: List[tuple]) -> bool:
+        """用一次executemany写入rows并提交，失败时回滚并返回False"""
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.executemany(self.insert_sql, rows)
+            self.connection.commit()
         except Exception as e:
             logger.error(f"插入数据失败: {e}")
             self.connection.rollback()
+            return False
+        self.inserted_rows += len(rows)
+        logger.info(f"成功插入 {len(rows)} 条现金流量表数据")
+        return True
+
+    def flush_cash_flow_data(self) -> bool:
+        """
+        将缓冲中的全部行用executemany写入cash_flow表并提交；整批失败时回滚后逐只股票写入，
+        仍失败的股票的行被丢弃并记录在failed_stocks中。无论成功与否都清空缓冲
+
+        Returns:
+            bool: 全部股票都写入成功时返回True
+        """
+        self.failed_stocks = set()
+        if not self._rows:
+            return True
+        rows, self._rows = self._rows, []
+        digests, self._pending_digests = self._pending_digests, []
+        if not self._write_rows(rows):
+            # 一只股票的坏值会使整批失败，逐只重写使其他股票不受影响
+            by_stock = {}
+            for row in rows:
+                by_stock.setdefault(row[0], []).append(row)
+            logger.warning(f"批量写入失败，改为逐只写入 {len(by_stock)} 个股票")
+            for code, stock_rows in by_stock.items():
+                if not self._write_rows(stock_rows):
+                    logger.error(f"股票代码 {code} 的现金流量表数据写入失败")
+                    self.failed_stocks.add(code)
+        for code, accper, digest in digests:
+            if code not in self.failed_stocks:
+                self.digests.setdefault(code, {})[accper] = digest
+        self._save_digests()
+        return not self.failed_stocks
+
+    def pending_rows(self) -> int:
+        """返回写入缓冲中尚未写入的行数"""
+        return len(self._rows)
     
-    def process_all_stocks(self, delay: float = 1.0):
-        """处理所有股票代码"""        
+    def _store(self, stock_code: str, cash_flow_df: Optional[pd.DataFrame], watermark: str = None) -> bool:
+        """筛选一只股票的抓取结果并加入写入缓冲，触发的写入失败时返回False；没有数据时视为成功"""
+        if cash_flow_df is None or cash_flow_df.empty:
+            return True
+        # 筛选0930或0331数据
+        filtered_df = self.filter_data(cash_flow_df)
+        if filtered_df.empty:
+            return True
+        # 插入数据库
+        return self.insert_cash_flow_data(filtered_df, watermark)
+
+    def process_all_stocks(self, delay: float = None, ledger=None, workers: int = None,
+                           incremental: bool = False) -> bool:
+        """
+        处理所有股票代码：多个线程并发抓取，共享令牌桶限速，抓取结果在当前线程中依次写入数据库
+
+        Args:
+            delay: 平均请求间隔（秒），即限速器速率为1/delay次/秒，默认取PROCESS_CONFIG['delay_between_requests']
+            ledger: 可选的进度账本（checkpoint.CheckpointLedger），提供时跳过已完成的股票，股票的数据写入数据库后立即记录
+            workers: 并发抓取的线程数，默认取FETCH_CONFIG['workers']
+            incremental: 为True时跳过按报告期日历还不可能有新报告的股票，只写入库中最大Accper之后的报告期
+
+        Returns:
+            bool: 全部股票都已抓取并写入时返回True；抓取失败或写入失败的股票不记录进度，返回False
+        """        
         # 获取股票代码
         stock_codes = self.get_stock_codes()
         
         if not stock_codes:
             logger.error("未获取到股票代码，程序终止")
-            return
+            return False
+
+        if ledger is not None:
+            pending = ledger.pending(stock_codes)
+            if len(pending) < len(stock_codes):
+                logger.info(f"跳过已完成的股票 {len(stock_codes) - len(pending)} 个，剩余 {len(pending)} 个")
+            stock_codes = pending
+
+        # 内容哈希只对目标表中仍然存在的行有效
+        self.reconcile_digests()
+        watermarks = {}
+        if incremental:
+            watermarks = self.get_watermarks()
+            today = datetime.now().strftime('%Y%m%d')
+            due = [c for c in stock_codes if may_have_new_report(watermarks.get(c), today)]
+            logger.info(f"增量模式: 跳过还不可能有新报告的股票 {len(stock_codes) - len(due)} 个，剩余 {len(due)} 个")
+            stock_codes = due
+
+        delay = delay or PROCESS_CONFIG['delay_between_requests']
+        workers = workers or FETCH_CONFIG['workers']
+        self.limiter = TokenBucket(1.0 / delay)
+        meter = ThroughputMeter(len(stock_codes))
+        logger.info(f"开始抓取 {len(stock_codes)} 个股票, {workers}个线程, 限速{self.limiter.rate:.2f}次/秒")
         
         total_processed = 0
-        total_inserted = 0
-        
-        for i, stock_code in enumerate(stock_codes, 1):
-            try:
-                logger.info(f"处理第 {i}/{len(stock_codes)} 个股票代码: {stock_code}")
-                # 获取现金流量表数据
-                cash_flow_df = self.get_cash_flow_data(stock_code)
-                if cash_flow_df is not None and not cash_flow_df.empty:
-                    # 筛选0930或0331数据
-                    filtered_df = self.filter_data(cash_flow_df)
-                    if not filtered_df.empty:
-                        # 插入数据库
-                        self.insert_cash_flow_data(filtered_df)
-                        total_inserted += len(filtered_df)
-                    total_processed += 1
-                # 添加延迟避免请求过于频繁
-                if i < len(stock_codes):
-                    time.sleep(0.5)  
-            except Exception as e:
-                logger.error(f"处理股票代码 {stock_code} 时发生错误: {e}")
-                continue
+        unfinished = 0  # 抓取或写入失败、下次运行需要重试的股票数
+        self.inserted_rows = 0
+        self.unchanged_rows = 0
+        waiting = []  # 数据仍在写入缓冲中的股票，写入成功后才记录进度
+        codes = iter(stock_codes)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # 同时在途的请求不超过线程数的两倍，抓取结果不会在内存中堆积
+            running = {}
+            for stock_code in codes:
+                running[executor.submit(self.get_cash_flow_data, stock_code)] = stock_code
+                if len(running) >= workers * 2:
+                    break
+            while running:
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    stock_code = running.pop(future)
+                    try:
+                        cash_flow_df = future.result()
+                        if cash_flow_df is None:
+                            # 抓取失败的股票不记录进度，下次运行时重试
+                            unfinished += 1
+                        else:
+                            if not cash_flow_df.empty:
+                                total_processed += 1
+                            stored = self._store(stock_code, cash_flow_df, watermarks.get(stock_code))
+                            waiting.append(stock_code)
+                            if not stored:
+                                # 写入失败的股票不记录进度，下次运行时重试；同批的其他股票已逐只写入
+                                unfinished += sum(c in self.failed_stocks for c in waiting)
+                                waiting = [c for c in waiting if c not in self.failed_stocks]
+                        # 缓冲为空说明等待中的股票都已写入数据库
+                        if not self.pending_rows():
+                            if ledger is not None:
+                                ledger.mark(waiting)
+                            waiting = []
+                    except Exception as e:
+                        logger.error(f"处理股票代码 {stock_code} 时发生错误: {e}")
+                        unfinished += 1
+                    meter.update(note=f"当前限速{self.limiter.rate:.2f}次/秒")
+                    next_code = next(codes, None)
+                    if next_code is not None:
+                        running[executor.submit(self.get_cash_flow_data, next_code)] = next_code
+        if not self.flush_cash_flow_data():
+            unfinished += sum(c in self.failed_stocks for c in waiting)
+            waiting = [c for c in waiting if c not in self.failed_stocks]
+        if ledger is not None:
+            ledger.mark(waiting)
+        self.resolver.save()
         
-        logger.info(f"处理完成！共处理 {total_processed} 个股票，插入 {total_inserted} 条数据")
+        logger.info(f"处理完成！共处理 {total_processed} 个股票，插入 {self.inserted_rows} 条数据，"
+                    f"内容未变化跳过 {self.unchanged_rows} 条，未完成 {unfinished} 个")
+        return unfinished == 0
     
     def close_connection(self):
         """关闭数据库连接"""
@@ -220,13 +586,29 @@ class StockCashFlowProcessor:
 
 def main():
     """主函数"""
+    parser = argparse.ArgumentParser(description='获取现金流量表数据并写入cash_flow表')
+    parser.add_argument('--resume', action='store_true', help='接续最近一次未完成的运行，跳过已完成的股票')
+    parser.add_argument('--run-id', default=None, help='指定运行ID，接续该运行')
+    parser.add_argument('--offline', action='store_true', help='只从本地响应缓存读取，不访问网络')
+    parser.add_argument('--no-cache', action='store_true', help='不使用本地响应缓存')
+    parser.add_argument('--incremental', action='store_true', help='只抓取可能有新报告的股票，只写入新的报告期')
+    args = parser.parse_args()
     try:
         # 导入配置文件
-        from config import DB_CONFIG, PROCESS_CONFIG
+        from config import DB_CONFIG
+        from checkpoint import CheckpointLedger
         # 创建处理器实例
-        processor = StockCashFlowProcessor(DB_CONFIG)
-        processor.connect_to_mysql()
-        processor.process_all_stocks(delay=1000)
+        cache = None if args.no_cache else ResponseCache(offline=args.offline or None)
+        processor = StockCashFlowProcessor(DB_CONFIG, cache=cache)
+        if not processor.connect_to_mysql():
+            return
+        ledger = CheckpointLedger('cash_flow', run_id=args.run_id, resume=args.resume)
+        # 只有全部股票都完成时才标记运行完成，否则保留给--resume接续
+        if processor.process_all_stocks(delay=PROCESS_CONFIG['delay_between_requests'], ledger=ledger,
+                                        incremental=args.incremental):
+            ledger.complete()
+        else:
+            logger.warning(f"部分股票未完成，可使用--resume或--run-id {ledger.run_id}接续")
         
     except ImportError:
         logger.error("配置文件config.py不存在，请先创建配置文件")      
@@ -236,7 +618,7 @@ def main():
         logger.error(f"程序执行出错: {e}")
     finally:
         # 关闭连接
-        if 'processor' in locals() and not args.no_db:
+        if 'processor' in locals():
             processor.close_connection()
 
 if __name__ == "__main__":
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+运行进度检查点
+功能：
+1. 为选股、买入评估和现金流量表导入等长时间运行的任务记录已完成的(运行ID, end_date, Stkcd)单元
+2. 进度保存在本地文件中，每个运行一个JSON Lines文件，每完成一批立即追加并落盘，进程崩溃或中断后不丢失
+3. 重新启动时跳过已完成的单元；resume=True时接续同一任务最近一次未完成的运行
+
+文件格式（checkpoints/<task>-<run_id>.jsonl）：
+    {"run_id": "...", "task": "sel", "started": "..."}
+    {"end_date": "2023-12-31", "codes": ["000001", "000002"]}
+    {"status": "complete", "finished": "..."}
+"""
+
+import os
+import json
+import glob
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Set
+
+from config import CHECKPOINT_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class CheckpointLedger:
+    """运行进度账本类"""
+
+    def __init__(self, task: str, run_id: str = None, resume: bool = False, root: str = None):
+        """
+        打开或新建一个运行的进度账本
+
+        Args:
+            task: 任务名，如sel、buy、cash_flow
+            run_id: 运行ID，默认按当前时间生成；指定已存在的运行ID时接续该运行
+            resume: 为True且未指定run_id时，接续该任务最近一次未完成的运行，没有时新建
+            root: 进度文件目录，默认取CHECKPOINT_CONFIG['root']
+        """
+        self.task = task
+        self.root = root or CHECKPOINT_CONFIG['root']
+        if run_id is None and resume:
+            run_id = self.last_incomplete(task, self.root)
+            if run_id is not None:
+                logger.info(f"接续未完成的运行: 任务={task}, 运行ID={run_id}")
+        self.run_id = run_id or datetime.now().strftime('%Y%m%d%H%M%S%f')
+        self.path = os.path.join(self.root, f"{task}-{self.run_id}.jsonl")
+        self._done: Dict[str, Set[str]] = {}
+        self.completed = False
+        if os.path.exists(self.path):
+            self._load()
+        else:
+            os.makedirs(self.root, exist_ok=True)
+            self._append({'run_id': self.run_id, 'task': task, 'started': datetime.now().isoformat()})
+
+    @staticmethod
+    def _read(path: str) -> List[dict]:
+        records = []
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    # 进程在写入中途退出时最后一行可能不完整
+                    continue
+        return records
+
+    def _load(self):
+        for record in self._read(self.path):
+            if 'codes' in record:
+                self._done.setdefault(record['end_date'], set()).update(record['codes'])
+            elif record.get('status') == 'complete':
+                self.completed = True
+
+    def _append(self, record: dict):
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8')
+        with open(self.path, 'a+b') as f:
+            # 上次中断留下的不完整行没有换行符，先补一个换行，避免与新记录连成一行
+            if f.tell() > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    line = b"\n" + line
+            f.write(line)
+            f.flush()
+            os.fsync(f.fileno())
+
+    @classmethod
+    def last_incomplete(cls, task: str, root: str = None) -> Optional[str]:
+        """
+        查找任务最近一次未完成的运行
+
+        Args:
+            task: 任务名
+            root: 进度文件目录
+
+        Returns:
+            str: 运行ID，不存在时返回None
+        """
+        root = root or CHECKPOINT_CONFIG['root']
+        paths = sorted(glob.glob(os.path.join(root, f"{task}-*.jsonl")), key=os.path.getmtime, reverse=True)
+        for path in paths:
+            if not any(r.get('status') == 'complete' for r in cls._read(path)):
+                return os.path.basename(path)[len(task) + 1:-len('.jsonl')]
+        return None
+
+    def done(self, end_date: str = None) -> Set[str]:
+        """返回end_date下已完成的股票代码集合；导入任务没有end_date时传None"""
+        return self._done.get(end_date or '', set())
+
+    def pending(self, stock_codes: List[str], end_date: str = None) -> List[str]:
+        """按原顺序返回end_date下尚未完成的股票代码"""
+        done = self.done(end_date)
+        return [c for c in stock_codes if c not in done]
+
+    def mark(self, stock_codes: List[str], end_date: str = None):
+        """
+        记录一批已完成的股票，立即落盘
+
+        Args:
+            stock_codes: 股票代码列表
+            end_date: 截止日期，导入任务没有end_date时传None
+        """
+        codes = [str(c) for c in stock_codes]
+        if not codes:
+            return
+        self._append({'end_date': end_date or '', 'codes': codes})
+        self._done.setdefault(end_date or '', set()).update(codes)
+
+    def complete(self):
+        """标记整个运行已完成，之后resume不再接续该运行"""
+        if not self.completed:
+            self._append({'status': 'complete', 'finished': datetime.now().isoformat()})
+            self.completed = True
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+列式快速读取
+功能：
+1. 提供连接级的转换表：DECIMAL直接解码为float，DATE/DATETIME保持为字符串，不再构造Decimal和date对象
+2. 用无缓冲的元组游标（SSCursor）分批读取结果，不为每行构造dict
+3. 按cursor.description的字段类型把结果直接转换为每列一个NumPy数组：数值列为float64，日期列为datetime64[D]；
+   SQLite没有字段类型，按值推断数值列
+"""
+
+import logging
+from typing import Dict
+
+import numpy as np
+import pandas as pd
+import pymysql
+from pymysql.constants import FIELD_TYPE
+from pymysql.converters import conversions
+
+logger = logging.getLogger(__name__)
+
+# 数值字段类型，解码为float64
+NUMERIC_TYPES = {
+    FIELD_TYPE.DECIMAL, FIELD_TYPE.NEWDECIMAL, FIELD_TYPE.TINY, FIELD_TYPE.SHORT, FIELD_TYPE.LONG,
+    FIELD_TYPE.FLOAT, FIELD_TYPE.DOUBLE, FIELD_TYPE.LONGLONG, FIELD_TYPE.INT24,
+}
+# 日期字段类型，解码为datetime64[D]
+DATE_TYPES = {FIELD_TYPE.DATE, FIELD_TYPE.NEWDATE, FIELD_TYPE.DATETIME, FIELD_TYPE.TIMESTAMP}
+
+# 连接使用的转换表：DECIMAL用float解析，日期保持服务端返回的'YYYY-MM-DD'字符串
+FAST_CONVERSIONS = dict(conversions)
+FAST_CONVERSIONS[FIELD_TYPE.DECIMAL] = float
+FAST_CONVERSIONS[FIELD_TYPE.NEWDECIMAL] = float
+for _t in DATE_TYPES:
+    FAST_CONVERSIONS.pop(_t, None)
+
+
+def _decode_column(values: tuple, type_code: int, dates_as: str) -> np.ndarray:
+    """将一列Python值转换为NumPy数组，NULL在数值列中为NaN、在日期列中为NaT"""
+    if type_code is None:
+        # SQLite不提供字段类型，按值判断：全部为数值（或NULL）时按数值列处理，日期为TEXT按字符串处理
+        present = [v for v in values if v is not None]
+        if present and all(isinstance(v, (int, float)) for v in present):
+            return np.array(values, dtype='float64')
+        return np.array(values, dtype=object)
+    if type_code in NUMERIC_TYPES:
+        return np.array(values, dtype='float64')
+    if type_code in DATE_TYPES:
+        try:
+            days = np.array([v[:10] if isinstance(v, str) else v for v in values], dtype='datetime64[D]')
+        except ValueError:
+            # '0000-00-00'等非法日期无法解析时保持原字符串
+            return np.array(values, dtype=object)
+        if dates_as != 'str':
+            return days
+        out = np.datetime_as_string(days, unit='D').astype(object)
+        out[np.isnat(days)] = None
+        return out
+    return np.array(values, dtype=object)
+
+
+def fetch_columns(connection, sql: str, params=None, fetch_size: int = 50000,
+                  dates_as: str = 'datetime64') -> Dict[str, np.ndarray]:
+    """
+    用无缓冲元组游标执行查询，返回按列组织的NumPy数组
+
+    Args:
+        connection: pymysql数据库连接
+        sql: SQL语句
+        params: 查询参数
+        fetch_size: 每批读取的行数
+        dates_as: 日期列的格式，'datetime64'为datetime64[D]数组，'str'为'YYYY-MM-DD'字符串（NULL为None）
+
+    Returns:
+        Dict[str, np.ndarray]: 列名到数组的有序字典，没有结果行时各列为空数组
+    """
+    with connection.cursor(pymysql.cursors.SSCursor) as cursor:
+        cursor.execute(sql, params)
+        description = cursor.description or ()
+        chunks = []
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            chunks.append(rows)
+
+    rows = [row for chunk in chunks for row in chunk] if len(chunks) != 1 else chunks[0]
+    columns = list(zip(*rows)) if rows else [()] * len(description)
+    return {
+        desc[0]: _decode_column(values, desc[1], dates_as)
+        for desc, values in zip(description, columns)
+    }
+
+
+def fetch_frame(connection, sql: str, params=None, fetch_size: int = 50000, dates_as: str = 'str') -> pd.DataFrame:
+    """
+    按列读取查询结果并构造DataFrame
+
+    Args:
+        connection: pymysql数据库连接
+        sql: SQL语句
+        params: 查询参数
+        fetch_size: 每批读取的行数
+        dates_as: 日期列的格式，默认为与快照一致的'YYYY-MM-DD'字符串
+
+    Returns:
+        pd.DataFrame: 查询结果，没有结果行时返回空DataFrame
+    """
+    columns = fetch_columns(connection, sql, params, fetch_size, dates_as)
+    if not columns or len(next(iter(columns.values()))) == 0:
+        return pd.DataFrame()
+    return pd.DataFrame(columns, copy=False)
@@ -14,13 +14,90 @@ DB_CONFIG = {
     'database': 'stock1'      # 数据库名称
 }
 
+# 本地SQLite数据库配置，用于单机回测、基准测试和开发调试（数据由load_datas.py导入）
+SQLITE_CONFIG = {
+    'backend': 'sqlite',            # 数据库后端：mysql（默认）或sqlite
+    'path': 'stock.db'              # SQLite数据库文件路径
+}
+
+# 数据库连接池配置
+POOL_CONFIG = {
+    'max_size': 4,                  # 最大连接数
+    'checkout_timeout': 30,         # 获取连接的最长等待时间（秒）
+    'health_check_after': 30,       # 连接空闲超过该时间（秒）后取出时先ping检查
+    'keepalive_interval': 300       # 后台保活ping间隔（秒），需小于MySQL的wait_timeout
+}
+
+# 策略结果写入配置
+RESULT_WRITER_CONFIG = {
+    'batch_size': 1000              # 每次executemany写入sel_stocks/trade_stocks的行数
+}
+
+# 行情信号流配置
+STREAM_CONFIG = {
+    'latency_budget_us': 200,       # 单条行情从接收到产生信号的处理时间预算（微秒）
+    'latency_window': 100000        # 计算耗时分位数时保留的最近行情条数
+}
+
+# 运行进度检查点配置
+CHECKPOINT_CONFIG = {
+    'root': 'checkpoints',          # 进度文件目录
+    'chunk_size': 500               # 启用检查点时每批评估并记录的股票数
+}
+
+# 分布式任务队列配置
+WORK_QUEUE_CONFIG = {
+    'chunk_size': 500,              # 每个任务包含的股票数
+    'heartbeat_interval': 10,       # 工作进程处理任务时的心跳间隔（秒）
+    'stale_after': 60,              # 心跳超过该时间（秒）未更新的任务视为失效，重新入队
+    'max_attempts': 3,              # 每个任务最多领取次数，超过后标记为failed
+    'poll_interval': 2              # 没有可领取的任务时的轮询间隔（秒）
+}
+
 # 数据处理配置
 PROCESS_CONFIG = {
     'delay_between_requests': 1.0,  # 请求间隔时间（秒），避免频繁请求
     'max_retries': 3,               # 最大重试次数
+    'insert_batch_size': 5000,      # 跨股票累积后每次executemany写入cash_flow表的行数
+    'digest_path': 'cash_flow_digests.json',  # 已写入cash_flow的每行内容哈希及所属数据库，内容未变化的行不再重写
     'log_level': 'INFO'             # 日志级别
 }
 
+# akshare并发抓取与限速配置，平均请求速率为1/PROCESS_CONFIG['delay_between_requests']次/秒
+FETCH_CONFIG = {
+    'workers': 4,                   # 并发抓取线程数
+    'burst': 2,                     # 令牌桶容量，允许的瞬时突发请求数
+    'min_rate': 0.1,                # 被限流后降速的下限（次/秒）
+    'backoff': 0.5,                 # 遇到限流错误时速率乘以该系数
+    'recover': 1.2,                 # 连续成功recover_after次后速率乘以该系数，不超过配置的速率
+    'recover_after': 20,            # 恢复速率所需的连续成功次数
+    'progress_interval': 10,        # 吞吐量日志间隔（秒）
+    'max_orphaned': 8               # 超时后仍在后台运行的请求上限，达到时暂停发出新请求
+}
+
+# 股票代码交易所前缀配置
+EXCHANGE_CONFIG = {
+    'path': 'exchange_prefix.json', # 已确认的股票代码 -> 前缀（sh/sz/bj）映射文件
+    'save_every': 100               # 每新确认多少个股票写一次文件，处理结束时总会写入
+}
+
+# akshare原始响应缓存配置
+CACHE_CONFIG = {
+    'root': 'ak_cache',             # 缓存文件目录
+    'ttl': 7 * 24 * 3600,           # 缓存有效期（秒），过期后重新请求
+    'max_bytes': 512 * 1024 * 1024, # 缓存目录大小上限（字节），超过时淘汰最久未使用的文件
+    'offline': False                # 离线模式：只从缓存读取，缓存中没有时报错，不访问网络
+}
+
+# 本地快照配置
+SNAPSHOT_CONFIG = {
+    'root': 'snapshot',             # 快照文件根目录
+    'fetch_size': 50000,            # 同步时每批从数据库读取的行数
+    # 增量同步时从高水位线往前重新拉取的天数，窗口内的本地行整体替换：
+    # 0表示只重新拉取高水位线当天（补上快照之后才到的同日数据），报表表多回看一年以覆盖往期报表的更正
+    'lookback_days': {'profit': 400, 'balance': 400, 'cash_flow': 400, 'trade': 0, 'shares': 0}
+}
+
 # akshare配置
 AKSHARE_CONFIG = {
     'timeout': 30,                  # 请求超时时间（秒）
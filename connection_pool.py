@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+线程安全的MySQL连接池
+功能：
+1. 限制最大连接数，连接池满时在checkout_timeout内等待归还
+2. 取出空闲较久的连接时先做ping健康检查，失效则重建
+3. 后台线程定期ping空闲连接，避免超过MySQL的wait_timeout被服务端断开
+4. 连接由backends中的数据库后端创建，同一连接池可用于MySQL和SQLite
+"""
+
+import time
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+
+from backends import create_backend
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """有界MySQL连接池类"""
+
+    def __init__(self, db_config: dict, max_size: int = 4, checkout_timeout: float = 30.0,
+                 health_check_after: float = 30.0, keepalive_interval: float = 300.0, backend=None):
+        """
+        初始化连接池
+
+        Args:
+            db_config: 数据库连接配置字典，包含host、port、user、password、database等字段
+            max_size: 最大连接数
+            checkout_timeout: 获取连接的最长等待时间（秒）
+            health_check_after: 连接空闲超过该时间（秒）后，取出时先ping检查
+            keepalive_interval: 后台ping空闲连接的间隔（秒），小于等于0时不启动后台线程
+            backend: 数据库后端，默认按db_config创建
+        """
+        self.db_config = db_config
+        self.backend = backend or create_backend(db_config)
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.health_check_after = health_check_after
+        self.keepalive_interval = keepalive_interval
+        self._idle = deque()  # 空闲连接队列，元素为(connection, 最后使用时间)
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._closed = False
+        self._stop = threading.Event()
+        self._keepalive_thread = None
+        if keepalive_interval and keepalive_interval > 0:
+            self._keepalive_thread = threading.Thread(target=self._keepalive_loop, name='mysql-keepalive', daemon=True)
+            self._keepalive_thread.start()
+
+    def _create(self):
+        """新建一个数据库连接"""
+        return self.backend.connect()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def acquire(self):
+        """
+        从连接池取出一个连接
+
+        Returns:
+            pymysql.connections.Connection: 可用的数据库连接
+
+        Raises:
+            TimeoutError: 在checkout_timeout内没有可用连接
+        """
+        if self._closed:
+            raise RuntimeError("连接池已关闭")
+        if not self._slots.acquire(timeout=self.checkout_timeout):
+            raise TimeoutError(f"等待数据库连接超时（{self.checkout_timeout}秒）")
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    return self._create()
+                conn, last_used = item
+                if time.monotonic() - last_used < self.health_check_after:
+                    return conn
+                try:
+                    conn.ping(reconnect=True)
+                    return conn
+                except Exception as e:
+                    logger.warning(f"空闲连接健康检查失败，丢弃该连接: {e}")
+                    self._close_quietly(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def release(self, conn, broken: bool = False):
+        """
+        归还连接
+
+        Args:
+            conn: 之前通过acquire取出的连接
+            broken: 连接已失效时为True，直接关闭而不放回连接池
+        """
+        try:
+            if broken or self._closed:
+                self._close_quietly(conn)
+            else:
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+        finally:
+            self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        """以上下文管理器方式借用连接，出现连接断开异常时丢弃该连接"""
+        conn = self.acquire()
+        try:
+            yield conn
+        except self.backend.disconnect_errors:
+            self.release(conn, broken=True)
+            raise
+        else:
+            self.release(conn)
+
+    def _keepalive_loop(self):
+        """后台线程：定期ping空闲过久的连接"""
+        while not self._stop.wait(self.keepalive_interval):
+            now = time.monotonic()
+            with self._lock:
+                stale = [item for item in self._idle if now - item[1] >= self.keepalive_interval]
+                for item in stale:
+                    self._idle.remove(item)
+            for conn, _ in stale:
+                try:
+                    conn.ping(reconnect=True)
+                except Exception as e:
+                    logger.warning(f"保活ping失败，丢弃该连接: {e}")
+                    self._close_quietly(conn)
+                    continue
+                with self._lock:
+                    self._idle.append((conn, time.monotonic()))
+
+    def close(self):
+        """关闭连接池及全部空闲连接"""
+        self._closed = True
+        self._stop.set()
+        with self._lock:
+            idle = list(self._idle)
+            self._idle.clear()
+        for conn, _ in idle:
+            self._close_quietly(conn)
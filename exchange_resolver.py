@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+股票代码交易所前缀解析
+功能：
+1. 按A股代码段推断新浪接口使用的交易所前缀：sh（上交所）、sz（深交所）、bj（北交所）
+2. 请求成功的前缀记录在本地JSON文件中，以后的运行直接使用，每只股票只需一次请求
+3. 推断失败时按其余前缀和不带前缀的代码依次回退
+"""
+
+import os
+import json
+import logging
+import threading
+from typing import Dict, List, Optional
+
+from config import EXCHANGE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# 代码前缀 -> 交易所前缀，按前缀长度从长到短匹配
+CODE_RANGES = {
+    '600': 'sh', '601': 'sh', '603': 'sh', '605': 'sh',  # 沪市主板
+    '688': 'sh', '689': 'sh',                            # 科创板
+    '900': 'sh',                                         # 沪市B股
+    '000': 'sz', '001': 'sz', '002': 'sz', '003': 'sz',  # 深市主板
+    '300': 'sz', '301': 'sz',                            # 创业板
+    '200': 'sz',                                         # 深市B股
+    '43': 'bj', '83': 'bj', '87': 'bj', '88': 'bj', '92': 'bj',  # 北交所
+}
+PREFIXES = ('sh', 'sz', 'bj')
+
+
+def exchange_prefix(stock_code: str) -> Optional[str]:
+    """
+    按代码段推断交易所前缀
+
+    Args:
+        stock_code: 6位股票代码
+
+    Returns:
+        str: sh、sz或bj，无法推断时返回None
+    """
+    code = str(stock_code).strip()
+    for length in (3, 2):
+        prefix = CODE_RANGES.get(code[:length])
+        if prefix is not None:
+            return prefix
+    return None
+
+
+class ExchangeResolver:
+    """交易所前缀解析类，线程安全，记录请求成功的前缀"""
+
+    def __init__(self, path: str = None, save_every: int = None):
+        """
+        加载已确认的前缀映射
+
+        Args:
+            path: 映射文件路径，默认取EXCHANGE_CONFIG['path']；为空字符串时不读写文件
+            save_every: 每新确认多少个股票写一次文件，默认取EXCHANGE_CONFIG['save_every']
+        """
+        self.path = EXCHANGE_CONFIG['path'] if path is None else path
+        self.save_every = save_every or EXCHANGE_CONFIG['save_every']
+        self._lock = threading.Lock()
+        self._known: Dict[str, str] = {}  # 股票代码 -> 前缀，不带前缀的代码请求成功时为空字符串
+        self._dirty = 0
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._known = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.warning(f"读取交易所前缀映射失败，重新学习: {e}")
+
+    def __len__(self) -> int:
+        return len(self._known)
+
+    def candidates(self, stock_code: str) -> List[str]:
+        """
+        返回依次尝试的请求代码：已确认的前缀或推断的前缀在最前，其余前缀和不带前缀的代码作为回退
+
+        Args:
+            stock_code: 股票代码
+
+        Returns:
+            list: 如['sh600000', 'sz600000', 'bj600000', '600000']
+        """
+        code = str(stock_code).strip()
+        with self._lock:
+            known = self._known.get(code)
+        if known is not None:
+            first = known
+        else:
+            first = exchange_prefix(code)
+        order = [first] if first is not None else []
+        order += [p for p in PREFIXES + ('',) if p != first]
+        return [p + code for p in order]
+
+    def learn(self, stock_code: str, symbol: str):
+        """
+        记录请求成功的代码，累计save_every个新确认后写入文件
+
+        Args:
+            stock_code: 股票代码
+            symbol: 请求成功时使用的代码，如sh600000
+        """
+        code = str(stock_code).strip()
+        prefix = symbol[:len(symbol) - len(code)]
+        with self._lock:
+            if self._known.get(code) == prefix:
+                return
+            self._known[code] = prefix
+            self._dirty += 1
+            flush = self._dirty >= self.save_every
+        if flush:
+            self.save()
+
+    def save(self):
+        """把映射写入文件：先写临时文件再替换，中断时不破坏已有文件"""
+        if not self.path:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            known = dict(self._known)
+            self._dirty = 0
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(known, f, ensure_ascii=False, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.error(f"保存交易所前缀映射失败: {e}")
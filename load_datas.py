@@ -2,17 +2,18 @@
 # -*- coding: utf-8 -*-
 """
 CSV数据加载器
-将外部CSV文件数据导入到MySQL数据库表中
+将外部CSV文件数据导入到MySQL数据库表中，也可以导入本地SQLite数据库文件（见config.SQLITE_CONFIG）
 """
 
 import csv
-import pymysql
 import logging
 import argparse
 import os
 import sys
 from typing import List, Dict, Any
-from config import DB_CONFIG
+from config import DB_CONFIG, SQLITE_CONFIG
+from backends import create_backend
+from schema import TABLE_SPECS, DATE_COLUMNS, build_create_table_sql, build_index_sql
 import pandas as pd
 
 # 配置日志
@@ -37,6 +38,7 @@ class CSVDataLoader:
             db_config: 数据库配置字典
         """
         self.db_config = db_config
+        self.backend = create_backend(db_config)
         self.connection = None
         self.cursor = None
     
@@ -48,17 +50,9 @@ class CSVDataLoader:
             bool: 连接成功返回True，失败返回False
         """
         try:
-            self.connection = pymysql.connect(
-                host=self.db_config['host'],
-                port=self.db_config['port'],
-                user=self.db_config['user'],
-                password=self.db_config['password'],
-                database=self.db_config['database'],
-                charset='utf8mb4',
-                cursorclass=pymysql.cursors.DictCursor
-            )
+            self.connection = self.backend.connect()
             self.cursor = self.connection.cursor()
-            logger.info("成功连接到MySQL数据库")
+            logger.info(f"成功连接到{self.backend.name}数据库")
             return True
         except Exception as e:
             logger.error(f"数据库连接失败: {e}")
@@ -130,8 +124,11 @@ class CSVDataLoader:
                 sample = file.read(1024)
                 file.seek(0)
                 
-                # 尝试不同的分隔符
-                dialect = csv.Sniffer().sniff(sample)
+                # 尝试不同的分隔符，无法识别时（如首行超过采样长度）按逗号分隔处理
+                try:
+                    dialect = csv.Sniffer().sniff(sample)
+                except csv.Error:
+                    dialect = csv.excel
                 
                 reader = csv.DictReader(file, dialect=dialect)
                 data = list(reader)
@@ -192,17 +189,24 @@ class CSVDataLoader:
         """
         try:
             # 检查表是否存在
-            self.cursor.execute(f"SHOW TABLES LIKE '{table_name}'")
-            table_exists = self.cursor.fetchone() is not None
+            table_exists = self.backend.table_exists(self.cursor, table_name)
             
             if not table_exists:
-                # 创建表，所有字段都设为VARCHAR(255)
-                columns = [f"`{header}` VARCHAR(255)" for header in headers]
-                create_table_sql = f"CREATE TABLE `{table_name}` (\n"
-                create_table_sql += ",\n".join(columns)
-                create_table_sql += "\n) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+                index_sqls = []
+                if table_name in TABLE_SPECS:
+                    # 已知表使用带类型和主键的表结构
+                    create_table_sql = build_create_table_sql(table_name, headers, self.backend.name)
+                    index_sqls = build_index_sql(table_name, self.backend.name)
+                else:
+                    # 其他表所有字段都设为VARCHAR(255)
+                    columns = [f"`{header}` VARCHAR(255)" for header in headers]
+                    create_table_sql = f"CREATE TABLE `{table_name}` (\n"
+                    create_table_sql += ",\n".join(columns)
+                    create_table_sql += "\n) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
                 
                 self.cursor.execute(create_table_sql)
+                for index_sql in index_sqls:
+                    self.cursor.execute(index_sql)
                 self.connection.commit()
                 logger.info(f"成功创建表: {table_name}")
             else:
@@ -236,6 +240,8 @@ class CSVDataLoader:
             columns = ", ".join([f"`{header}`" for header in headers])
             ## insert_sql = f"INSERT INTO `{table_name}` ({columns}) VALUES ({placeholders})"
             insert_sql = f"INSERT INTO `{table_name}` VALUES ({placeholders})"
+            # 带类型的表中日期列不接受'0'，空日期写入NULL
+            typed = table_name in TABLE_SPECS
             
             # 批量插入数据
             batch_size = 500
@@ -246,7 +252,8 @@ class CSVDataLoader:
                 batch_values = []
                 
                 for row in batch:
-                    values = [row[header] for header in headers]
+                    values = [None if typed and header in DATE_COLUMNS and row[header] == '0' else row[header]
+                              for header in headers]
                     batch_values.append(values)
                 
                 try:
@@ -304,6 +311,10 @@ class CSVDataLoader:
             
             logger.info(f"数据预处理完成，共处理 {len(processed_data)} 行")
             
+            headers = [header.lstrip('\ufeff') for header in processed_data[0].keys()]
+            if not self.create_table_if_not_exists(table_name, headers):
+                return False
+            
             # 插入数据到数据库
             success = self.insert_data(table_name, processed_data)
             
@@ -313,9 +324,9 @@ class CSVDataLoader:
             # 确保关闭连接
             self.close()
 
-def load_csv_datas(csv_file, table_name):    
+def load_csv_datas(csv_file, table_name, db_config=DB_CONFIG):    
     # 创建数据加载器
-    loader = CSVDataLoader(DB_CONFIG)
+    loader = CSVDataLoader(db_config)
     # 执行数据加载
     success = loader.load_file_to_mysql(csv_file, table_name, 'csv')
     
@@ -325,9 +336,9 @@ def load_csv_datas(csv_file, table_name):
         logger.error("数据加载失败！")
         sys.exit(1)
 
-def load_xlsx_datas(xlsx_file, table_name):    
+def load_xlsx_datas(xlsx_file, table_name, db_config=DB_CONFIG):    
     # 创建数据加载器
-    loader = CSVDataLoader(DB_CONFIG)
+    loader = CSVDataLoader(db_config)
     # 执行数据加载
     success = loader.load_file_to_mysql(xlsx_file, table_name, 'xlsx')
     
@@ -343,12 +354,15 @@ def main():
     parser.add_argument('csv_file', help='CSV文件路径')
     parser.add_argument('table_name', help='目标表名')
     parser.add_argument('--config', default='config.py', help='配置文件路径')
+    parser.add_argument('--sqlite', nargs='?', const=SQLITE_CONFIG['path'], default=None,
+                        help='导入本地SQLite数据库文件，默认路径取SQLITE_CONFIG')
     args = parser.parse_args()
     # 检查文件是否存在
     if not os.path.exists(args.csv_file):
         logger.error(f"CSV文件不存在: {args.csv_file}")
         sys.exit(1)
-    load_csv_datas(args.csv_file, args.table_name)
+    db_config = dict(SQLITE_CONFIG, path=args.sqlite) if args.sqlite else DB_CONFIG
+    load_csv_datas(args.csv_file, args.table_name, db_config)
 
 
 # 使用示例
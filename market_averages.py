@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+市场平均指标预计算
+功能：
+1. 一次遍历balance、profit表，按Accper分组计算所有季度的市场平均roc、rooc、存货周转率
+2. 用as-of索引取各季度末的股价和股本，计算季度末的市场平均pb
+3. 结果写入汇总表market_avg（快照模式下写入快照目录的market_avg.csv），启动时直接加载预热缓存
+4. 汇总结果同时记录计算时各报告期的balance、profit行数和内容指纹，以及截至各报告期的trade、shares内容指纹；
+   启动时任一项变化（新报告期、补充披露、报表更正、股价或股本修订）则重新计算
+5. 数据库汇总表先写入暂存表再整表替换，写入失败时保留原表
+
+用法：
+    python market_averages.py
+"""
+
+import os
+import logging
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# 汇总表名及各指标列
+MARKET_AVG_TABLE = 'market_avg'
+MARKET_AVG_COLUMNS = ['roc_avg', 'rooc_avg', 'it_avg', 'pb_avg']
+# 计算时各报告期的报表行数和内容指纹，用于判断汇总结果是否过期
+SOURCE_COUNT_COLUMNS = ['balance_rows', 'profit_rows']
+SOURCE_HASH_COLUMNS = ['balance_hash', 'profit_hash', 'trade_hash', 'shares_hash']
+SOURCE_COLUMNS = SOURCE_COUNT_COLUMNS + SOURCE_HASH_COLUMNS
+# 季度末pb按as-of查询的表：(表名, 日期列, 数值列)
+ASOF_SOURCES = [('trade', 'Trddt', 'Clsprc'), ('shares', 'Reptdt', 'Nshrttl')]
+# 指纹为各行32位哈希之和，取模后保存为double不丢精度
+_HASH_MODULUS = 2 ** 53
+
+# 计算市场平均值用到的报表列
+BALANCE_COLUMNS = ['Stkcd', 'Accper', 'ParOwnEquity', 'ShortBorrow', 'NonCurLia1Y', 'LTBorrow', 'BondPay',
+                   'AcctRecNet', 'PrepayNet', 'InventNet', 'NotesRecNet', 'AcctPay', 'AdvFromCust',
+                   'NotesPay', 'EmpBenefitPay', 'TaxPay']
+PROFIT_COLUMNS = ['Stkcd', 'Accper', 'OpProfit', 'IncomeTax', 'ProfitBefTax', 'OpCost']
+
+
+def _numeric(df: pd.DataFrame) -> pd.DataFrame:
+    """将除Stkcd、Accper外的列转换为浮点数"""
+    df = df.copy()
+    for col in df.columns:
+        if col not in ('Stkcd', 'Accper'):
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    df['Accper'] = df['Accper'].astype(str)
+    return df
+
+
+def _group_mean(values: pd.Series, keys: pd.Series) -> pd.Series:
+    """按keys分组求平均，忽略NaN和无穷值，与SQL的AVG忽略NULL一致"""
+    values = pd.Series(values.to_numpy(dtype='float64'), index=keys.to_numpy())
+    values = values.replace([np.inf, -np.inf], np.nan).dropna()
+    return values.groupby(level=0).mean()
+
+
+def compute_pb_avg(balance_q: pd.DataFrame, price_index, shares_index, date: str) -> float:
+    """
+    计算某一季度的市场平均pb
+
+    Args:
+        balance_q: 该季度的资产负债表数据，包含Stkcd、ParOwnEquity列
+        price_index: 收盘价as-of索引
+        shares_index: 总股本as-of索引
+        date: 取股价和股本的日期
+
+    Returns:
+        float: 市场平均pb
+    """
+    price = price_index.lookup_many(balance_q['Stkcd'], date)
+    shares = shares_index.lookup_many(balance_q['Stkcd'], date)
+    equity = pd.to_numeric(balance_q['ParOwnEquity'], errors='coerce').to_numpy(dtype='float64')
+    bvps = equity / np.where(shares == 0, np.nan, shares)
+    pb = pd.Series(price / np.where(bvps == 0, np.nan, bvps)).replace([np.inf, -np.inf], np.nan).dropna()
+    return float(pb.mean()) if len(pb) else np.nan
+
+
+def compute_market_averages(balance: pd.DataFrame, profit: pd.DataFrame,
+                            price_index=None, shares_index=None) -> pd.DataFrame:
+    """
+    一次计算所有季度的市场平均指标
+
+    Args:
+        balance: 资产负债表数据，至少包含BALANCE_COLUMNS
+        profit: 利润表数据，至少包含PROFIT_COLUMNS
+        price_index: 可选的收盘价as-of索引，与shares_index同时提供时计算季度末pb
+        shares_index: 可选的总股本as-of索引
+
+    Returns:
+        pd.DataFrame: 以Accper为索引、列为MARKET_AVG_COLUMNS的汇总数据，按Accper升序
+    """
+    if balance.empty or profit.empty:
+        return pd.DataFrame(columns=MARKET_AVG_COLUMNS)
+    b = _numeric(balance)
+    p = _numeric(profit)
+    m = b.merge(p, on=['Stkcd', 'Accper'])
+
+    nopat = m['OpProfit'] * (1 - m['IncomeTax'] / m['ProfitBefTax'].replace(0, np.nan))
+    invested = m['ParOwnEquity'] + m['ShortBorrow'] + m['NonCurLia1Y'] + m['LTBorrow'] + m['BondPay']
+    roc = nopat / invested.replace(0, np.nan)
+
+    nowc = (m['AcctRecNet'] + m['PrepayNet'] + m['InventNet'] + m['NotesRecNet']
+            - m['AcctPay'] - m['AdvFromCust'] - m['NotesPay'] - m['EmpBenefitPay'] - m['TaxPay'])
+    mask = (nopat > 0) & (nowc > 0)
+
+    # 存货周转率：2 * 本季营业成本 / (本季存货 + 该股票上一季存货)
+    inv = (b[['Stkcd', 'Accper', 'InventNet']]
+           .drop_duplicates(['Stkcd', 'Accper'])
+           .sort_values(['Stkcd', 'Accper'], kind='mergesort'))
+    inv['PrevInventNet'] = inv.groupby('Stkcd')['InventNet'].shift(1)
+    it = inv.merge(p[['Stkcd', 'Accper', 'OpCost']], on=['Stkcd', 'Accper'])
+    it_value = 2 * it['OpCost'] / (it['InventNet'] + it['PrevInventNet']).replace(0, np.nan)
+
+    result = pd.DataFrame({
+        'roc_avg': _group_mean(roc, m['Accper']),
+        'rooc_avg': _group_mean((nopat / nowc)[mask], m['Accper'][mask]),
+        'it_avg': _group_mean(it_value, it['Accper']),
+    }).reindex(sorted(b['Accper'].unique()))
+    result['pb_avg'] = np.nan
+
+    if price_index is not None and shares_index is not None:
+        for quarter, group in b[['Stkcd', 'Accper', 'ParOwnEquity']].groupby('Accper'):
+            result.loc[quarter, 'pb_avg'] = compute_pb_avg(group, price_index, shares_index, quarter)
+
+    result.index.name = 'Accper'
+    return result[MARKET_AVG_COLUMNS]
+
+
+def load_statement_frames(repo) -> tuple:
+    """
+    读取计算市场平均值所需的资产负债表和利润表列
+
+    Args:
+        repo: FinancialDataRepository实例，存在快照时从快照读取
+
+    Returns:
+        tuple: (balance, profit)两个DataFrame
+    """
+    if repo.snapshot is not None:
+        return (repo.snapshot.read_table('balance')[BALANCE_COLUMNS],
+                repo.snapshot.read_table('profit')[PROFIT_COLUMNS])
+    balance = repo._fetch_frame(f"SELECT {', '.join(BALANCE_COLUMNS)} FROM balance")
+    profit = repo._fetch_frame(f"SELECT {', '.join(PROFIT_COLUMNS)} FROM profit")
+    return balance, profit
+
+
+def _csv_path(repo) -> str:
+    return os.path.join(repo.snapshot.root, f"{MARKET_AVG_TABLE}.csv")
+
+
+def build_market_avg_table_sql(dialect: str = 'mysql', table: str = MARKET_AVG_TABLE) -> str:
+    """生成market_avg表（或同结构的暂存表）的建表语句，SQLite不支持字段注释"""
+    columns = [('Accper', 'varchar(30) NOT NULL', '报告期'),
+               ('roc_avg', 'double', '市场平均资本报酬率'),
+               ('rooc_avg', 'double', '市场平均营运报酬率'),
+               ('it_avg', 'double', '市场平均存货周转率'),
+               ('pb_avg', 'double', '季度末市场平均股价净值比'),
+               ('balance_rows', 'int', '计算时该报告期的balance行数'),
+               ('profit_rows', 'int', '计算时该报告期的profit行数'),
+               ('balance_hash', 'bigint', '计算时该报告期的balance内容指纹'),
+               ('profit_hash', 'bigint', '计算时该报告期的profit内容指纹'),
+               ('trade_hash', 'bigint', '计算时截至该报告期的trade内容指纹'),
+               ('shares_hash', 'bigint', '计算时截至该报告期的shares内容指纹')]
+    lines = [f"{name} {type_} COMMENT '{comment}'" if dialect == 'mysql' else f"{name} {type_}"
+             for name, type_, comment in columns]
+    lines.append("primary key(Accper)")
+    return f"CREATE TABLE IF NOT EXISTS {table} (\n    " + ",\n    ".join(lines) + "\n)"
+
+
+def _row_hashes(df: pd.DataFrame, columns: list) -> np.ndarray:
+    """每行内容的32位哈希"""
+    hashes = pd.util.hash_pandas_object(df[columns].astype(str), index=False).to_numpy(dtype='uint64')
+    return (hashes & np.uint64(0xFFFFFFFF)).astype('int64')
+
+
+def _row_hash_sql(columns: list) -> str:
+    """每行内容的32位哈希的SQL表达式，SQLite后端注册了同名的crc32、concat_ws函数"""
+    fields = ', '.join(f"COALESCE({c}, '')" for c in columns)
+    return f"CRC32(CONCAT_WS(',', {fields}))"
+
+
+def _asof_hashes(monthly: pd.Series, quarters: list) -> np.ndarray:
+    """
+    把按月（YYYY-MM）汇总的行情指纹累计到各报告期：as-of查询可能取到报告期所在月及之前的任意一行
+
+    Args:
+        monthly: 以月份为索引的指纹
+        quarters: 报告期列表，升序
+
+    Returns:
+        np.ndarray: 与quarters等长的累计指纹
+    """
+    monthly = monthly.groupby(level=0).sum().sort_index()
+    if monthly.empty:
+        return np.zeros(len(quarters), dtype='int64')
+    cumulative = np.cumsum(monthly.to_numpy(dtype='int64')) % _HASH_MODULUS
+    pos = np.searchsorted(monthly.index.to_numpy(dtype=str), [q[:7] for q in quarters], side='right') - 1
+    return np.where(pos >= 0, cumulative[np.maximum(pos, 0)], 0)
+
+
+def _assemble_source_state(statements: dict, monthly: dict) -> pd.DataFrame:
+    state = pd.DataFrame(statements)
+    state = state.reindex(sorted(state.index.astype(str)))
+    for table, _, _ in ASOF_SOURCES:
+        state[f'{table}_hash'] = _asof_hashes(monthly.get(table, pd.Series(dtype='int64')), list(state.index))
+    state = state.reindex(columns=SOURCE_COLUMNS).fillna(0).astype('int64')
+    state[SOURCE_HASH_COLUMNS] %= _HASH_MODULUS
+    state.index.name = 'Accper'
+    return state
+
+
+def summarize_sources(balance: pd.DataFrame, profit: pd.DataFrame,
+                      trade: pd.DataFrame = None, shares: pd.DataFrame = None) -> pd.DataFrame:
+    """
+    统计各报告期的资产负债表、利润表行数和内容指纹，以及截至各报告期的行情、股本内容指纹
+
+    Args:
+        balance: 资产负债表数据，至少包含BALANCE_COLUMNS
+        profit: 利润表数据，至少包含PROFIT_COLUMNS
+        trade: 可选的行情数据，包含Stkcd、Trddt、Clsprc
+        shares: 可选的股本数据，包含Stkcd、Reptdt、Nshrttl
+
+    Returns:
+        pd.DataFrame: 以Accper为索引、列为SOURCE_COLUMNS，缺少的报告期或表为0
+    """
+    statements = {}
+    for table, df, columns in (('balance', balance, BALANCE_COLUMNS), ('profit', profit, PROFIT_COLUMNS)):
+        keys = df['Accper'].astype(str).to_numpy()
+        statements[f'{table}_rows'] = pd.Series(1, index=keys, dtype='int64').groupby(level=0).sum()
+        statements[f'{table}_hash'] = pd.Series(_row_hashes(df, columns), index=keys).groupby(level=0).sum()
+    monthly = {}
+    for (table, date_col, value_col), df in zip(ASOF_SOURCES, (trade, shares)):
+        if df is not None and not df.empty:
+            monthly[table] = pd.Series(_row_hashes(df, ['Stkcd', date_col, value_col]),
+                                       index=df[date_col].astype(str).str[:7].to_numpy())
+    return _assemble_source_state(statements, monthly)
+
+
+def source_state(repo) -> pd.DataFrame:
+    """
+    查询数据库（或快照）当前各报告期的报表行数和内容指纹
+
+    Args:
+        repo: FinancialDataRepository实例
+
+    Returns:
+        pd.DataFrame: 同summarize_sources，查询失败时返回空DataFrame
+    """
+    try:
+        if repo.snapshot is not None:
+            return summarize_sources(repo.snapshot.read_table('balance', BALANCE_COLUMNS),
+                                     repo.snapshot.read_table('profit', PROFIT_COLUMNS),
+                                     *[repo.snapshot.read_table(table, ['Stkcd', date_col, value_col])
+                                       for table, date_col, value_col in ASOF_SOURCES])
+        statements, monthly = {}, {}
+        for table, columns in (('balance', BALANCE_COLUMNS), ('profit', PROFIT_COLUMNS)):
+            rows = repo._fetchall(f"SELECT Accper, COUNT(*) AS n, SUM({_row_hash_sql(columns)}) AS h "
+                                  f"FROM {table} GROUP BY Accper") or []
+            statements[f'{table}_rows'] = pd.Series({str(r['Accper']): int(r['n']) for r in rows}, dtype='int64')
+            statements[f'{table}_hash'] = pd.Series({str(r['Accper']): int(r['h'] or 0) for r in rows}, dtype='int64')
+        for table, date_col, value_col in ASOF_SOURCES:
+            month = f"SUBSTR({date_col}, 1, 7)"
+            rows = repo._fetchall(f"SELECT {month} AS ym, SUM({_row_hash_sql(['Stkcd', date_col, value_col])}) AS h "
+                                  f"FROM {table} GROUP BY {month}") or []
+            monthly[table] = pd.Series({str(r['ym']): int(r['h'] or 0) for r in rows}, dtype='int64')
+        return _assemble_source_state(statements, monthly)
+    except Exception as e:
+        logger.warning(f"查询各报告期的报表行数和内容指纹失败: {e}")
+        return pd.DataFrame(columns=SOURCE_COLUMNS)
+
+
+def stale_quarters(saved: pd.DataFrame, current: pd.DataFrame) -> list:
+    """
+    比较保存时和当前的各报告期行数和内容指纹，返回需要重新计算的报告期
+
+    Args:
+        saved: load_market_averages的返回值，包含SOURCE_COLUMNS
+        current: source_state的返回值
+
+    Returns:
+        list: balance中存在、但未保存或行数、指纹已变化的报告期，升序
+    """
+    current = current[current['balance_rows'] > 0]
+    known = saved.reindex(current.index)[SOURCE_COLUMNS]
+    changed = (known.to_numpy(dtype='float64') != current[SOURCE_COLUMNS].to_numpy(dtype='float64')).any(axis=1)
+    return sorted(current.index[changed])
+
+
+def _replace_table(repo, cursor, staging: str, table: str):
+    """用暂存表替换正式表：MySQL的RENAME TABLE原子地完成交换，SQLite在显式事务中执行DDL"""
+    old = f"{table}_old"
+    cursor.execute(f"DROP TABLE IF EXISTS {old}")
+    exists = repo.backend.table_exists(cursor, table)
+    if repo.backend.name == 'mysql':
+        renames = ([f"{table} TO {old}"] if exists else []) + [f"{staging} TO {table}"]
+        cursor.execute(f"RENAME TABLE {', '.join(renames)}")
+    else:
+        cursor.execute("BEGIN")
+        if exists:
+            cursor.execute(f"ALTER TABLE {table} RENAME TO {old}")
+        cursor.execute(f"ALTER TABLE {staging} RENAME TO {table}")
+    cursor.execute(f"DROP TABLE IF EXISTS {old}")
+
+
+def save_market_averages(repo, averages: pd.DataFrame):
+    """
+    保存预计算结果：快照模式写入market_avg.csv，否则写入暂存表后替换数据库market_avg表
+
+    Args:
+        repo: FinancialDataRepository实例
+        averages: build_market_averages的返回值，包含MARKET_AVG_COLUMNS和SOURCE_COLUMNS
+    """
+    columns = MARKET_AVG_COLUMNS + SOURCE_COLUMNS
+    if repo.snapshot is not None:
+        averages[columns].to_csv(_csv_path(repo))
+        return
+    rows = [(accper, *[None if pd.isna(v) else float(v) for v in row[:len(MARKET_AVG_COLUMNS)]],
+             *[int(v) for v in row[len(MARKET_AVG_COLUMNS):]])
+            for accper, row in zip(averages.index, averages[columns].itertuples(index=False))]
+    staging = f"{MARKET_AVG_TABLE}_new"
+    try:
+        with repo.connection.cursor() as cursor:
+            # MySQL的DDL会隐式提交，先完整写入暂存表，失败时原表不受影响；新建表也使旧版本缺少行数、指纹列的表得到升级
+            cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+            cursor.execute(build_market_avg_table_sql(repo.backend.name, staging))
+            cursor.executemany(f"""
+            INSERT INTO {staging}(Accper, {', '.join(columns)})
+            VALUES (%s, {', '.join(['%s'] * len(columns))})
+            """, rows)
+        repo.connection.commit()
+        with repo.connection.cursor() as cursor:
+            _replace_table(repo, cursor, staging, MARKET_AVG_TABLE)
+        repo.connection.commit()
+        logger.info(f"已写入{len(rows)}个季度的市场平均值到{MARKET_AVG_TABLE}表")
+    except Exception as e:
+        logger.error(f"写入{MARKET_AVG_TABLE}表失败: {e}")
+        repo.connection.rollback()
+
+
+def load_market_averages(repo) -> pd.DataFrame:
+    """
+    加载已保存的预计算结果
+
+    Args:
+        repo: FinancialDataRepository实例
+
+    Returns:
+        pd.DataFrame: 以Accper为索引、列为MARKET_AVG_COLUMNS和SOURCE_COLUMNS的汇总数据，
+                      不存在或缺少行数、指纹列（旧版本保存）时返回空DataFrame
+    """
+    columns = MARKET_AVG_COLUMNS + SOURCE_COLUMNS
+    try:
+        if repo.snapshot is not None:
+            path = _csv_path(repo)
+            if not os.path.exists(path):
+                return pd.DataFrame(columns=columns)
+            df = pd.read_csv(path, dtype={'Accper': str}).set_index('Accper')
+        else:
+            rows = repo._fetchall(f"SELECT Accper, {', '.join(columns)} FROM {MARKET_AVG_TABLE}")
+            df = pd.DataFrame(rows or [], columns=['Accper'] + columns).set_index('Accper')
+        df.index = df.index.astype(str)
+        return df[columns].astype('float64').sort_index()
+    except Exception as e:
+        logger.warning(f"加载{MARKET_AVG_TABLE}失败: {e}")
+        return pd.DataFrame(columns=columns)
+
+
+def build_market_averages(repo, save: bool = True) -> pd.DataFrame:
+    """
+    预计算所有季度的市场平均值并（可选）保存
+
+    Args:
+        repo: FinancialDataRepository实例
+        save: 是否保存结果
+
+    Returns:
+        pd.DataFrame: 以Accper为索引的汇总数据，附带计算时各报告期的报表行数和内容指纹
+    """
+    # 先统计再读取数据，读取期间发生的改动使下次启动时的指纹不一致而重新计算
+    state = source_state(repo)
+    if repo.price_index is None or repo.shares_index is None:
+        repo.load_asof_indexes()
+    balance, profit = load_statement_frames(repo)
+    averages = compute_market_averages(balance, profit, repo.price_index, repo.shares_index)
+    averages = averages.join(state).fillna({c: 0 for c in SOURCE_COLUMNS})
+    logger.info(f"已预计算{len(averages)}个季度的市场平均值")
+    if save:
+        save_market_averages(repo, averages)
+    return averages
+
+
+def refresh_market_averages(repo) -> pd.DataFrame:
+    """
+    加载已保存的预计算结果；没有保存结果，或有报告期未保存、行数或内容指纹与保存时不同时重新计算并保存
+
+    Args:
+        repo: FinancialDataRepository实例
+
+    Returns:
+        pd.DataFrame: 以Accper为索引的汇总数据
+    """
+    saved = load_market_averages(repo)
+    if not saved.empty:
+        current = source_state(repo)
+        if current.empty:
+            return saved
+        stale = stale_quarters(saved, current)
+        if not stale:
+            return saved
+        logger.info(f"{len(stale)}个报告期的报表数据在预计算之后有变化（最早{stale[0]}），重新计算市场平均值")
+        # 已加载的as-of索引可能早于股价、股本的修订
+        repo.load_asof_indexes()
+    return build_market_averages(repo)
+
+
+def main():
+    """主函数：预计算并保存全部季度的市场平均值"""
+    from config import DB_CONFIG
+    from miller_value import FinancialDataRepository
+
+    repo = FinancialDataRepository(DB_CONFIG)
+    if not repo.connect():
+        return
+    try:
+        build_market_averages(repo)
+    finally:
+        repo.close()
+
+
+if __name__ == "__main__":
+    main()
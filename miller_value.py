@@ -20,12 +20,26 @@ D.最近四季股价自由现金流量比< 1/通货膨胀率。
 E.市值/10 年自由现金流量折现值< 1.0。
 '''
 
+import os
+import time
+import bisect
 import logging
-import pymysql
+import weakref
+import threading
 import pandas as pd
+from contextlib import contextmanager
 import numpy as np
 from typing import List
-from config import DB_CONFIG
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from config import DB_CONFIG, POOL_CONFIG, CHECKPOINT_CONFIG
+from connection_pool import ConnectionPool
+from backends import create_backend
+from columnar_fetch import fetch_frame
+from asof_index import AsOfIndex
+import market_averages
+from result_writer import ResultWriter
+from schema import build_upsert_sql
+from batch_engine import build_ttm_index, five_year_avg_pe, evaluate_selection_batch, evaluate_buy_batch
 # 计算从start_date开始的90天每一天的日期
 from datetime import datetime, timedelta
 
@@ -39,23 +53,50 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class _ThreadConnection:
+    """线程持有的连接和游标；线程结束后线程局部变量被回收时，由weakref.finalize把连接归还连接池"""
+
+    def __init__(self, pool: ConnectionPool, conn):
+        self.connection = conn
+        self.cursor = None
+        # 回调不能引用self，否则对象永远不会被回收
+        self.finalizer = weakref.finalize(self, pool.release, conn)
+        self.finalizer.atexit = False
+
+
 class FinancialDataRepository:
     """财务数据仓库类，负责从数据库获取股票财务数据"""
-    
-    def __init__(self, db_config: dict):
+
+    # 支持面板查询的报表名
+    STATEMENT_TABLES = ('profit', 'balance', 'cash_flow')
+    # 报表的键列，按列投影查询时总是包含
+    KEY_COLUMNS = ('Stkcd', 'Accper')
+
+    def __init__(self, db_config: dict, snapshot=None, pool_size: int = None):
         """
         初始化财务数据仓库
         
         Args:
-            db_config: 数据库连接配置字典，包含host、port、user、password、database等字段
+            db_config: 数据库连接配置字典，包含host、port、user、password、database等字段；
+                       backend为sqlite时只需path字段，见backends.create_backend
+            snapshot: 可选的本地快照（snapshot_store.SnapshotStore），提供时get_*方法直接从快照读取
+            pool_size: 连接池最大连接数，默认取POOL_CONFIG['max_size']
         """
         self.db_config = db_config
-        self.connection = None
-        self.cursor = None
-        self.roc_avg_cache = {}  # 内存缓存字典，存储(end_date, roc_avg)键值对
-        self.rooc_avg_cache = {}  # 内存缓存字典，存储(end_date, rooc_avg)键值对
-        self.pb_avg_cache = {}  # 内存缓存字典，存储(end_date, pb_avg)键值对
-        self.inventory_turnover_cache = {}  # 内存缓存字典，存储(end_date, inventory_turnover)键值对
+        self.backend = create_backend(db_config)
+        self.snapshot = snapshot
+        self.pool_size = pool_size or POOL_CONFIG['max_size']
+        self.pool = None
+        self.price_index = None  # trade.Clsprc的as-of索引，调用load_asof_indexes后可用
+        self.shares_index = None  # shares.Nshrttl的as-of索引
+        self.profit_ttm_index = None  # profit.ParNetProfit近四季之和的as-of索引
+        self._local = threading.local()  # 每个线程各自持有的_ThreadConnection
+        self._cache_lock = threading.Lock()  # 保护下面四个平均值缓存
+        self._quarters = None  # balance表中全部Accper，升序，用于把日期解析为报告期
+        self.roc_avg_cache = {}  # 内存缓存字典，存储(报告期, roc_avg)键值对
+        self.rooc_avg_cache = {}  # 内存缓存字典，存储(报告期, rooc_avg)键值对
+        self.pb_avg_cache = {}  # 内存缓存字典，存储(end_date, pb_avg)键值对，pb依赖当日股价
+        self.inventory_turnover_cache = {}  # 内存缓存字典，存储(报告期, inventory_turnover)键值对
 
     def connect(self) -> bool:
         """
@@ -65,29 +106,214 @@ class FinancialDataRepository:
             bool: 连接成功返回True，失败返回False
         """
         try:
-            self.connection = pymysql.connect(
-                host=self.db_config.get('host', 'localhost'),
-                port=self.db_config.get('port', 3306),
-                user=self.db_config.get('user', 'root'),
-                password=self.db_config.get('password', ''),
-                database=self.db_config.get('database', 'stock'),
-                charset='utf8mb4',
-                cursorclass=pymysql.cursors.DictCursor
+            self.pool = ConnectionPool(
+                self.db_config,
+                max_size=self.pool_size,
+                checkout_timeout=POOL_CONFIG['checkout_timeout'],
+                health_check_after=POOL_CONFIG['health_check_after'],
+                keepalive_interval=POOL_CONFIG['keepalive_interval'],
+                backend=self.backend
             )
-            self.cursor = self.connection.cursor()
+            # 为当前线程取出一个连接，验证数据库可用
+            self.connection
             return True
         except Exception as e:
             logger.error(f"数据库连接失败: {e}")
+            if self.pool is not None:
+                self.pool.close()
+                self.pool = None
             return False
 
+    @property
+    def connection(self):
+        """当前线程持有的数据库连接，首次访问时从连接池取出；线程结束时未归还的连接会被回收"""
+        if self.pool is None:
+            return None
+        held = getattr(self._local, 'held', None)
+        if held is None:
+            held = _ThreadConnection(self.pool, self.pool.acquire())
+            self._local.held = held
+        return held.connection
+
+    @property
+    def cursor(self):
+        """当前线程持有的游标"""
+        if self.pool is None:
+            return None
+        conn = self.connection
+        held = self._local.held
+        if held.cursor is None:
+            held.cursor = conn.cursor()
+        return held.cursor
+
+    def release(self, broken: bool = False):
+        """
+        将当前线程持有的连接归还连接池，工作线程结束前应调用（或使用session）
+
+        Args:
+            broken: 连接已失效时为True，归还时直接关闭
+        """
+        held = getattr(self._local, 'held', None)
+        if held is None:
+            return
+        self._local.held = None
+        held.finalizer.detach()
+        if held.cursor is not None and not broken:
+            try:
+                held.cursor.close()
+            except Exception:
+                pass
+        self.pool.release(held.connection, broken=broken)
+
+    @contextmanager
+    def session(self):
+        """
+        在当前线程中借用连接的上下文管理器，退出时归还该线程持有的连接
+
+        用法：
+            with repo.session():
+                repo.get_profit_quarterly(...)
+        """
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def _execute(self, sql: str, params=None, fetch: str = 'all'):
+        """
+        执行查询并返回结果，连接断开（后端的disconnect_errors）时换一个连接重试一次
+
+        Args:
+            sql: SQL语句
+            params: 查询参数
+            fetch: 'all'返回全部行，'one'返回第一行，'frame'用元组游标按列读取并返回DataFrame
+
+        Returns:
+            list、dict或pd.DataFrame: 查询结果
+        """
+        for attempt in range(2):
+            try:
+                if fetch == 'frame':
+                    return fetch_frame(self.connection, sql, params)
+                self.cursor.execute(sql, params)
+                return self.cursor.fetchall() if fetch == 'all' else self.cursor.fetchone()
+            except self.backend.disconnect_errors as e:
+                if attempt:
+                    raise
+                logger.warning(f"数据库连接异常，重新连接后重试: {e}")
+                self.release(broken=True)
+
+    def _fetchall(self, sql: str, params=None) -> list:
+        return self._execute(sql, params, 'all')
+
+    def _fetchone(self, sql: str, params=None):
+        return self._execute(sql, params, 'one')
+
+    def _fetch_frame(self, sql: str, params=None) -> pd.DataFrame:
+        return self._execute(sql, params, 'frame')
+
+    def _cache_get(self, cache: dict, key):
+        with self._cache_lock:
+            return cache.get(key)
+
+    def _cache_put(self, cache: dict, key, value: float):
+        with self._cache_lock:
+            cache[key] = value
+
+    @classmethod
+    def select_list(cls, columns: List[str] = None, alias: str = None) -> str:
+        """
+        构造SELECT的列清单：columns为None时为*，否则为键列加columns（去重并保持顺序）
+
+        Args:
+            columns: 需要的列名列表
+            alias: 可选的表别名
+
+        Returns:
+            str: 列清单
+        """
+        prefix = f"{alias}." if alias else ""
+        if columns is None:
+            return prefix + "*"
+        names = list(dict.fromkeys(list(cls.KEY_COLUMNS) + list(columns)))
+        for name in names:
+            if not name.isidentifier():
+                raise ValueError(f"非法的列名: {name}")
+        return ", ".join(f"{prefix}`{name}`" for name in names)
+
+    def load_asof_indexes(self):
+        """
+        一次性加载收盘价、总股本和TTM净利润的as-of索引，之后的价格、股本、市值、五年平均市盈率查询不再访问数据库
+        """
+        if self.snapshot is not None:
+            self.price_index = AsOfIndex.from_snapshot(self.snapshot, 'trade', 'Clsprc')
+            self.shares_index = AsOfIndex.from_snapshot(self.snapshot, 'shares', 'Nshrttl')
+            profit = self.snapshot.read_table('profit')[['Stkcd', 'Accper', 'ParNetProfit']]
+        else:
+            self.price_index = AsOfIndex.from_repository(self, 'trade', 'Trddt', 'Clsprc')
+            self.shares_index = AsOfIndex.from_repository(self, 'shares', 'Reptdt', 'Nshrttl')
+            profit = self._fetch_frame("SELECT Stkcd, Accper, ParNetProfit FROM profit")
+        self.profit_ttm_index = build_ttm_index(profit)
+
+    def get_five_year_avg_pe_batch(self, codes: List[str], end_date: str) -> pd.Series:
+        """
+        批量计算一组股票在同一日期的五年平均市盈率
+
+        Args:
+            codes: 股票代码列表
+            end_date: 日期，格式为'YYYY-MM-DD'
+
+        Returns:
+            pd.Series: 以股票代码为索引的五年平均市盈率
+        """
+        if self.profit_ttm_index is None:
+            self.load_asof_indexes()
+        values = five_year_avg_pe(codes, end_date, self.price_index, self.shares_index, self.profit_ttm_index)
+        return pd.Series(values, index=list(codes))
+
+    def resolve_quarter(self, end_date: str):
+        """
+        将日期解析为balance表中不晚于该日期的最近一个报告期
+
+        Args:
+            end_date: 日期，格式为'YYYY-MM-DD'
+
+        Returns:
+            str: 报告期，不存在时返回None
+        """
+        if self.snapshot is not None:
+            return self.snapshot.resolve_quarter(end_date)
+        if self._quarters is None:
+            try:
+                rows = self._fetchall("SELECT DISTINCT Accper FROM balance ORDER BY Accper")
+                self._quarters = [str(row['Accper']) for row in rows]
+            except Exception as e:
+                logger.error(f"查询报告期列表失败: {e}")
+                return None
+        i = bisect.bisect_right(self._quarters, end_date)
+        return self._quarters[i - 1] if i > 0 else None
+
+    def warm_market_averages(self):
+        """
+        启动时预热四个市场平均值缓存：优先加载已保存的预计算结果，不存在或已过期时现场计算并保存
+        """
+        averages = market_averages.refresh_market_averages(self)
+        for quarter, row in averages.iterrows():
+            for cache, column in ((self.roc_avg_cache, 'roc_avg'), (self.rooc_avg_cache, 'rooc_avg'),
+                                  (self.inventory_turnover_cache, 'it_avg'), (self.pb_avg_cache, 'pb_avg')):
+                if not np.isnan(row[column]):
+                    self._cache_put(cache, quarter, float(row[column]))
+        logger.info(f"已预热{len(averages)}个报告期的市场平均值缓存")
+
     def close(self):
         """关闭数据库连接"""
-        if self.cursor:
-            self.cursor.close()
-        if self.connection:
-            self.connection.close()
+        if self.pool is not None:
+            self.release()
+            self.pool.close()
+            self.pool = None
 
-    def get_profit_quarterly(self, stock_code: str, limit: int = 12, end_date: str = None) -> pd.DataFrame:
+    def get_profit_quarterly(self, stock_code: str, limit: int = 12, end_date: str = None,
+                             columns: List[str] = None) -> pd.DataFrame:
         """
         获取季度利润表数据
         
@@ -95,6 +321,8 @@ class FinancialDataRepository:
             stock_code: 股票代码
             limit: 获取的季度数量，默认12个季度
             end_date: 截止日期（格式：YYYY-MM-DD），默认为当前日期
+            columns: 需要的列（Stkcd、Accper总是包含），默认全部列；
+                     一般传入MillerValueStrategy.required_columns('profit')
             
         Returns:
             pd.DataFrame: 季度利润表数据
@@ -102,32 +330,28 @@ class FinancialDataRepository:
         if end_date is None:
             end_date = datetime.now().strftime('%Y-%m-%d')
         
+        if self.snapshot is not None:
+            return self.snapshot.get_profit_quarterly(stock_code, limit, end_date, columns)
+
         try:
             # 构建SQL查询语句
-            sql = """
-            SELECT * FROM profit 
+            sql = f"""
+            SELECT {self.select_list(columns)} FROM profit 
             WHERE Stkcd = %s 
             AND Accper <= %s 
             ORDER BY Accper DESC 
             LIMIT %s
             """
             
-            # 执行查询
-            self.cursor.execute(sql, (stock_code, end_date, limit))
-            result = self.cursor.fetchall()
-            
-            # 转换为DataFrame
-            if result:
-                df = pd.DataFrame(result)
-                return df
-            else:   
-                return pd.DataFrame()
+            # 按列读取查询结果
+            return self._fetch_frame(sql, (stock_code, end_date, limit))
                 
         except Exception as e:
             logger.error(f"查询季度利润表数据失败: {e}")
             return pd.DataFrame()
 
-    def get_balance_quarterly(self, stock_code: str, limit: int = 12, end_date: str = None) -> pd.DataFrame:
+    def get_balance_quarterly(self, stock_code: str, limit: int = 12, end_date: str = None,
+                              columns: List[str] = None) -> pd.DataFrame:
         """
         获取季度资产负债表数据
         
@@ -135,6 +359,8 @@ class FinancialDataRepository:
             stock_code: 股票代码
             limit: 获取的季度数量，默认12个季度
             end_date: 截止日期（格式：YYYY-MM-DD），默认为当前日期
+            columns: 需要的列（Stkcd、Accper总是包含），默认全部列；
+                     一般传入MillerValueStrategy.required_columns('balance')
             
         Returns:
             pd.DataFrame: 季度资产负债表数据
@@ -142,32 +368,28 @@ class FinancialDataRepository:
         if end_date is None:
             end_date = datetime.now().strftime('%Y-%m-%d')
         
+        if self.snapshot is not None:
+            return self.snapshot.get_balance_quarterly(stock_code, limit, end_date, columns)
+
         try:
             # 构建SQL查询语句
-            sql = """
-            SELECT * FROM balance 
+            sql = f"""
+            SELECT {self.select_list(columns)} FROM balance 
             WHERE Stkcd = %s 
             AND Accper <= %s 
             ORDER BY Accper DESC 
             LIMIT %s
             """
             
-            # 执行查询
-            self.cursor.execute(sql, (stock_code, end_date, limit))
-            result = self.cursor.fetchall()
-            
-            # 转换为DataFrame
-            if result:
-                df = pd.DataFrame(result)
-                return df
-            else:
-                return pd.DataFrame()
+            # 按列读取查询结果
+            return self._fetch_frame(sql, (stock_code, end_date, limit))
                 
         except Exception as e:
             logger.error(f"查询季度资产负债表数据失败: {e}")
             return pd.DataFrame()
 
-    def get_cashflow_quarterly(self, stock_code: str, limit: int = 12, end_date: str = None) -> pd.DataFrame:
+    def get_cashflow_quarterly(self, stock_code: str, limit: int = 12, end_date: str = None,
+                               columns: List[str] = None) -> pd.DataFrame:
         """
         获取季度现金流量表数据
         
@@ -175,6 +397,8 @@ class FinancialDataRepository:
             stock_code: 股票代码
             limit: 获取的季度数量，默认12个季度
             end_date: 截止日期（格式：YYYY-MM-DD），默认为当前日期
+            columns: 需要的列（Stkcd、Accper总是包含），默认全部列；
+                     一般传入MillerValueStrategy.required_columns('cash_flow')
             
         Returns:
             pd.DataFrame: 季度现金流量表数据
@@ -182,31 +406,133 @@ class FinancialDataRepository:
         if end_date is None:
             end_date = datetime.now().strftime('%Y-%m-%d')
         
+        if self.snapshot is not None:
+            return self.snapshot.get_cashflow_quarterly(stock_code, limit, end_date, columns)
+
         try:
             # 构建SQL查询语句
-            sql = """
-            SELECT * FROM cash_flow 
+            sql = f"""
+            SELECT {self.select_list(columns)} FROM cash_flow 
             WHERE Stkcd = %s 
             AND Accper <= %s 
             ORDER BY Accper DESC 
             LIMIT %s
             """
             
-            # 执行查询
-            self.cursor.execute(sql, (stock_code, end_date, limit))
-            result = self.cursor.fetchall()
-            
-            # 转换为DataFrame
-            if result:
-                df = pd.DataFrame(result)
-                return df
-            else:
-                return pd.DataFrame()
+            # 按列读取查询结果
+            return self._fetch_frame(sql, (stock_code, end_date, limit))
                 
         except Exception as e:
             logger.error(f"查询季度现金流量表数据失败: {e}")
             return pd.DataFrame()
 
+    def get_statement_panel(self, table: str, codes: List[str] = None, end_date: str = None, last_n: int = 12,
+                            columns: List[str] = None) -> pd.DataFrame:
+        """
+        一次查询获取多只股票最近N个季度的报表数据（截面面板）
+
+        Args:
+            table: 报表名，取值为STATEMENT_TABLES中的profit、balance或cash_flow
+            codes: 股票代码列表，为None时获取全部股票
+            end_date: 截止日期（格式：YYYY-MM-DD），默认为当前日期
+            last_n: 每只股票获取的季度数量，默认12个季度
+            columns: 需要的列（Stkcd、Accper总是包含），默认全部列
+
+        Returns:
+            pd.DataFrame: 以(Stkcd, Accper)为索引的面板数据，每只股票内按Accper降序排列
+        """
+        if table not in self.STATEMENT_TABLES:
+            raise ValueError(f"不支持的报表: {table}")
+        if end_date is None:
+            end_date = datetime.now().strftime('%Y-%m-%d')
+        if codes is not None and len(codes) == 0:
+            return pd.DataFrame()
+        if self.snapshot is not None:
+            return self.snapshot.get_statement_panel(table, codes, end_date, last_n, columns)
+
+        try:
+            code_filter = ""
+            params = []
+            if codes is not None:
+                code_filter = "Stkcd IN (" + ", ".join(["%s"] * len(codes)) + ") AND "
+                params.extend(codes)
+            params.extend([end_date, last_n])
+
+            # 按股票分区开窗，每只股票只保留截止日期前最近的last_n个季度
+            sql = f"""
+            SELECT * FROM (
+              SELECT {self.select_list(columns, 't')}, ROW_NUMBER() OVER (PARTITION BY Stkcd ORDER BY Accper DESC) AS rn
+              FROM {table} t
+              WHERE {code_filter}Accper <= %s
+            ) ranked
+            WHERE rn <= %s
+            ORDER BY Stkcd, Accper DESC
+            """
+
+            df = self._fetch_frame(sql, params)
+
+            if not df.empty:
+                return df.drop(columns=['rn']).set_index(['Stkcd', 'Accper'])
+            else:
+                return pd.DataFrame()
+
+        except Exception as e:
+            logger.error(f"查询{table}面板数据失败: {e}")
+            return pd.DataFrame()
+
+    def get_statement_history(self, table: str, end_date: str = None, columns: List[str] = None) -> pd.DataFrame:
+        """
+        一次查询获取全部股票截止日期前的全部报表数据，供回测逐日推进时增量使用
+
+        Args:
+            table: 报表名，取值为STATEMENT_TABLES中的profit、balance或cash_flow
+            end_date: 截止日期（格式：YYYY-MM-DD），为None时不限制
+            columns: 需要的列（Stkcd、Accper总是包含），默认全部列
+
+        Returns:
+            pd.DataFrame: 按Stkcd、Accper升序排列的报表数据，查询失败返回空DataFrame
+        """
+        if table not in self.STATEMENT_TABLES:
+            raise ValueError(f"不支持的报表: {table}")
+        if self.snapshot is not None:
+            df = self.snapshot.read_table(table)
+            if df.empty:
+                return df
+            df = df[self.snapshot._projection(columns) or list(df.columns)]
+            if end_date is not None:
+                df = df[df['Accper'] <= end_date]
+            return df.sort_values(['Stkcd', 'Accper'], kind='stable').reset_index(drop=True)
+
+        try:
+            sql = f"SELECT {self.select_list(columns)} FROM {table}"
+            params = None
+            if end_date is not None:
+                sql += " WHERE Accper <= %s"
+                params = (end_date,)
+            return self._fetch_frame(sql + " ORDER BY Stkcd, Accper", params)
+        except Exception as e:
+            logger.error(f"查询{table}历史数据失败: {e}")
+            return pd.DataFrame()
+
+    @staticmethod
+    def slice_panel(panel: pd.DataFrame, stock_code: str) -> pd.DataFrame:
+        """
+        从面板数据中切出单只股票的数据，格式与get_*_quarterly的返回值一致
+
+        Args:
+            panel: get_statement_panel返回的面板数据
+            stock_code: 股票代码
+
+        Returns:
+            pd.DataFrame: 单只股票的季度数据，不存在时返回空DataFrame
+        """
+        if panel.empty:
+            return pd.DataFrame()
+        try:
+            return panel.xs(stock_code, level='Stkcd', drop_level=False).reset_index()
+        except KeyError:
+            return pd.DataFrame()
+
     def get_roc_avg(self, end_date: str = None) -> float:
         """
         获取市场平均roc
@@ -220,27 +546,38 @@ class FinancialDataRepository:
         if end_date is None:
             end_date = datetime.now().strftime('%Y-%m-%d')
         
+        # 同一报告期内的日期共用一个结果，按报告期缓存
+        quarter = self.resolve_quarter(end_date)
+        if quarter is None:
+            logger.warning(f"未找到{end_date}之前的报告期")
+            return np.nan
+
         # 1. 首先从内存缓存中查询
-        if end_date in self.roc_avg_cache:
-            return self.roc_avg_cache[end_date]
+        cached = self._cache_get(self.roc_avg_cache, quarter)
+        if cached is not None:
+            return cached
+        if self.snapshot is not None:
+            roc_avg = self.snapshot.get_roc_avg(quarter)
+            if not np.isnan(roc_avg):
+                self._cache_put(self.roc_avg_cache, quarter, roc_avg)
+            return roc_avg
         
         try:
             sql = """
             select avg(p.OpProfit*(1 - p.IncomeTax/p.ProfitBefTax)/(b.ParOwnEquity + b.ShortBorrow + NonCurLia1Y + b.LTBorrow+b.BondPay)) as avg_roc
-             from stock1.balance b join stock1.profit p 
+             from balance b join profit p 
              on b.Stkcd = p.Stkcd and b.Accper = p.Accper
-             where b.Accper = (select Accper from balance where Accper <= %s order by Accper desc limit 1)
+             where b.Accper = %s
             """
             
             # 执行查询
-            self.cursor.execute(sql, (end_date,))
-            result = self.cursor.fetchone()
+            result = self._fetchone(sql, (quarter,))
             
             # 返回单个浮点数值
             if result and result['avg_roc'] is not None:
                 roc_avg = float(result['avg_roc'])
                 # 2. 将查询结果存储到内存缓存中
-                self.roc_avg_cache[end_date] = roc_avg
+                self._cache_put(self.roc_avg_cache, quarter, roc_avg)
                 return roc_avg
             else:
                 logger.warning(f"未找到{end_date}的roc_avg数据")
@@ -263,9 +600,21 @@ class FinancialDataRepository:
         if end_date is None:
             end_date = datetime.now().strftime('%Y-%m-%d')
         
+        # 同一报告期内的日期共用一个结果，按报告期缓存
+        quarter = self.resolve_quarter(end_date)
+        if quarter is None:
+            logger.warning(f"未找到{end_date}之前的报告期")
+            return np.nan
+
         # 1. 首先从内存缓存中查询
-        if end_date in self.rooc_avg_cache:
-            return self.rooc_avg_cache[end_date]
+        cached = self._cache_get(self.rooc_avg_cache, quarter)
+        if cached is not None:
+            return cached
+        if self.snapshot is not None:
+            rooc_avg = self.snapshot.get_rooc_avg(quarter)
+            if not np.isnan(rooc_avg):
+                self._cache_put(self.rooc_avg_cache, quarter, rooc_avg)
+            return rooc_avg
         
         try:
             # 构建SQL查询语句
@@ -281,21 +630,20 @@ class FinancialDataRepository:
                 FROM balance AS b
                    JOIN profit  AS p
                    ON b.Stkcd = p.Stkcd AND b.Accper = p.Accper
-                WHERE b.Accper = (select Accper from balance where Accper <= %s order by Accper desc limit 1)
+                WHERE b.Accper = %s
               ) AS t
               WHERE nopat > 0 and nowc > 0
             ) as s;
             """
             
             # 执行查询
-            self.cursor.execute(sql, (end_date,))
-            result = self.cursor.fetchone()
+            result = self._fetchone(sql, (quarter,))
             
             # 返回单个浮点数值
             if result and result['avg_rooc'] is not None:
                 rooc_avg = float(result['avg_rooc'])
                 # 2. 将查询结果存储到内存缓存中
-                self.rooc_avg_cache[end_date] = rooc_avg
+                self._cache_put(self.rooc_avg_cache, quarter, rooc_avg)
                 return rooc_avg
             else:
                 logger.warning(f"未找到{end_date}的rooc_avg数据")
@@ -318,30 +666,42 @@ class FinancialDataRepository:
         if end_date is None:
             end_date = datetime.now().strftime('%Y-%m-%d')
         
+        # 同一报告期内的日期共用一个结果，按报告期缓存
+        quarter = self.resolve_quarter(end_date)
+        if quarter is None:
+            logger.warning(f"未找到{end_date}之前的报告期")
+            return np.nan
+
         # 1. 首先从内存缓存中查询
-        if end_date in self.inventory_turnover_cache:
-            return self.inventory_turnover_cache[end_date]
+        cached = self._cache_get(self.inventory_turnover_cache, quarter)
+        if cached is not None:
+            return cached
+        if self.snapshot is not None:
+            inventory_turnover = self.snapshot.get_avg_inventory_turnover(quarter)
+            if not np.isnan(inventory_turnover):
+                self._cache_put(self.inventory_turnover_cache, quarter, inventory_turnover)
+            return inventory_turnover
         
         try:
             # 构建SQL查询语句
             sql = """
-            select 2 * (t3.OpCost / (t1.InventNet + t2.InventNet)) as avg_it
+            select avg(2 * p.OpCost / (b.InventNet + b.PrevInventNet)) as avg_it
             from
-              (select InventNet,Stkcd from balance b where b.Accper = (select Accper from balance where Accper <= %s order by Accper desc limit 1)) t1,
-              (select InventNet,Stkcd from balance b where b.Accper < %s order by b.Accper desc limit 1) t2,
-              (select Stkcd,OpCost from profit p where p.Accper = (select Accper from balance where Accper <= %s order by Accper desc limit 1)) t3
-            where t1.Stkcd = t2.Stkcd and t1.Stkcd = t3.Stkcd;
+              (select Stkcd, Accper, InventNet,
+                      lag(InventNet) over (partition by Stkcd order by Accper) as PrevInventNet
+               from balance) b
+              join profit p on b.Stkcd = p.Stkcd and b.Accper = p.Accper
+            where b.Accper = %s;
             """
             
             # 执行查询
-            self.cursor.execute(sql, (end_date,end_date,end_date,))
-            result = self.cursor.fetchone()
+            result = self._fetchone(sql, (quarter,))
             
             # 返回单个浮点数值
             if result and result['avg_it'] is not None:
                 inventory_turnover = float(result['avg_it'])
                 # 2. 将查询结果存储到内存缓存中
-                self.inventory_turnover_cache[end_date] = inventory_turnover
+                self._cache_put(self.inventory_turnover_cache, quarter, inventory_turnover)
                 return inventory_turnover
             else:
                 logger.warning(f"未找到{end_date}的存货周转率数据")
@@ -364,34 +724,38 @@ class FinancialDataRepository:
             end_date = datetime.now().strftime('%Y-%m-%d')
         
         # 1. 首先从内存缓存中查询
-        if end_date in self.pb_avg_cache:
-            return self.pb_avg_cache[end_date]
+        cached = self._cache_get(self.pb_avg_cache, end_date)
+        if cached is not None:
+            return cached
+        if self.snapshot is not None:
+            pb_avg = self.snapshot.get_pb_avg(end_date)
+            if not np.isnan(pb_avg):
+                self._cache_put(self.pb_avg_cache, end_date, pb_avg)
+            return pb_avg
         
         try:
-            # 构建SQL查询语句
+            # 用关联子查询取每只股票截止日期前最近的收盘价和总股本，MySQL和SQLite通用（不依赖LATERAL）
             sql = """
-            select  
-             avg(t.Clsprc/(b.ParOwnEquity/s.Nshrttl)) as avg_pb
-            FROM
-              (select ParOwnEquity,Stkcd FROM balance where Accper = 
-                (select Accper from balance where Accper <= %s order by Accper desc limit 1)) b
-              join LATERAL
-              (select Clsprc,Stkcd FROM trade WHERE Trddt <= %s and Stkcd = b.Stkcd order by Trddt desc limit 1) t 
-               on b.Stkcd = t.Stkcd
-              join LATERAL
-             (SELECT Nshrttl,Stkcd FROM shares WHERE Reptdt <= %s and Stkcd = b.Stkcd order by Reptdt desc limit 1) s
-             on t.Stkcd = s.Stkcd;
+            select avg(x.Clsprc/(x.ParOwnEquity/x.Nshrttl)) as avg_pb
+            from (
+              select b.ParOwnEquity,
+                (select t.Clsprc from trade t
+                  where t.Stkcd = b.Stkcd and t.Trddt <= %s order by t.Trddt desc limit 1) as Clsprc,
+                (select s.Nshrttl from shares s
+                  where s.Stkcd = b.Stkcd and s.Reptdt <= %s order by s.Reptdt desc limit 1) as Nshrttl
+              from balance b
+              where b.Accper = (select Accper from balance where Accper <= %s order by Accper desc limit 1)
+            ) x;
             """
             
             # 执行查询
-            self.cursor.execute(sql, (end_date,end_date,end_date,))
-            result = self.cursor.fetchone()
+            result = self._fetchone(sql, (end_date,end_date,end_date,))
             
             # 返回单个浮点数值
             if result and result['avg_pb'] is not None:
                 pb_avg = float(result['avg_pb'])
                 # 2. 将查询结果存储到内存缓存中
-                self.pb_avg_cache[end_date] = pb_avg
+                self._cache_put(self.pb_avg_cache, end_date, pb_avg)
                 return pb_avg
             else:
                 logger.warning(f"未找到{end_date}的pb_avg数据")
@@ -421,6 +785,8 @@ class FinancialDataRepository:
         """
         if end_date is None:
             end_date = self.end_date
+        if self.snapshot is not None:
+            return self.snapshot.get_inflation_rate(end_date)
         
         try:
             # 从日期中提取年份
@@ -428,8 +794,7 @@ class FinancialDataRepository:
             
             # 查询inflation_cn表获取对应年份的通货膨胀率
             sql = "SELECT rate FROM inflation_cn WHERE year = %s"
-            self.cursor.execute(sql, (year,))
-            result = self.cursor.fetchone()
+            result = self._fetchone(sql, (year,))
             
             if result:
                 inflation_rate = float(result['rate'])
@@ -461,6 +826,11 @@ class FinancialDataRepository:
         Returns:
             float: 股票市值（单位：元）
         """
+        if self.price_index is not None and self.shares_index is not None:
+            return self.price_index.lookup(stock_code, end_date) * self.shares_index.lookup(stock_code, end_date)
+        if self.snapshot is not None:
+            return self.snapshot.get_market_cap(stock_code, end_date)
+
         try:
             # 查询shares表获取股票市值
             sql = """
@@ -473,8 +843,7 @@ class FinancialDataRepository:
             on t.Stkcd = s.Stkcd;
             """
             
-            self.cursor.execute(sql, (stock_code, end_date, stock_code, end_date))
-            result = self.cursor.fetchone()
+            result = self._fetchone(sql, (stock_code, end_date, stock_code, end_date))
             
             if result:
                 total_shares = float(result['cap'])
@@ -498,6 +867,11 @@ class FinancialDataRepository:
         Returns:
             float: 总股本（单位：股），如果查询失败返回NaN
         """
+        if self.shares_index is not None:
+            return self.shares_index.lookup(stock_code, end_date)
+        if self.snapshot is not None:
+            return self.snapshot.get_total_shares(stock_code, end_date)
+
         try:
             # 查询shares表获取总股本数
             sql = """
@@ -506,8 +880,7 @@ class FinancialDataRepository:
             WHERE Stkcd = %s AND Reptdt <= %s order by Reptdt desc limit 1
             """
             
-            self.cursor.execute(sql, (stock_code, end_date))
-            result = self.cursor.fetchone()
+            result = self._fetchone(sql, (stock_code, end_date))
             
             if result:
                 total_shares = float(result['Nshrttl'])
@@ -531,6 +904,11 @@ class FinancialDataRepository:
         Returns:
             float: 最新收盘价（单位：元），如果查询失败返回NaN
         """
+        if self.price_index is not None:
+            return self.price_index.lookup(stock_code, end_date)
+        if self.snapshot is not None:
+            return self.snapshot.get_latest_close_price(stock_code, end_date)
+
         try:
             # 查询trade表获取收盘价
             sql = """
@@ -539,8 +917,7 @@ class FinancialDataRepository:
             WHERE Stkcd = %s AND Trddt <= %s order by Trddt desc limit 1
             """
             
-            self.cursor.execute(sql, (stock_code, end_date))
-            result = self.cursor.fetchone()
+            result = self._fetchone(sql, (stock_code, end_date))
             
             if result:
                 close_price = float(result['Clsprc'])
@@ -563,6 +940,11 @@ class FinancialDataRepository:
         Returns:
             float: 五年平均市盈率
         """
+        if self.profit_ttm_index is not None:
+            return float(self.get_five_year_avg_pe_batch([stock_code], end_date).iloc[0])
+        if self.snapshot is not None:
+            return self.snapshot.get_five_year_avg_pe(stock_code, end_date)
+
         try:
             # 查询市场值
             sql_cap = """
@@ -583,10 +965,8 @@ class FinancialDataRepository:
                 year = int(end_date[:4]) - year
                 month_day = end_date[5:]
                 start_date = f"{year}-{month_day}"
-                self.cursor.execute(sql_cap, (stock_code, start_date, stock_code, start_date))
-                cap_result = self.cursor.fetchone()
-                self.cursor.execute(sql_profit, (stock_code, start_date))
-                profit_result = self.cursor.fetchone()
+                cap_result = self._fetchone(sql_cap, (stock_code, start_date, stock_code, start_date))
+                profit_result = self._fetchone(sql_profit, (stock_code, start_date))
                 
                 if cap_result and profit_result:
                     cap = float(cap_result['cap'])
@@ -598,10 +978,154 @@ class FinancialDataRepository:
             return (pe/5)        
         except Exception as e:
             logger.error(f"查询股票市值失败: {e}")
-            return float('nan')      
+            return float('nan')
+
+    def get_discounted_10y_fcf(self, stock_code: str, end_date: str, discount_rate: float, growth_rate: float = 0.0) -> float:
+        """
+        获取10年自由现金流折现值
+        
+        Args:
+            stock_code: 股票代码
+            end_date: 截止日期（格式：YYYY-MM-DD）
+            discount_rate: 折现率
+            growth_rate: 增长率，默认0%
+            
+        Returns:
+            float: 10年自由现金流折现值，如果查询失败返回NaN
+        """
+        if self.snapshot is not None:
+            return self.snapshot.get_discounted_10y_fcf(stock_code, end_date, discount_rate, growth_rate)
+
+        sql = """
+            select 
+                sum((NetOpCF - AssetPurchase) * 
+                    pow((1.0 + %s), year(%s)-year(Accper))/
+                    pow((1.0 + %s), year(%s)-year(Accper))) as free_cash 
+            from cash_flow 
+            where Stkcd=%s and Accper like '%%12-31' 
+            order by Accper desc limit 10;
+        """
+        try:
+            # 执行查询
+            result = self._fetchone(sql, (growth_rate, end_date ,discount_rate, end_date, stock_code))
+
+            # 返回单个浮点数值
+            if result and result['free_cash'] is not None:
+                fcf_10y = float(result['free_cash'])
+                return fcf_10y
+            else:
+                logger.warning(f"未找到{end_date}fcf_10y")
+                return np.nan
+        except Exception as e:
+            logger.error(f"查询{stock_code}在{end_date}的自由现金流折现值时出错: {e}")
+            return np.nan
+
+    def get_trade_history(self, start_date: str, end_date: str, codes: List[str] = None) -> pd.DataFrame:
+        """
+        一次查询获取日期区间内的收盘价记录，按交易日期、股票代码排序，供行情回放使用
+
+        Args:
+            start_date: 开始日期（格式：YYYY-MM-DD），包含
+            end_date: 结束日期（格式：YYYY-MM-DD），包含
+            codes: 股票代码列表，为None时获取全部股票
+
+        Returns:
+            pd.DataFrame: 包含Stkcd、Trddt、Clsprc列，查询失败返回空DataFrame
+        """
+        if codes is not None and len(codes) == 0:
+            return pd.DataFrame()
+        if self.snapshot is not None:
+            df = self.snapshot.read_table('trade')
+            if df.empty:
+                return df
+            df = df[['Stkcd', 'Trddt', 'Clsprc']]
+            df = df[(df['Trddt'] >= start_date) & (df['Trddt'] <= end_date)]
+            if codes is not None:
+                df = df[df['Stkcd'].isin(codes)]
+            return df.sort_values(['Trddt', 'Stkcd'], kind='stable').reset_index(drop=True)
+
+        try:
+            code_filter = ""
+            params = [start_date, end_date]
+            if codes is not None:
+                code_filter = " AND Stkcd IN (" + ", ".join(["%s"] * len(codes)) + ")"
+                params.extend(codes)
+            sql = f"SELECT Stkcd, Trddt, Clsprc FROM trade WHERE Trddt BETWEEN %s AND %s{code_filter} ORDER BY Trddt, Stkcd"
+            return self._fetch_frame(sql, params)
+        except Exception as e:
+            logger.error(f"查询行情数据失败: {e}")
+            return pd.DataFrame()
+
+    def get_annual_cash_flows(self, codes: List[str] = None) -> pd.DataFrame:
+        """
+        一次查询获取多只股票全部年报的经营现金流和资本支出，供批量计算自由现金流折现值
+
+        Args:
+            codes: 股票代码列表，为None时获取全部股票
+
+        Returns:
+            pd.DataFrame: 包含Stkcd、Accper、NetOpCF、AssetPurchase列的年报数据，查询失败返回空DataFrame
+        """
+        if codes is not None and len(codes) == 0:
+            return pd.DataFrame()
+        if self.snapshot is not None:
+            df = self.snapshot.read_table('cash_flow')[['Stkcd', 'Accper', 'NetOpCF', 'AssetPurchase']]
+            df = df[df['Accper'].str.endswith('12-31')]
+            if codes is not None:
+                df = df[df['Stkcd'].isin(codes)]
+            return df.reset_index(drop=True)
+
+        try:
+            code_filter = ""
+            params = []
+            if codes is not None:
+                code_filter = " AND Stkcd IN (" + ", ".join(["%s"] * len(codes)) + ")"
+                params.extend(codes)
+            sql = f"SELECT Stkcd, Accper, NetOpCF, AssetPurchase FROM cash_flow WHERE Accper LIKE '%%12-31'{code_filter}"
+            return self._fetch_frame(sql, params)
+        except Exception as e:
+            logger.error(f"查询年报现金流数据失败: {e}")
+            return pd.DataFrame()
 
 class MillerValueStrategy:
     """米勒价值投资策略实现类"""
+
+    # 各评估方法用到的报表列（不含Stkcd、Accper），仓库按此清单只查询需要的列
+    REQUIRED_COLUMNS = {
+        'evaluate_selection': {
+            'profit': ['OpProfit', 'IncomeTax', 'ProfitBefTax', 'OpCost'],
+            'balance': ['ParOwnEquity', 'ShortBorrow', 'NonCurLia1Y', 'LTBorrow', 'BondPay',
+                        'AcctRecNet', 'PrepayNet', 'InventNet', 'NotesRecNet', 'AcctPay',
+                        'AdvFromCust', 'NotesPay', 'EmpBenefitPay', 'TaxPay'],
+        },
+        'evaluate_buy': {
+            'profit': ['ParNetProfit'],
+            'balance': ['ParOwnEquity'],
+            'cash_flow': ['NetOpCF', 'AssetPurchase'],
+        },
+    }
+
+    def __init__(self):
+        """初始化策略"""
+        self._fundamentals_cache = {}  # 买入评估的基本面输入，键为(股票代码, 最新报告期, 年份)
+
+    @classmethod
+    def required_columns(cls, table: str, method: str = None) -> List[str]:
+        """
+        返回评估方法需要的报表列
+
+        Args:
+            table: 报表名，profit、balance或cash_flow
+            method: 评估方法名，为None时返回所有方法所需列的并集
+
+        Returns:
+            List[str]: 列名列表
+        """
+        methods = [method] if method is not None else list(cls.REQUIRED_COLUMNS)
+        columns = []
+        for m in methods:
+            columns.extend(cls.REQUIRED_COLUMNS[m].get(table, []))
+        return list(dict.fromkeys(columns))
     
     def _col(self, df: pd.DataFrame, names: list) -> pd.Series:
         """
@@ -815,10 +1339,7 @@ class MillerValueStrategy:
         Returns:
             float: TTM市盈率，如果数据无效则返回NaN
         """
-        np_ttm = self._ttm_sum(net_profit_series, 4)
-        if np.isnan(np_ttm) or np_ttm == 0:
-            return np.nan
-        return float(market_cap / np_ttm)
+        return self._ttm_ratio(market_cap, self._ttm_sum(net_profit_series, 4))
 
     def compute_pfcf_ttm(self, market_cap: float, cfo_series: pd.Series, capex_series: pd.Series) -> float:
         """
@@ -833,61 +1354,55 @@ class MillerValueStrategy:
             float: TTM市现率，如果数据无效则返回NaN
         """
         fcf_series = pd.to_numeric(cfo_series, errors='coerce') - pd.to_numeric(capex_series, errors='coerce')
-        fcf_ttm = self._ttm_sum(fcf_series, 4)
-        if np.isnan(fcf_ttm) or fcf_ttm == 0:
+        return self._ttm_ratio(market_cap, self._ttm_sum(fcf_series, 4))
+
+    def _ttm_ratio(self, market_cap: float, ttm: float) -> float:
+        """市值与TTM值之比，TTM值无效或为0时返回NaN"""
+        if np.isnan(ttm) or ttm == 0:
             return np.nan
-        return float(market_cap / fcf_ttm)
+        return float(market_cap / ttm)
 
-    def discounted_10y_fcf(self, stock_code: str, end_date: str, discount_rate: float, growth_rate: float = 0.0) -> float:
+    def discounted_10y_fcf(self, stock_code: str, repo: FinancialDataRepository, end_date: str,
+                           discount_rate: float, growth_rate: float = 0.0) -> float:
         """
         计算10年自由现金流折现值
         
         Args:
-            fcf_base: 基础自由现金流
+            stock_code: 股票代码
+            repo: 财务数据仓库实例
+            end_date: 截止日期（格式：YYYY-MM-DD）
             discount_rate: 折现率
             growth_rate: 增长率，默认0%
             
         Returns:
-            float: 10年自由现金流折现值，如果折现率无效则返回NaN
+            float: 10年自由现金流折现值，如果数据无效则返回NaN
         """
-        sql = """
-            select 
-                sum((NetOpCF - AssetPurchase) * 
-                    pow((1.0 + %s), year(%s)-year(Accper))/
-                    pow((1.0 + %s), year(%s)-year(Accper))) as free_cash 
-            from cash_flow 
-            where Stkcd=%s and Accper like "%12-31" 
-            order by Accper desc limit 10;
-        """
-        try:
-        # 执行查询
-            self.cursor.execute(sql, (growth_rate, end_date ,discount_rate, end_date, stock_code))
-            result = self.cursor.fetchone()
+        return repo.get_discounted_10y_fcf(stock_code, end_date, discount_rate, growth_rate)
 
-            # 返回单个浮点数值
-            if result and result['free_cash'] is not None:
-                fcf_10y = float(result['free_cash'])
-                return fcf_10y
-            else:
-                logger.warning(f"未找到{end_date}fcf_10y")
-                return np.nan
-        except Exception as e:
-            logger.error(f"查询{end_date}的roc_avg数据时出错: {e}")
-            return np.nan
-
-    def evaluate_selection(self, stock_code: str, repo: FinancialDataRepository, end_date: str) -> bool:
+    def selection_criteria(self, stock_code: str, repo: FinancialDataRepository, end_date: str,
+                           profit_panel: pd.DataFrame = None, balance_panel: pd.DataFrame = None) -> dict:
         """
-        评估股票是否符合选股标准
-        
+        逐项计算单只股票的选股条件A-G
+
         Args:
             stock_code: 股票代码
             repo: 财务数据仓库实例
-            
+            profit_panel: 可选的利润表面板数据，提供时直接切片而不再查询数据库
+            balance_panel: 可选的资产负债表面板数据，提供时直接切片而不再查询数据库
+
         Returns:
-            dict: 包含各项指标和评估结果的字典
-        """
-        profit = repo.get_profit_quarterly(stock_code, 12, end_date)
-        balance = repo.get_balance_quarterly(stock_code, 12, end_date)
+            dict: 存储(条件名, 是否满足)键值对
+        """
+        if profit_panel is not None:
+            profit = repo.slice_panel(profit_panel, stock_code)
+        else:
+            profit = repo.get_profit_quarterly(stock_code, 12, end_date,
+                                               self.required_columns('profit', 'evaluate_selection'))
+        if balance_panel is not None:
+            balance = repo.slice_panel(balance_panel, stock_code)
+        else:
+            balance = repo.get_balance_quarterly(stock_code, 12, end_date,
+                                                 self.required_columns('balance', 'evaluate_selection'))
         roc_q = self.compute_roc_quarterly(profit, balance)
         rooc_q = self.compute_rooc_quarterly(profit, balance)
         it_q = self.compute_inventory_turnover_quarterly(profit, balance)
@@ -908,11 +1423,88 @@ class MillerValueStrategy:
         cE = rooc_4_min > rooc_5_8_max if not np.isnan(rooc_4_min) and not np.isnan(rooc_5_8_max) else False
         cF = it_4_min > industry_it if not np.isnan(it_4_min) and industry_it is not None else False
         cG = it_4_min > it_5_8_max if not np.isnan(it_4_min) and not np.isnan(it_5_8_max) else False
-        return (cA and cB and cC and cD and cE and cF and cG)
+        return {'A': cA, 'B': cB, 'C': cC, 'D': cD, 'E': cE, 'F': cF, 'G': cG}
+
+    def evaluate_selection(self, stock_code: str, repo: FinancialDataRepository, end_date: str,
+                           profit_panel: pd.DataFrame = None, balance_panel: pd.DataFrame = None) -> bool:
+        """
+        评估股票是否符合选股标准
+
+        Args:
+            stock_code: 股票代码
+            repo: 财务数据仓库实例
+            profit_panel: 可选的利润表面板数据，提供时直接切片而不再查询数据库
+            balance_panel: 可选的资产负债表面板数据，提供时直接切片而不再查询数据库
+
+        Returns:
+            bool: 七项条件全部满足时返回True
+        """
+        criteria = self.selection_criteria(stock_code, repo, end_date, profit_panel, balance_panel)
+        return all(criteria.values())
+
+    def evaluate_selection_batch(self, stock_codes: List[str], repo: FinancialDataRepository, end_date: str,
+                                 profit_panel: pd.DataFrame = None, balance_panel: pd.DataFrame = None) -> pd.DataFrame:
+        """
+        对一组股票一次评估选股标准，结果与逐只调用evaluate_selection一致
+
+        Args:
+            stock_codes: 股票代码列表
+            repo: 财务数据仓库实例
+            end_date: 截止日期（格式：YYYY-MM-DD）
+            profit_panel: 可选的利润表面板数据，默认按REQUIRED_COLUMNS一次查询
+            balance_panel: 可选的资产负债表面板数据，默认按REQUIRED_COLUMNS一次查询
+
+        Returns:
+            pd.DataFrame: 以股票代码为索引，列为A-G各条件及最终结果selected的布尔矩阵
+        """
+        if profit_panel is None:
+            profit_panel = repo.get_statement_panel(
+                'profit', stock_codes, end_date, 12, self.required_columns('profit', 'evaluate_selection'))
+        if balance_panel is None:
+            balance_panel = repo.get_statement_panel(
+                'balance', stock_codes, end_date, 12, self.required_columns('balance', 'evaluate_selection'))
+        return evaluate_selection_batch(profit_panel, balance_panel, repo.get_roc_avg(end_date), repo.get_deposit_rate(),
+                                        repo.get_rooc_avg(end_date), repo.get_avg_inventory_turnover(end_date),
+                                        codes=stock_codes)
+
+    def buy_fundamentals(self, stock_code: str, repo: FinancialDataRepository, end_date: str) -> dict:
+        """
+        计算买入评估中不依赖股价的基本面输入，按(股票, 最新报告期, 年份)缓存，同一季度内的逐日评估不再查询报表
+
+        Args:
+            stock_code: 股票代码
+            repo: 财务数据仓库实例
+            end_date: 截止日期（格式：YYYY-MM-DD）
+
+        Returns:
+            dict: 包含equity、np_ttm、fcf_ttm、dcf_10y、inflation的字典
+        """
+        # 折现年数和通货膨胀率随年份变化，键中包含年份
+        key = (stock_code, repo.resolve_quarter(end_date), end_date[:4])
+        cached = self._fundamentals_cache.get(key)
+        if cached is not None:
+            return cached
+        income = repo.get_profit_quarterly(stock_code, 12, end_date, self.required_columns('profit', 'evaluate_buy'))
+        balance = repo.get_balance_quarterly(stock_code, 12, end_date, self.required_columns('balance', 'evaluate_buy'))
+        cash = repo.get_cashflow_quarterly(stock_code, 12, end_date, self.required_columns('cash_flow', 'evaluate_buy'))
+        equity_latest = self._col(balance, ['归属于母公司所有者权益', 'ParOwnEquity']).tail(1)
+        net_profit = self._col(income, ['净利润', '归属于母公司净利润', 'ParNetProfit'])
+        cfo = self._col(cash, ['经营活动现金流量净额', 'NetOpCF'])
+        capex = self._col(cash, ['购建固定资产、无形资产和其他长期资产支付的现金', 'AssetPurchase'])
+        fcf_series = pd.to_numeric(cfo, errors='coerce') - pd.to_numeric(capex, errors='coerce')
+        fundamentals = {
+            'equity': float(equity_latest.iloc[-1]) if not equity_latest.empty else np.nan,
+            'np_ttm': self._ttm_sum(net_profit, 4),
+            'fcf_ttm': self._ttm_sum(fcf_series, 4),
+            'dcf_10y': self.discounted_10y_fcf(stock_code, repo, end_date, repo.get_discount_rate(), 0.0),
+            'inflation': repo.get_inflation_rate(end_date),
+        }
+        self._fundamentals_cache[key] = fundamentals
+        return fundamentals
 
     def evaluate_buy(self, stock_code: str, repo: FinancialDataRepository, end_date: str) -> dict:
         """
-        评估股票是否符合买入标准
+        评估股票是否符合买入标准：基本面输入取自buy_fundamentals的缓存，只重新计算依赖股价的估值指标
         
         Args:
             stock_code: 股票代码
@@ -921,31 +1513,18 @@ class MillerValueStrategy:
         Returns:
             dict: 包含各项估值指标和买入条件的字典
         """
-        income = repo.get_profit_quarterly(stock_code, 12, end_date)
-        balance = repo.get_balance_quarterly(stock_code, 12, end_date)
-        cash = repo.get_cashflow_quarterly(stock_code, 12, end_date)
+        fundamentals = self.buy_fundamentals(stock_code, repo, end_date)
         market_cap = repo.get_market_cap(stock_code, end_date)
         shares = repo.get_total_shares(stock_code, end_date)
         price = repo.get_latest_close_price(stock_code, end_date)
-        equity_latest = self._col(balance, ['归属于母公司所有者权益', 'ParOwnEquity']).tail(1)
-        net_profit = self._col(income, ['净利润', '归属于母公司净利润', 'ParNetProfit'])
-        cfo = self._col(cash, ['经营活动现金流量净额', 'NetOpCF'])
-        capex = self._col(cash, ['购建固定资产、无形资产和其他长期资产支付的现金', 'AssetPurchase'])
-        pb_latest = np.nan
-        if not equity_latest.empty:
-            pb_latest = self.compute_pb_latest(price, float(equity_latest.iloc[-1]), shares)
-        pe_ttm = self.compute_pe_ttm(market_cap, net_profit)
-        pfcf_ttm = self.compute_pfcf_ttm(market_cap, cfo, capex)
+        pb_latest = self.compute_pb_latest(price, fundamentals['equity'], shares)
+        pe_ttm = self._ttm_ratio(market_cap, fundamentals['np_ttm'])
+        pfcf_ttm = self._ttm_ratio(market_cap, fundamentals['fcf_ttm'])
         market_pb_avg = repo.get_pb_avg(end_date)
         deposit = repo.get_deposit_rate(end_date)
-        infl = repo.get_inflation_rate(end_date)
+        infl = fundamentals['inflation']
         five_year_avg_pe = repo.get_five_year_avg_pe(stock_code, end_date)
-        discount = repo.get_discount_rate()
-        # 将字符串转换为数值类型再进行计算
-        # cfo_numeric = pd.to_numeric(cfo, errors='coerce')
-        # capex_numeric = pd.to_numeric(capex, errors='coerce')
-        # fcf_base = self._ttm_sum(cfo_numeric - capex_numeric, 2)
-        dcf_10y = self.discounted_10y_fcf(stock_code, end_date, discount, 0.0)
+        dcf_10y = fundamentals['dcf_10y']
         condA = pb_latest < 2.0 * market_pb_avg if market_pb_avg is not None and not np.isnan(pb_latest) else False
         condB = pe_ttm < (1.0 / deposit) if deposit is not None and not np.isnan(pe_ttm) and deposit > 0 else False
         condC = pb_latest < five_year_avg_pe if not np.isnan(pb_latest) and five_year_avg_pe is not None else False
@@ -954,25 +1533,151 @@ class MillerValueStrategy:
         count = int(condA) + int(condB) + int(condC) + int(condD) + int(condE)
         return count,price
 
+    def evaluate_buy_batch(self, stock_codes: List[str], repo: FinancialDataRepository, end_date: str) -> pd.DataFrame:
+        """
+        对一组候选股票一次评估买入标准，结果与逐只调用evaluate_buy一致
+
+        Args:
+            stock_codes: 股票代码列表
+            repo: 财务数据仓库实例
+            end_date: 截止日期（格式：YYYY-MM-DD）
+
+        Returns:
+            pd.DataFrame: 以股票代码为索引，包含各项估值指标、A-E各条件、满足条件数count和价格price
+        """
+        panels = {
+            table: repo.get_statement_panel(table, stock_codes, end_date, 12, self.required_columns(table, 'evaluate_buy'))
+            for table in ('profit', 'balance', 'cash_flow')
+        }
+        if repo.profit_ttm_index is None:
+            repo.load_asof_indexes()
+        return evaluate_buy_batch(stock_codes, end_date, panels['profit'], panels['balance'], panels['cash_flow'],
+                                  repo.get_annual_cash_flows(stock_codes), repo.price_index, repo.shares_index,
+                                  repo.profit_ttm_index, repo.get_pb_avg(end_date), repo.get_deposit_rate(end_date),
+                                  repo.get_inflation_rate(end_date), repo.get_discount_rate())
+
+# 工作进程中的仓库实例，由_init_worker在每个进程启动时创建一次
+_worker_repo = None
+
+
+def _init_worker(db_config: dict, snapshot_root: str = None):
+    """
+    工作进程初始化：每个进程持有自己的数据库连接（或本地快照），不与主进程共享连接
+
+    Args:
+        db_config: 数据库连接配置字典
+        snapshot_root: 本地快照根目录，为None时直接查询数据库
+    """
+    global _worker_repo
+    snapshot = None
+    if snapshot_root is not None:
+        from snapshot_store import SnapshotStore
+        snapshot = SnapshotStore(snapshot_root)
+    _worker_repo = FinancialDataRepository(db_config, snapshot=snapshot, pool_size=1)
+    if snapshot is None and not _worker_repo.connect():
+        raise RuntimeError(f"工作进程{os.getpid()}连接数据库失败")
+
+
+def _evaluate_chunk(method: str, chunk_id: int, stock_codes: List[str], end_date: str) -> dict:
+    """
+    在工作进程中对一组股票执行批量评估
+
+    Args:
+        method: 策略的批量评估方法名，evaluate_selection_batch或evaluate_buy_batch
+        chunk_id: 分块序号，用于汇总时按原顺序拼接
+        stock_codes: 本块的股票代码列表
+        end_date: 截止日期（格式：YYYY-MM-DD）
+
+    Returns:
+        dict: 包含chunk_id、pid、codes、seconds、result（失败时为None）和error（成功时为None）
+    """
+    start = time.perf_counter()
+    outcome = {'chunk_id': chunk_id, 'pid': os.getpid(), 'codes': stock_codes, 'result': None, 'error': None}
+    try:
+        outcome['result'] = getattr(MillerValueStrategy(), method)(stock_codes, _worker_repo, end_date)
+    except Exception as e:
+        outcome['error'] = f"{type(e).__name__}: {e}"
+    outcome['seconds'] = time.perf_counter() - start
+    return outcome
+
+
 class MillerStrategyRunner:
     """米勒策略执行器类"""
     
-    def __init__(self, repo: FinancialDataRepository, end_date: str = None):
+    def __init__(self, repo: FinancialDataRepository, end_date: str = None, workers: int = 1, ledger=None):
         """
         初始化策略执行器
         
         Args:
             repo: 财务数据仓库实例
+            workers: 并行评估的进程数，大于1时把股票分块交给进程池执行
+            ledger: 可选的进度账本（checkpoint.CheckpointLedger），提供时分批评估并跳过已完成的股票
         """
         self.repo = repo
+        self.ledger = ledger
         self.end_date = end_date
+        self.workers = max(1, int(workers))
         self.strategy = MillerValueStrategy()
+        self.writer = ResultWriter(repo)  # sel_for_stocks/buy_for_stocks的结果按end_date批量写入
+        self.failed_codes = []  # 最近一次并行评估中失败分块的股票代码
+        self.unfinished = 0  # 评估失败、写入失败而未记录为已完成的股票累计数
+
+    def evaluate_batch(self, method: str, stock_codes: List[str], end_date: str) -> pd.DataFrame:
+        """
+        批量评估一组股票；workers大于1时按股票分块，在进程池中并行执行，每个进程使用自己的数据库连接
+
+        Args:
+            method: 策略的批量评估方法名，evaluate_selection_batch或evaluate_buy_batch
+            stock_codes: 股票代码列表
+            end_date: 截止日期（格式：YYYY-MM-DD）
+
+        Returns:
+            pd.DataFrame: 以股票代码为索引的评估结果，行顺序与stock_codes一致；失败分块的股票不在结果中，
+                          其代码记录在failed_codes
+        """
+        self.failed_codes = []
+        if self.workers <= 1 or len(stock_codes) <= 1:
+            return getattr(self.strategy, method)(stock_codes, self.repo, end_date)
+
+        chunks = [list(c) for c in np.array_split(np.asarray(stock_codes, dtype=object), self.workers) if len(c)]
+        snapshot_root = self.repo.snapshot.root if self.repo.snapshot is not None else None
+        outcomes = []
+        start = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=len(chunks), initializer=_init_worker,
+                                 initargs=(self.repo.db_config, snapshot_root)) as executor:
+            futures = {executor.submit(_evaluate_chunk, method, i, chunk, end_date): i for i, chunk in enumerate(chunks)}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    outcome = future.result()
+                except Exception as e:
+                    # 工作进程初始化失败或异常退出
+                    outcome = {'chunk_id': i, 'pid': None, 'codes': chunks[i], 'result': None,
+                               'error': f"{type(e).__name__}: {e}", 'seconds': float('nan')}
+                outcomes.append(outcome)
+                if outcome['error'] is None:
+                    logger.info(f"分块{i}: 进程{outcome['pid']}评估{len(outcome['codes'])}只股票, "
+                                f"耗时{outcome['seconds']:.2f}秒, {len(outcome['codes']) / max(outcome['seconds'], 1e-9):.1f}只/秒")
+                else:
+                    logger.error(f"分块{i}: 进程{outcome['pid']}评估{len(outcome['codes'])}只股票失败: {outcome['error']}")
+
+        outcomes.sort(key=lambda o: o['chunk_id'])
+        results = [o['result'] for o in outcomes if o['error'] is None]
+        self.failed_codes = [code for o in outcomes if o['error'] is not None for code in o['codes']]
+        elapsed = time.perf_counter() - start
+        logger.info(f"{method}: {len(chunks)}个进程评估{len(stock_codes)}只股票, 耗时{elapsed:.2f}秒, "
+                    f"失败{len(self.failed_codes)}只")
+        if not results:
+            return pd.DataFrame()
+        return pd.concat(results)
 
     def get_stock_codes(self) -> List[str]:
         """从stock.balance表获取所有股票代码"""
+        if self.repo.snapshot is not None:
+            return self.repo.snapshot.get_stock_codes()
         try:
             with self.repo.connection.cursor() as cursor:
-                sql = "SELECT DISTINCT Stkcd FROM stock1.balance WHERE Stkcd IS NOT NULL AND Stkcd != ''"
+                sql = "SELECT DISTINCT Stkcd FROM balance WHERE Stkcd IS NOT NULL AND Stkcd != ''"
                 cursor.execute(sql)
                 results = cursor.fetchall()
                 
@@ -987,8 +1692,8 @@ class MillerStrategyRunner:
         """从stock.balance表获取所有股票代码"""
         try:
             with self.repo.connection.cursor() as cursor:
-                sql = "SELECT DISTINCT Stkcd FROM stock1.sel_stocks WHERE end_date = " \
-                "(select end_date from stock1.sel_stocks where end_date <= %s order by end_date desc limit 1)"
+                sql = "SELECT DISTINCT Stkcd FROM sel_stocks WHERE end_date = " \
+                "(select end_date from sel_stocks where end_date <= %s order by end_date desc limit 1)"
                 cursor.execute(sql, (end_date,))
                 results = cursor.fetchall()
                 
@@ -1023,10 +1728,8 @@ class MillerStrategyRunner:
                     primary key(Stkcd, end_date)
                 );
                 """
-                sql = """
-                INSERT INTO trade_stocks(Stkcd, end_date, price, op, score) 
-                VALUES (%s, %s, %s, %s, %s)
-                """
+                # 主键已存在时覆盖，重复运行同一日期不报错
+                sql = build_upsert_sql('trade_stocks', dialect=self.repo.backend.name)
                 
                 # 执行插入操作
                 cursor.execute(sql, (stock_code, end_date, price, op, score))
@@ -1058,10 +1761,7 @@ class MillerStrategyRunner:
         try:
             with self.repo.connection.cursor() as cursor:
                 # 构建SQL插入语句
-                sql = """
-                INSERT INTO sel_stocks(Stkcd, end_date) 
-                VALUES (%s, %s)
-                """
+                sql = build_upsert_sql('sel_stocks', dialect=self.repo.backend.name)
                 
                 # 执行插入操作
                 cursor.execute(sql, (stock_code, end_date))
@@ -1073,41 +1773,119 @@ class MillerStrategyRunner:
             self.repo.connection.rollback()
             return False
     
-    def sel_for_stocks(self, end_date: str) -> dict:
+    def _run_checkpointed(self, method: str, stock_codes: List[str], end_date: str, write) -> pd.DataFrame:
         """
-        对单个股票执行米勒价值投资策略
+        评估并写入结果；设置了进度账本时跳过已完成的股票，按CHECKPOINT_CONFIG['chunk_size']分批，
+        每批结果提交成功后再记录为已完成
+
+        Args:
+            method: 策略的批量评估方法名
+            stock_codes: 股票代码列表
+            end_date: 截止日期（格式：YYYY-MM-DD）
+            write: 写入一批评估结果的函数，提交成功返回True
+
+        Returns:
+            pd.DataFrame: 本次实际评估的股票的结果；未完成的股票数累加到unfinished
+        """
+        if self.ledger is None:
+            result = self.evaluate_batch(method, stock_codes, end_date)
+            self.unfinished += len(self.failed_codes) if write(result) else len(stock_codes)
+            return result
+
+        pending = self.ledger.pending(stock_codes, end_date)
+        if len(pending) < len(stock_codes):
+            logger.info(f"截止日期={end_date}, 跳过已完成的股票{len(stock_codes) - len(pending)}只, 剩余{len(pending)}只")
+        size = CHECKPOINT_CONFIG['chunk_size']
+        results = []
+        for start in range(0, len(pending), size):
+            chunk = pending[start:start + size]
+            result = self.evaluate_batch(method, chunk, end_date)
+            # 失败分块的股票不记录，下次运行时重新评估；结果写入是幂等的，提交后、记录前中断也可以安全重做
+            if write(result):
+                failed = set(self.failed_codes)
+                self.ledger.mark([c for c in chunk if c not in failed], end_date)
+                self.unfinished += len(failed)
+            else:
+                self.unfinished += len(chunk)
+            results.append(result)
+        results = [r for r in results if not r.empty]
+        return pd.concat(results) if results else pd.DataFrame()
+
+    def _write_selection(self, result: pd.DataFrame, end_date: str) -> bool:
+        if result.empty:
+            return True
+        selected = result.index[result['selected']].tolist()
+        logger.info(f"截止日期={end_date}, 评估股票{len(result)}只, 入选{len(selected)}只")
+        for stock_code in selected:
+            self.writer.add_sel_stock(stock_code, end_date)
+        return self.writer.commit()
+
+    def _write_buy(self, result: pd.DataFrame, end_date: str) -> bool:
+        for stock_code, row in result.iterrows():
+            sel, price = int(row['count']), row['price']
+            logger.info(f"股票代码={stock_code}, 截止日期={end_date}, 评估结果={sel}, 价格={price}")
+            if sel >= 3:
+                self.writer.add_trade_stock(stock_code, end_date, price, '1', sel)
+            elif sel <= 1:
+                self.writer.add_trade_stock(stock_code, end_date, price, '0', sel)
+        return self.writer.commit()
+
+    def sel_for_stocks(self, end_date: str) -> pd.DataFrame:
+        """
+        对全部股票执行选股评估，入选的股票在一个事务中批量写入sel_stocks表
         
         Args:
-            stock_code: 股票代码
+            end_date: 截止日期（格式：YYYY-MM-DD）
             
         Returns:
-            dict: 包含选股评估和买入评估结果的字典
+            pd.DataFrame: evaluate_selection_batch返回的条件矩阵（设置了进度账本时只含本次评估的股票）
         """
         stock_codes = self.get_stock_codes()
-        for stock_code in (stock_codes):
-            sel = self.strategy.evaluate_selection(stock_code, self.repo, end_date)
-            logger.info(f"股票代码={stock_code}, 截止日期={end_date}, 评估结果={sel}")
-            if sel:
-                self.insert_sel_stock(stock_code, end_date)
+        # 一次性获取全部股票的面板数据，向量化计算全部股票的选股条件
+        return self._run_checkpointed('evaluate_selection_batch', stock_codes, end_date,
+                                      lambda result: self._write_selection(result, end_date))
 
-    def buy_for_stocks(self, end_date: str):
+    def buy_for_stocks(self, end_date: str) -> pd.DataFrame:
         """
-        对单个股票执行米勒价值投资策略
+        对入选股票执行买入评估，满足3项及以上条件记为买入，1项及以下记为卖出，在一个事务中批量写入trade_stocks表
         
         Args:
-            stock_code: 股票代码
+            end_date: 截止日期（格式：YYYY-MM-DD）
             
         Returns:
-            dict: 包含选股评估和买入评估结果的字典
+            pd.DataFrame: evaluate_buy_batch返回的估值指标和条件矩阵（设置了进度账本时只含本次评估的股票）
         """ 
         stock_codes = self.get_sel_codes(end_date)
-        for i, stock_code in enumerate(stock_codes, 1):
-            sel,price = self.strategy.evaluate_buy(stock_code, self.repo, end_date=end_date)
-            logger.info(f"股票代码={stock_code}, 截止日期={end_date}, 评估结果={sel}, 价格={price}")
-            if sel >= 3:
-                self.insert_trade_stock(stock_code, end_date, price, '1', sel)
-            elif sel <= 1:
-                self.insert_trade_stock(stock_code, end_date, price, '0', sel)
+        # 一次性获取全部候选股票的面板数据，向量化计算全部候选股票的买入条件
+        return self._run_checkpointed('evaluate_buy_batch', stock_codes, end_date,
+                                      lambda result: self._write_buy(result, end_date))
+
+    def distribute(self, mode: str, dates: List[str], chunk_size: int = None, run_id: str = None) -> str:
+        """
+        分布式模式的协调进程：把每个日期的股票分块写入任务表，由各节点上的work_queue工作进程领取执行
+
+        Args:
+            mode: sel为全部股票的选股评估，buy为各日期入选股票的买入评估
+            dates: 截止日期列表（格式：YYYY-MM-DD）
+            chunk_size: 每个任务的股票数，默认取WORK_QUEUE_CONFIG['chunk_size']
+            run_id: 运行ID，默认按当前时间生成；已入队的运行ID不重复入队
+
+        Returns:
+            str: 运行ID，工作进程和TaskQueue.wait用它筛选任务
+        """
+        from work_queue import TaskQueue
+
+        queue = TaskQueue(self.repo)
+        if not queue.create_table():
+            raise RuntimeError("创建任务表失败")
+        run_id = run_id or datetime.now().strftime('%Y%m%d%H%M%S%f')
+        if mode == 'sel':
+            stock_codes = self.get_stock_codes()
+            tasks = {end_date: stock_codes for end_date in dates}
+        else:
+            tasks = {end_date: self.get_sel_codes(end_date) for end_date in dates}
+        queue.enqueue(run_id, mode, tasks, chunk_size)
+        return run_id
 
     def plot_trade_stocks(self, save_path: str = None):
         """
@@ -1213,17 +1991,41 @@ class MillerStrategyRunner:
             raise
 
 if __name__ == '__main__':
-    
+    import argparse
+
+    parser = argparse.ArgumentParser(description='米勒价值投资策略选股与买入评估')
+    parser.add_argument('--workers', type=int, default=1, help='并行评估的进程数，默认1（串行）')
+    parser.add_argument('--resume', action='store_true', help='接续最近一次未完成的运行，跳过已完成的股票')
+    parser.add_argument('--run-id', default=None, help='指定运行ID，接续该运行')
+    args = parser.parse_args()
+
     repo = FinancialDataRepository(DB_CONFIG)
-    repo.connect()
-    runner = MillerStrategyRunner(repo)
+    if not repo.connect():
+        raise SystemExit(1)
+
+    from checkpoint import CheckpointLedger
+    ledger = CheckpointLedger('sel', run_id=args.run_id, resume=args.resume)
+    repo.warm_market_averages()
+    runner = MillerStrategyRunner(repo, workers=args.workers, ledger=ledger)
     # runner.strategy.evaluate_selection("300529", repo, "2023-12-31")
     # runner.sel_for_stocks('2024-03-31')
     
     dates = ['2023-12-31','2024-03-31','2024-06-30','2024-09-30','2024-12-31','2025-03-31','2025-06-30','2025-09-30']
 
-    for end_date in dates:
-        runner.sel_for_stocks(end_date)
+    # 单进程时用回测引擎执行多个日期：报表历史只加载一次，按日期增量推进；多进程时逐个日期分块并行
+    # 两种方式都按进度账本跳过已完成的日期或股票
+    from backtest import BacktestEngine
+    engine = BacktestEngine(runner)
+    if args.workers > 1:
+        for end_date in dates:
+            runner.sel_for_stocks(end_date)
+    else:
+        engine.run(dates, 'sel')
+    # 只有全部分块都写入并记录后才标记运行完成，否则保留账本供接续
+    if runner.unfinished == 0:
+        ledger.complete()
+    else:
+        logger.warning(f"{runner.unfinished}只股票未完成，可使用--resume或--run-id {ledger.run_id}接续")
     '''
     start_date = '2024-01-01'
 
@@ -1238,10 +2040,8 @@ if __name__ == '__main__':
     for i, date in enumerate(date_list, 1):
         print(f"第{i}天: {date}")
     
-    # 示例：对每个日期执行策略
-    for end_date in date_list:
-        print(f"\n处理日期: {end_date}")
-        runner.buy_for_stocks(end_date)
+    # 示例：逐日执行买入评估，历史数据和as-of索引只加载一次
+    engine.run(date_list, 'buy')
     '''
     # 绘制trade_stocks数据图表
     # print("\n开始绘制trade_stocks数据图表...")
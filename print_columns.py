@@ -1,16 +1,19 @@
 #!/usr/bin/env python3
 """
 打印cash_flow_df中所有元素的列的名称，并演示如何按序号获取元素值
+数据优先从本地响应缓存读取（见response_cache.py），未命中时才请求akshare
 """
 import pandas as pd
 import akshare as ak
+from response_cache import ResponseCache
 
 # 获取一个股票代码的现金流量表数据作为示例
 stock_code = "000001"  # 平安银行作为示例
 
 try:
     # 使用akshare获取现金流量表数据
-    cash_flow_df = ak.stock_financial_report_sina(stock=stock_code, symbol="现金流量表")
+    cash_flow_df = ResponseCache().fetch('stock_financial_report_sina', stock_code, {'symbol': '现金流量表'},
+                                         lambda: ak.stock_financial_report_sina(stock=stock_code, symbol="现金流量表"))
     
     if cash_flow_df.empty:
         print(f"股票代码 {stock_code} 的现金流量表数据为空")
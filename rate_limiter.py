@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+请求限速与超时控制
+功能：
+1. 令牌桶限速器，多个抓取线程共享，平均速率不超过设定值，允许少量突发
+2. 遇到限流错误（HTTP 429/456/403、请求过于频繁）时按比例降速，连续成功后逐步恢复到设定速率
+3. 为不支持timeout参数的接口（如akshare）提供带超时的调用，超时后仍未返回的后台调用数不超过设定上限
+4. 按固定间隔输出进度和吞吐量
+"""
+
+import re
+import time
+import logging
+import threading
+
+from config import FETCH_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# 出现在异常信息中即视为被限流
+_THROTTLE_PATTERN = re.compile(r"\b(429|456|403)\b|too many requests|rate limit|频繁|限流", re.IGNORECASE)
+
+
+def is_throttled(error: Exception) -> bool:
+    """判断异常是否为服务端限流，是则调用方应降速；超时、连接中断等网络错误不算限流"""
+    status = getattr(getattr(error, 'response', None), 'status_code', None)
+    if status in (403, 429, 456):
+        return True
+    return bool(_THROTTLE_PATTERN.search(str(error)))
+
+
+_orphaned = 0  # 已超时、后台线程仍未返回的调用数
+_orphaned_changed = threading.Condition()
+
+
+def orphaned_calls() -> int:
+    """返回已超时、后台线程仍未返回的调用数"""
+    with _orphaned_changed:
+        return _orphaned
+
+
+def call_with_timeout(func, timeout: float, *args, **kwargs):
+    """
+    在后台线程中调用func，超过timeout秒未返回时抛出TimeoutError；超时的调用不能被中断，结果被丢弃
+
+    akshare不接受timeout参数，超时的调用会留在后台直到底层连接自行结束；这样的调用达到
+    FETCH_CONFIG['max_orphaned']个时，先最多等待timeout秒让其中一个返回，仍未返回则不发出新调用，直接抛出TimeoutError
+
+    Args:
+        func: 被调用的函数
+        timeout: 超时时间（秒），为None或0时直接调用
+        *args, **kwargs: 传给func的参数
+
+    Returns:
+        func的返回值
+    """
+    global _orphaned
+    if not timeout:
+        return func(*args, **kwargs)
+    limit = FETCH_CONFIG['max_orphaned']
+    with _orphaned_changed:
+        if not _orphaned_changed.wait_for(lambda: _orphaned < limit, timeout):
+            raise TimeoutError(f"已有{_orphaned}个超时的请求仍未返回，暂不发出新请求")
+    outcome = {}
+    done = threading.Event()
+
+    def target():
+        global _orphaned
+        try:
+            outcome['value'] = func(*args, **kwargs)
+        except BaseException as e:
+            outcome['error'] = e
+        finally:
+            with _orphaned_changed:
+                done.set()
+                if outcome.get('orphaned'):
+                    _orphaned -= 1
+                    _orphaned_changed.notify_all()
+
+    threading.Thread(target=target, daemon=True).start()
+    if not done.wait(timeout):
+        with _orphaned_changed:
+            # 等待超时与调用返回可能同时发生，加锁后再确认一次
+            if not done.is_set():
+                outcome['orphaned'] = True
+                _orphaned += 1
+                raise TimeoutError(f"请求超过{timeout}秒未返回")
+    if 'error' in outcome:
+        raise outcome['error']
+    return outcome['value']
+
+
+class TokenBucket:
+    """自适应令牌桶限速器类，线程安全"""
+
+    def __init__(self, rate: float, burst: int = None, min_rate: float = None, backoff: float = None,
+                 recover: float = None, recover_after: int = None, clock=time.monotonic, sleep=time.sleep):
+        """
+        初始化限速器
+
+        Args:
+            rate: 设定速率（次/秒），也是恢复时的上限
+            burst: 令牌桶容量；min_rate、backoff、recover、recover_after见FETCH_CONFIG，默认取其中的值
+            clock: 单调时钟函数，测试时可替换
+            sleep: 等待函数，测试时可替换
+        """
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.capacity = float(burst or FETCH_CONFIG['burst'])
+        self.min_rate = min(min_rate or FETCH_CONFIG['min_rate'], self.max_rate)
+        self.backoff = backoff or FETCH_CONFIG['backoff']
+        self.recover = recover or FETCH_CONFIG['recover']
+        self.recover_after = recover_after or FETCH_CONFIG['recover_after']
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._successes = 0  # 上次调整速率后的连续成功次数
+
+    def _refill(self, now: float):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """取一个令牌，令牌不足时等待"""
+        while True:
+            with self._lock:
+                self._refill(self._clock())
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            self._sleep(wait)
+
+    def throttled(self):
+        """报告一次限流：速率乘以backoff（不低于min_rate），并清空已积累的令牌"""
+        with self._lock:
+            self._refill(self._clock())
+            self.rate = max(self.min_rate, self.rate * self.backoff)
+            self._tokens = min(self._tokens, 0.0)
+            self._successes = 0
+            rate = self.rate
+        logger.warning(f"请求被限流，速率降为{rate:.2f}次/秒")
+
+    def succeeded(self):
+        """报告一次成功：连续成功recover_after次后速率乘以recover，不超过设定速率"""
+        with self._lock:
+            if self.rate >= self.max_rate:
+                return
+            self._successes += 1
+            if self._successes < self.recover_after:
+                return
+            self._refill(self._clock())
+            self.rate = min(self.max_rate, self.rate * self.recover)
+            self._successes = 0
+            rate = self.rate
+        logger.info(f"速率恢复为{rate:.2f}次/秒")
+
+
+class ThroughputMeter:
+    """进度与吞吐量日志类，每隔interval秒输出一次"""
+
+    def __init__(self, total: int, interval: float = None, clock=time.monotonic):
+        """
+        Args:
+            total: 总数
+            interval: 日志间隔（秒），默认取FETCH_CONFIG['progress_interval']
+            clock: 单调时钟函数
+        """
+        self.total = total
+        self.interval = interval if interval is not None else FETCH_CONFIG['progress_interval']
+        self.count = 0
+        self._clock = clock
+        self._start = clock()
+        self._last = self._start
+
+    def update(self, n: int = 1, note: str = '') -> bool:
+        """
+        累加完成数，距上次输出超过interval或全部完成时输出进度
+
+        Args:
+            n: 本次完成数
+            note: 附加在日志末尾的说明，如当前速率
+
+        Returns:
+            bool: 本次是否输出了日志
+        """
+        self.count += n
+        now = self._clock()
+        if now - self._last < self.interval and self.count < self.total:
+            return False
+        self._last = now
+        elapsed = max(now - self._start, 1e-9)
+        speed = self.count / elapsed
+        remaining = (self.total - self.count) / speed if speed > 0 else float('nan')
+        logger.info(f"进度 {self.count}/{self.total}, {speed:.2f}只/秒, 预计剩余{remaining:.0f}秒" + (f", {note}" if note else ''))
+        return True
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+akshare原始响应缓存
+功能：
+1. 按(接口, 代码, 参数)的哈希值寻址，把抓取到的报表DataFrame保存为本地文件，重复运行时不再重新下载
+2. 每个响应保存为一个压缩的.npz文件，每列一个数组：数值列保持原类型，其余列保存为字符串并附带空值掩码，不使用pickle
+3. 超过有效期的缓存重新请求；目录总大小超过上限时按最近使用时间淘汰
+4. 离线模式只从缓存读取（不检查有效期），缓存中没有时抛出CacheMiss，导入流程的测试和基准可以不访问网络
+
+用法：
+    cache = ResponseCache()
+    df = cache.fetch('stock_financial_report_sina', 'sh600000', {'symbol': '现金流量表'},
+                     lambda: ak.stock_financial_report_sina(stock='sh600000', symbol='现金流量表'))
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Callable, Optional
+
+import numpy as np
+import pandas as pd
+
+from config import CACHE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class CacheMiss(KeyError):
+    """离线模式下缓存中没有请求的响应"""
+
+
+def cache_key(endpoint: str, symbol: str, params: dict = None) -> str:
+    """返回(接口, 代码, 参数)的SHA-256哈希值，参数按键排序，与传入顺序无关"""
+    payload = json.dumps([endpoint, symbol, params or {}], ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """akshare原始响应缓存类，线程安全"""
+
+    def __init__(self, root: str = None, ttl: float = None, max_bytes: int = None, offline: bool = None):
+        """
+        初始化缓存
+
+        Args:
+            root: 缓存目录，默认取CACHE_CONFIG['root']
+            ttl: 有效期（秒），默认取CACHE_CONFIG['ttl']
+            max_bytes: 目录大小上限（字节），默认取CACHE_CONFIG['max_bytes']
+            offline: 是否为离线模式，默认取CACHE_CONFIG['offline']
+        """
+        self.root = root or CACHE_CONFIG['root']
+        self.ttl = ttl if ttl is not None else CACHE_CONFIG['ttl']
+        self.max_bytes = max_bytes if max_bytes is not None else CACHE_CONFIG['max_bytes']
+        self.offline = CACHE_CONFIG['offline'] if offline is None else offline
+        self._lock = threading.Lock()
+        self._total = None  # 目录总大小（字节），首次写入时扫描得到，之后随写入累加
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], f"{key}.npz")
+
+    @staticmethod
+    def _encode(df: pd.DataFrame) -> dict:
+        arrays = {}
+        columns = []
+        for i, col in enumerate(df.columns):
+            values = df[col].to_numpy()
+            if values.dtype.kind in 'biuf':
+                arrays[f"c{i}"] = values
+                kind = 'num'
+            else:
+                mask = pd.isna(df[col]).to_numpy()
+                arrays[f"c{i}"] = np.asarray(df[col].where(~mask, '').astype(str).to_numpy(), dtype=str)
+                arrays[f"m{i}"] = mask
+                kind = 'str'
+            columns.append({'name': str(col), 'kind': kind})
+        arrays['_meta'] = np.array(json.dumps({'columns': columns, 'rows': len(df)}, ensure_ascii=False))
+        return arrays
+
+    @staticmethod
+    def _decode(data) -> pd.DataFrame:
+        meta = json.loads(str(data['_meta']))
+        out = {}
+        for i, column in enumerate(meta['columns']):
+            values = data[f"c{i}"]
+            if column['kind'] == 'str':
+                values = values.astype(object)
+                values[data[f"m{i}"]] = None
+            out[column['name']] = values
+        return pd.DataFrame(out, index=pd.RangeIndex(meta['rows']))
+
+    def get(self, endpoint: str, symbol: str, params: dict = None) -> Optional[pd.DataFrame]:
+        """
+        读取缓存的响应
+
+        Args:
+            endpoint: 接口名，如stock_financial_report_sina
+            symbol: 请求的代码
+            params: 其他请求参数
+
+        Returns:
+            pd.DataFrame: 缓存的响应；不存在或已过期时返回None，离线模式下不存在时抛出CacheMiss
+        """
+        path = self._path(cache_key(endpoint, symbol, params))
+        try:
+            age = time.time() - os.path.getmtime(path)
+            if not self.offline and age > self.ttl:
+                self.misses += 1
+                return None
+            with np.load(path, allow_pickle=False) as data:
+                df = self._decode(data)
+            # 读取时更新访问时间，淘汰时按它判断最近使用
+            os.utime(path, (time.time(), os.path.getmtime(path)))
+            self.hits += 1
+            return df
+        except (OSError, ValueError, KeyError) as e:
+            self.misses += 1
+            if self.offline:
+                raise CacheMiss(f"离线模式下缓存中没有{endpoint}({symbol}, {params})") from e
+            return None
+
+    def put(self, endpoint: str, symbol: str, params: dict, df: pd.DataFrame):
+        """
+        保存响应：先写临时文件再替换，之后按目录大小上限淘汰
+
+        Args:
+            endpoint: 接口名
+            symbol: 请求的代码
+            params: 其他请求参数
+            df: 响应数据
+        """
+        path = self._path(cache_key(endpoint, symbol, params))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            old_size = os.path.getsize(path) if os.path.exists(path) else 0
+            with open(tmp_path, 'wb') as f:
+                np.savez_compressed(f, **self._encode(df))
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"写入响应缓存失败: {e}")
+            return
+        with self._lock:
+            if self._total is None:
+                self._total = sum(s for _, s, _ in self._scan())
+            else:
+                self._total += size - old_size
+            over = self._total > self.max_bytes
+        if over:
+            self.evict()
+
+    def fetch(self, endpoint: str, symbol: str, params: dict, loader: Callable[[], pd.DataFrame]) -> pd.DataFrame:
+        """
+        命中缓存时直接返回，否则调用loader请求并写入缓存；离线模式下不调用loader
+
+        Args:
+            endpoint: 接口名
+            symbol: 请求的代码
+            params: 其他请求参数
+            loader: 无参数的请求函数，异常原样抛出且不写入缓存
+
+        Returns:
+            pd.DataFrame: 响应数据
+        """
+        df = self.get(endpoint, symbol, params)
+        if df is not None:
+            return df
+        df = loader()
+        if isinstance(df, pd.DataFrame):
+            self.put(endpoint, symbol, params, df)
+        return df
+
+    def _scan(self) -> list:
+        """返回缓存目录中全部响应文件的(访问时间, 大小, 路径)"""
+        entries = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if not name.endswith('.npz'):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_atime, st.st_size, path))
+        return entries
+
+    def evict(self) -> int:
+        """
+        目录总大小超过max_bytes时，按最近使用时间从旧到新删除文件，直到不超过上限
+
+        Returns:
+            int: 删除的文件数
+        """
+        with self._lock:
+            entries = self._scan()
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+            self._total = total
+        if removed:
+            logger.info(f"响应缓存超过上限，淘汰{removed}个文件")
+        return removed
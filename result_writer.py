@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+策略结果批量写入
+功能：
+1. 缓冲sel_stocks、trade_stocks的结果行，按batch_size分批用executemany写入
+2. 一个end_date的全部结果在同一个事务中提交，失败时整体回滚
+3. 使用schema.build_upsert_sql生成的按主键幂等写入语句，重复运行同一日期时覆盖已有结果，不再逐行报主键冲突
+"""
+
+import math
+import logging
+from typing import Dict, List
+
+from config import RESULT_WRITER_CONFIG
+from schema import TABLE_SPECS, build_upsert_sql
+
+logger = logging.getLogger(__name__)
+
+
+def _to_param(value):
+    """NumPy标量转换为Python值，NaN写为NULL"""
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+class ResultWriter:
+    """策略结果批量写入类"""
+
+    def __init__(self, repo, batch_size: int = None):
+        """
+        初始化结果写入器
+
+        Args:
+            repo: 财务数据仓库实例，写入使用其当前线程的连接和数据库后端
+            batch_size: 每次executemany写入的行数，默认取RESULT_WRITER_CONFIG['batch_size']
+        """
+        self.repo = repo
+        self.batch_size = batch_size or RESULT_WRITER_CONFIG['batch_size']
+        self._buffers: Dict[str, List[tuple]] = {}
+
+    def add(self, table: str, row: tuple):
+        """
+        缓冲一行结果
+
+        Args:
+            table: 结果表名，sel_stocks或trade_stocks
+            row: 按TABLE_SPECS中字段顺序排列的值
+        """
+        if len(row) != len(TABLE_SPECS[table]['columns']):
+            raise ValueError(f"表{table}的字段数为{len(TABLE_SPECS[table]['columns'])}, 实际为{len(row)}")
+        self._buffers.setdefault(table, []).append(tuple(_to_param(v) for v in row))
+
+    def add_sel_stock(self, stock_code: str, end_date: str):
+        """缓冲一条选股结果"""
+        self.add('sel_stocks', (stock_code, end_date))
+
+    def add_trade_stock(self, stock_code: str, end_date: str, price, op: str, score: int):
+        """缓冲一条买卖结果"""
+        self.add('trade_stocks', (stock_code, end_date, price, op, score))
+
+    def pending(self) -> int:
+        """返回尚未写入的行数"""
+        return sum(len(rows) for rows in self._buffers.values())
+
+    def commit(self) -> bool:
+        """
+        在一个事务中分批写入全部缓冲行并提交，失败时回滚；无论成功与否都清空缓冲
+
+        Returns:
+            bool: 写入成功（或没有待写入的行）返回True，失败返回False
+        """
+        if not self.pending():
+            return True
+        buffers, self._buffers = self._buffers, {}
+        connection = self.repo.connection
+        try:
+            with connection.cursor() as cursor:
+                for table, rows in buffers.items():
+                    sql = build_upsert_sql(table, dialect=self.repo.backend.name)
+                    for start in range(0, len(rows), self.batch_size):
+                        cursor.executemany(sql, rows[start:start + self.batch_size])
+            connection.commit()
+            logger.info("写入结果成功: " + ", ".join(f"{t}={len(r)}行" for t, r in buffers.items()))
+            return True
+        except Exception as e:
+            logger.error(f"写入结果失败: {e}")
+            connection.rollback()
+            return False
@@ -0,0 +1,375 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据库表结构管理
+功能：
+1. 根据tables.py中的profit_order/balance_order/cashflow_order生成带类型的建表语句：
+   金额列为DECIMAL，日期列为DATE，(Stkcd, Accper)为主键，Accper上建二级索引
+2. 为trade(Stkcd, Trddt)和shares(Stkcd, Reptdt)生成同样结构的建表语句
+3. 为结果表sel_stocks、trade_stocks生成以(Stkcd, end_date)为主键的建表语句
+4. 提供迁移命令，将已有的全VARCHAR(255)表原地转换为上述结构（仅MySQL）
+5. 支持SQLite方言：数值列为REAL、日期和字符串列为TEXT，二级索引单独用CREATE INDEX创建
+6. 生成按主键幂等写入的INSERT语句：MySQL为ON DUPLICATE KEY UPDATE，SQLite为ON CONFLICT DO UPDATE
+
+用法：
+    python schema.py create [--tables profit balance] [--dry-run]
+    python schema.py migrate [--tables profit balance] [--dry-run]
+    python schema.py create --sqlite stock.db
+"""
+
+import sys
+import logging
+import argparse
+from typing import List, Dict, Any
+
+from backends import create_backend
+from tables import (profit_order, balance_order, cashflow_order,
+                    profit_mapping_revert, balance_mapping_revert, cashflow_mapping_revert)
+
+logger = logging.getLogger(__name__)
+
+# 日线行情表(TRD_Dalyr)和股本变动表(CG_Capchg)的默认字段顺序
+TRADE_ORDER = [
+    "Stkcd", "Trddt", "Opnprc", "Hiprc", "Loprc", "Clsprc", "Dnshrtrd", "Dnvaltrd",
+    "Dsmvosd", "Dsmvtll", "Dretwd", "Dretnd", "Adjprcwd", "Adjprcnd", "Markettype",
+    "Capchgdt", "Trdsta"
+]
+SHARES_ORDER = ["Stkcd", "Reptdt", "Nshrttl"]
+# 策略结果表
+SEL_STOCKS_ORDER = ["Stkcd", "end_date"]
+TRADE_STOCKS_ORDER = ["Stkcd", "end_date", "price", "op", "score"]
+
+# 每张表的字段顺序、字段注释和主键
+TABLE_SPECS = {
+    'profit': {'columns': profit_order, 'comments': profit_mapping_revert, 'key': ('Stkcd', 'Accper')},
+    'balance': {'columns': balance_order, 'comments': balance_mapping_revert, 'key': ('Stkcd', 'Accper')},
+    'cash_flow': {'columns': cashflow_order, 'comments': cashflow_mapping_revert, 'key': ('Stkcd', 'Accper')},
+    'trade': {'columns': TRADE_ORDER, 'comments': {}, 'key': ('Stkcd', 'Trddt')},
+    'shares': {'columns': SHARES_ORDER, 'comments': {}, 'key': ('Stkcd', 'Reptdt')},
+    'sel_stocks': {'columns': SEL_STOCKS_ORDER, 'comments': {}, 'key': ('Stkcd', 'end_date')},
+    'trade_stocks': {'columns': TRADE_STOCKS_ORDER, 'comments': {'price': '价格', 'op': '操作', 'score': '买入条件得分'},
+                     'key': ('Stkcd', 'end_date')},
+}
+
+DATE_COLUMNS = {'Accper', 'DeclareDate', 'Trddt', 'Reptdt', 'Capchgdt', 'end_date'}
+STRING_COLUMNS = {
+    'Stkcd': 'VARCHAR(20)',
+    'ShortName': 'VARCHAR(100)',
+    'Typrep': 'VARCHAR(10)',
+    'IfCorrect': 'VARCHAR(10)',
+    'Markettype': 'VARCHAR(10)',
+    'Trdsta': 'VARCHAR(10)',
+    'op': 'VARCHAR(2)',
+    'score': 'VARCHAR(2)',
+}
+DECIMAL_TYPE = 'DECIMAL(26,6)'
+KEY_COMMENTS = {'Stkcd': '证券代码', 'Accper': '统计截止日期', 'Trddt': '交易日期', 'Reptdt': '报告日期',
+                'end_date': '截止日期'}
+
+# MySQL中合法数值的正则，迁移前不匹配的值置为NULL
+NUMERIC_PATTERN = r'^[-+]?[0-9]*\\.?[0-9]+([eE][-+]?[0-9]+)?$'
+
+
+def column_type(column: str, dialect: str = 'mysql') -> str:
+    """
+    返回字段的数据库类型
+
+    Args:
+        column: 字段名
+        dialect: mysql或sqlite
+
+    Returns:
+        str: 字段类型
+    """
+    if column in STRING_COLUMNS:
+        return STRING_COLUMNS[column] if dialect == 'mysql' else 'TEXT'
+    if column in DATE_COLUMNS:
+        return 'DATE' if dialect == 'mysql' else 'TEXT'
+    return DECIMAL_TYPE if dialect == 'mysql' else 'REAL'
+
+
+def _column_definition(table: str, column: str, dialect: str = 'mysql') -> str:
+    spec = TABLE_SPECS[table]
+    definition = f"`{column}` {column_type(column, dialect)}"
+    if column in spec['key']:
+        definition += " NOT NULL"
+    comment = spec['comments'].get(column) or KEY_COMMENTS.get(column)
+    if comment and dialect == 'mysql':
+        definition += " COMMENT '" + comment.replace("'", "''") + "'"
+    return definition
+
+
+def _index_name(table: str) -> str:
+    return f"idx_{table}_{TABLE_SPECS[table]['key'][1]}"
+
+
+def _key_definitions(table: str) -> List[str]:
+    key = TABLE_SPECS[table]['key']
+    return [
+        "PRIMARY KEY (" + ", ".join(f"`{c}`" for c in key) + ")",
+        f"KEY `{_index_name(table)}` (`{key[1]}`)",
+    ]
+
+
+def build_create_table_sql(table: str, columns: List[str] = None, dialect: str = 'mysql') -> str:
+    """
+    生成建表语句
+
+    Args:
+        table: 表名，取值为TABLE_SPECS中的表
+        columns: 字段顺序，默认使用TABLE_SPECS中的顺序；导入文件时传入文件表头
+        dialect: mysql或sqlite；sqlite的二级索引由build_index_sql单独生成
+
+    Returns:
+        str: CREATE TABLE语句
+    """
+    if table not in TABLE_SPECS:
+        raise ValueError(f"不支持的表: {table}")
+    columns = list(columns or TABLE_SPECS[table]['columns'])
+    for key in TABLE_SPECS[table]['key']:
+        if key not in columns:
+            raise ValueError(f"表{table}缺少主键字段: {key}")
+    lines = [_column_definition(table, c, dialect) for c in columns]
+    if dialect == 'mysql':
+        lines += _key_definitions(table)
+        suffix = " ENGINE=InnoDB DEFAULT CHARSET=utf8mb4"
+    else:
+        lines += _key_definitions(table)[:1]
+        suffix = ""
+    return f"CREATE TABLE IF NOT EXISTS `{table}` (\n  " + ",\n  ".join(lines) + "\n)" + suffix
+
+
+def build_index_sql(table: str, dialect: str = 'mysql') -> List[str]:
+    """
+    生成建表语句之外需要单独执行的建索引语句
+
+    Args:
+        table: 表名
+        dialect: mysql或sqlite
+
+    Returns:
+        List[str]: MySQL的索引已包含在建表语句中，返回空列表
+    """
+    if dialect == 'mysql':
+        return []
+    key = TABLE_SPECS[table]['key']
+    return [f"CREATE INDEX IF NOT EXISTS `{_index_name(table)}` ON `{table}` (`{key[1]}`)"]
+
+
+def build_upsert_sql(table: str, columns: List[str] = None, dialect: str = 'mysql') -> str:
+    """
+    生成按主键幂等写入的INSERT语句，主键已存在时用新值覆盖非主键字段，可直接用于executemany
+
+    Args:
+        table: 表名，取值为TABLE_SPECS中的表
+        columns: 写入的字段，默认使用TABLE_SPECS中的顺序
+        dialect: mysql或sqlite
+
+    Returns:
+        str: 使用%s占位符的INSERT语句
+    """
+    if table not in TABLE_SPECS:
+        raise ValueError(f"不支持的表: {table}")
+    columns = list(columns or TABLE_SPECS[table]['columns'])
+    key = TABLE_SPECS[table]['key']
+    updates = [c for c in columns if c not in key]
+    sql = (f"INSERT INTO `{table}` (" + ", ".join(f"`{c}`" for c in columns) + ") VALUES ("
+           + ", ".join(["%s"] * len(columns)) + ")")
+    if dialect == 'mysql':
+        # 全部字段都是主键时用主键自身赋值，重复行不报错也不修改
+        assignments = updates or [key[0]]
+        return sql + " ON DUPLICATE KEY UPDATE " + ", ".join(f"`{c}` = VALUES(`{c}`)" for c in assignments)
+    conflict = " ON CONFLICT (" + ", ".join(f"`{c}`" for c in key) + ")"
+    if not updates:
+        return sql + conflict + " DO NOTHING"
+    return sql + conflict + " DO UPDATE SET " + ", ".join(f"`{c}` = excluded.`{c}`" for c in updates)
+
+
+def build_migration_sql(table: str, existing_columns: List[str]) -> List[str]:
+    """
+    生成将已有字符串表转换为带类型表的语句
+
+    先用一次UPDATE把无法转换的数值/日期置为NULL，再用一条ALTER TABLE修改全部字段类型并添加主键和索引，
+    整张表只重建一次
+
+    Args:
+        table: 表名
+        existing_columns: 表中现有的字段名（SHOW COLUMNS的顺序）
+
+    Returns:
+        List[str]: 依次执行的SQL语句
+    """
+    if table not in TABLE_SPECS:
+        raise ValueError(f"不支持的表: {table}")
+    key = TABLE_SPECS[table]['key']
+    cleanups = []
+    for c in existing_columns:
+        t = column_type(c)
+        if t == DECIMAL_TYPE:
+            cleanups.append(f"`{c}` = IF(TRIM(`{c}`) REGEXP '{NUMERIC_PATTERN}', TRIM(`{c}`), NULL)")
+        elif t == 'DATE' and c not in key:
+            cleanups.append(f"`{c}` = IF(STR_TO_DATE(`{c}`, '%Y-%m-%d') IS NOT NULL "
+                            f"OR STR_TO_DATE(`{c}`, '%Y%m%d') IS NOT NULL, `{c}`, NULL)")
+    statements = []
+    if cleanups:
+        statements.append(f"UPDATE `{table}` SET " + ", ".join(cleanups))
+    alters = [f"MODIFY COLUMN {_column_definition(table, c)}" for c in existing_columns]
+    alters += ["ADD " + k for k in _key_definitions(table)]
+    statements.append(f"ALTER TABLE `{table}`\n  " + ",\n  ".join(alters))
+    return statements
+
+
+class SchemaManager:
+    """数据库表结构管理类"""
+
+    def __init__(self, db_config: Dict[str, Any]):
+        """
+        初始化表结构管理器
+
+        Args:
+            db_config: 数据库配置字典
+        """
+        self.db_config = db_config
+        self.backend = create_backend(db_config)
+        self.connection = None
+
+    def connect(self) -> bool:
+        """
+        连接到数据库
+
+        Returns:
+            bool: 连接成功返回True，失败返回False
+        """
+        try:
+            self.connection = self.backend.connect()
+            return True
+        except Exception as e:
+            logger.error(f"数据库连接失败: {e}")
+            return False
+
+    def close(self):
+        """关闭数据库连接"""
+        if self.connection:
+            self.connection.close()
+
+    def _execute(self, statements: List[str], dry_run: bool):
+        with self.connection.cursor() as cursor:
+            for sql in statements:
+                if dry_run:
+                    print(sql + ";\n")
+                else:
+                    cursor.execute(sql)
+        if not dry_run:
+            self.connection.commit()
+
+    def create_tables(self, tables: List[str] = None, dry_run: bool = False) -> bool:
+        """
+        创建带类型和索引的表（已存在的表不受影响）
+
+        Args:
+            tables: 表名列表，默认全部
+            dry_run: 为True时只打印语句不执行
+
+        Returns:
+            bool: 全部成功返回True
+        """
+        dialect = self.backend.name
+        statements = []
+        for t in (tables or list(TABLE_SPECS)):
+            statements.append(build_create_table_sql(t, dialect=dialect))
+            statements.extend(build_index_sql(t, dialect))
+        try:
+            self._execute(statements, dry_run)
+            return True
+        except Exception as e:
+            logger.error(f"建表失败: {e}")
+            return False
+
+    def migrate_table(self, table: str, dry_run: bool = False) -> bool:
+        """
+        将已有的字符串表原地迁移为带类型和主键的表
+
+        主键字段存在空值或重复时不做任何修改，记录错误后返回False
+
+        Args:
+            table: 表名
+            dry_run: 为True时只打印语句不执行
+
+        Returns:
+            bool: 迁移成功返回True
+        """
+        if self.backend.name != 'mysql':
+            logger.error(f"{self.backend.name}后端的表由create直接创建为带类型的结构，不需要迁移")
+            return False
+        key = TABLE_SPECS[table]['key']
+        try:
+            with self.connection.cursor() as cursor:
+                cursor.execute(f"SHOW COLUMNS FROM `{table}`")
+                existing = [row['Field'] for row in cursor.fetchall()]
+                missing = [k for k in key if k not in existing]
+                if missing:
+                    logger.error(f"表{table}缺少主键字段{missing}，跳过迁移")
+                    return False
+
+                cursor.execute(f"SELECT COUNT(*) AS n FROM `{table}` WHERE "
+                               + " OR ".join(f"`{k}` IS NULL OR `{k}` = ''" for k in key))
+                empty_keys = cursor.fetchone()['n']
+                cols = ", ".join(f"`{k}`" for k in key)
+                cursor.execute(f"SELECT COUNT(*) AS n FROM (SELECT {cols} FROM `{table}` "
+                               f"GROUP BY {cols} HAVING COUNT(*) > 1) d")
+                duplicates = cursor.fetchone()['n']
+            if empty_keys or duplicates:
+                logger.error(f"表{table}有{empty_keys}行主键为空、{duplicates}组主键重复，请先清理后再迁移")
+                return False
+
+            self._execute(build_migration_sql(table, existing), dry_run)
+            logger.info(f"表{table}迁移{'语句已生成' if dry_run else '完成'}")
+            return True
+        except Exception as e:
+            logger.error(f"迁移表{table}失败: {e}")
+            self.connection.rollback()
+            return False
+
+    def migrate(self, tables: List[str] = None, dry_run: bool = False) -> bool:
+        """
+        迁移多张表
+
+        Args:
+            tables: 表名列表，默认全部
+            dry_run: 为True时只打印语句不执行
+
+        Returns:
+            bool: 全部成功返回True
+        """
+        results = [self.migrate_table(t, dry_run) for t in (tables or list(TABLE_SPECS))]
+        return all(results)
+
+
+def main():
+    """主函数"""
+    from config import DB_CONFIG, SQLITE_CONFIG
+
+    parser = argparse.ArgumentParser(description='生成带类型和索引的表结构，或迁移已有的字符串表')
+    parser.add_argument('command', choices=['create', 'migrate'], help='create建表，migrate迁移已有表')
+    parser.add_argument('--tables', nargs='*', choices=list(TABLE_SPECS), default=None, help='表名，默认全部')
+    parser.add_argument('--dry-run', action='store_true', help='只打印SQL，不执行')
+    parser.add_argument('--sqlite', nargs='?', const=SQLITE_CONFIG['path'], default=None,
+                        help='在本地SQLite数据库文件中建表，默认路径取SQLITE_CONFIG')
+    args = parser.parse_args()
+
+    manager = SchemaManager(dict(SQLITE_CONFIG, path=args.sqlite) if args.sqlite else DB_CONFIG)
+    if not manager.connect():
+        sys.exit(1)
+    try:
+        if args.command == 'create':
+            ok = manager.create_tables(args.tables, args.dry_run)
+        else:
+            ok = manager.migrate(args.tables, args.dry_run)
+    finally:
+        manager.close()
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+行情信号流
+功能：
+1. 逐条消费(Stkcd, 时间, 价格)行情，来源可以是文件、管道（-为标准输入）或本地TCP端口（tcp://host:port）
+2. 入选股票的买入价格区间（backtest.BacktestEngine.buy_triggers）常驻内存，每个交易日刷新一次，每条行情只做5次区间比较
+3. 满足条件数跨过3（op=1买入）或1（op=0卖出）时立即产生信号，可选地按交易日批量写入trade_stocks表
+4. 提供用trade表历史收盘价回放的模式，并统计每条行情的处理耗时，超过预算的条数单独报告
+5. 日期早于当前交易日的迟到行情记录警告后丢弃，不回退价格区间
+
+行情行格式：Stkcd,时间,价格，时间为'YYYY-MM-DD'或'YYYY-MM-DD HH:MM:SS'
+
+用法：
+    python signal_stream.py replay 2024-01-01 2024-03-31
+    python signal_stream.py listen ticks.csv
+    tail -f ticks.csv | python signal_stream.py listen -
+    python signal_stream.py listen tcp://127.0.0.1:9000
+"""
+
+import sys
+import time
+import socket
+import logging
+import argparse
+from collections import deque
+from typing import Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from config import STREAM_CONFIG
+from batch_engine import BUY_CRITERIA
+from backtest import BacktestEngine
+
+logger = logging.getLogger(__name__)
+
+
+def iter_lines(source: str) -> Iterator[str]:
+    """
+    按行读取行情来源
+
+    Args:
+        source: 文件或命名管道路径；-为标准输入；tcp://host:port为在本地端口监听并读取一个连接
+    """
+    if source == '-':
+        yield from sys.stdin
+    elif source.startswith('tcp://'):
+        host, port = source[len('tcp://'):].rsplit(':', 1)
+        with socket.create_server((host, int(port))) as server:
+            logger.info(f"等待行情连接: {source}")
+            conn, addr = server.accept()
+            with conn, conn.makefile('r', encoding='utf-8') as f:
+                logger.info(f"行情连接建立: {addr}")
+                yield from f
+    else:
+        with open(source, 'r', encoding='utf-8') as f:
+            yield from f
+
+
+def parse_events(lines: Iterable[str]) -> Iterator[tuple]:
+    """把行情行解析为(Stkcd, 时间, 价格)，跳过空行、表头和无法解析的行"""
+    for line in lines:
+        parts = line.strip().split(',')
+        if len(parts) < 3:
+            continue
+        try:
+            yield parts[0].strip(), parts[1].strip(), float(parts[2])
+        except ValueError:
+            continue
+
+
+class SignalStream:
+    """行情信号流类，逐条行情与常驻内存的价格区间比较并产生买卖信号"""
+
+    def __init__(self, engine: BacktestEngine, stock_codes: List[str] = None, latency_budget_us: float = None):
+        """
+        初始化信号流
+
+        Args:
+            engine: 回测引擎，已调用load加载历史数据；用其报表窗口和价格区间缓存
+            stock_codes: 关注的股票，默认每个交易日从sel_stocks表读取入选股票
+            latency_budget_us: 单条行情的处理时间预算（微秒），默认取STREAM_CONFIG['latency_budget_us']
+        """
+        self.engine = engine
+        self.stock_codes = stock_codes
+        self.latency_budget_us = latency_budget_us or STREAM_CONFIG['latency_budget_us']
+        self.date = None
+        self._intervals = {}  # 股票代码 -> ((low, high), ...)，A-E各条件成立的价格区间
+        self._state = {}  # 股票代码 -> 最近一次产生的op
+        self._latencies = deque(maxlen=STREAM_CONFIG['latency_window'])  # 最近行情的处理耗时（纳秒）
+        self.events = 0  # 已处理的行情条数
+        self.over_budget = 0  # 处理耗时超过预算的行情条数
+        self.max_ns = 0  # 单条行情的最大处理耗时（纳秒）
+        self.late = 0  # 因日期早于当前交易日而丢弃的行情条数
+
+    def refresh(self, date: str):
+        """
+        推进到新的交易日：重新读取入选股票，并按当日的市场平均pb、股本和往年股价刷新价格区间
+
+        Args:
+            date: 交易日期（格式：YYYY-MM-DD）
+        """
+        if self.engine.write:
+            self.engine.runner.writer.commit()
+        self.engine.advance(date)
+        codes = self.stock_codes if self.stock_codes is not None else self.engine.runner.get_sel_codes(date)
+        triggers = self.engine.buy_triggers(codes, date)
+        lows = triggers[[f'{c}_low' for c in BUY_CRITERIA]].to_numpy().tolist()
+        highs = triggers[[f'{c}_high' for c in BUY_CRITERIA]].to_numpy().tolist()
+        self._intervals = {code: tuple(zip(lo, hi)) for code, lo, hi in zip(triggers.index, lows, highs)}
+        self.date = date
+
+    def process(self, stock_code: str, timestamp: str, price: float) -> Optional[dict]:
+        """
+        处理一条行情
+
+        Args:
+            stock_code: 股票代码
+            timestamp: 时间，前10位为日期
+            price: 价格
+
+        Returns:
+            dict: 满足条件数跨入买入或卖出区域时返回信号（Stkcd、timestamp、price、op、score），否则返回None；
+                  日期早于当前交易日的行情丢弃并返回None
+        """
+        start = time.perf_counter_ns()
+        date = timestamp[:10]
+        if self.date is not None and date < self.date:
+            # 报表窗口只能向前推进，迟到的行情无法按其日期的价格区间评估
+            self.late += 1
+            logger.warning(f"丢弃迟到的行情: 股票代码={stock_code}, 时间={timestamp}, 当前交易日={self.date}")
+            return None
+        if date != self.date:
+            self.refresh(date)
+            start = time.perf_counter_ns()  # 换日求解不计入单条行情的处理耗时
+        signal = None
+        intervals = self._intervals.get(stock_code)
+        if intervals is not None:
+            score = sum(1 for low, high in intervals if low < price < high)
+            op = '1' if score >= 3 else '0' if score <= 1 else None
+            if op is not None and self._state.get(stock_code) != op:
+                self._state[stock_code] = op
+                signal = {'Stkcd': stock_code, 'timestamp': timestamp, 'price': price, 'op': op, 'score': score}
+        elapsed = time.perf_counter_ns() - start
+        self._latencies.append(elapsed)
+        self.events += 1
+        self.max_ns = max(self.max_ns, elapsed)
+        if elapsed > self.latency_budget_us * 1000:
+            self.over_budget += 1
+        if signal is not None and self.engine.write:
+            self.engine.runner.writer.add_trade_stock(stock_code, date, price, signal['op'], signal['score'])
+        return signal
+
+    def run(self, events: Iterable[tuple]) -> Iterator[dict]:
+        """
+        依次处理行情并产生信号
+
+        Args:
+            events: (Stkcd, 时间, 价格)序列
+
+        Yields:
+            dict: 买卖信号
+        """
+        for stock_code, timestamp, price in events:
+            signal = self.process(stock_code, timestamp, price)
+            if signal is not None:
+                logger.info(f"信号: 股票代码={signal['Stkcd']}, 时间={signal['timestamp']}, 价格={signal['price']}, "
+                            f"op={signal['op']}, score={signal['score']}")
+                yield signal
+        if self.engine.write:
+            self.engine.runner.writer.commit()
+
+    def latency_stats(self) -> dict:
+        """
+        返回单条行情处理耗时的统计；分位数按最近STREAM_CONFIG['latency_window']条计算，其余为全部行情的累计值
+
+        Returns:
+            dict: events、p50_us、p99_us、max_us、over_budget（超过预算的条数）、late（丢弃的迟到行情条数）
+        """
+        if not self._latencies:
+            return {'events': 0, 'p50_us': np.nan, 'p99_us': np.nan, 'max_us': np.nan, 'over_budget': 0,
+                    'late': self.late}
+        us = np.asarray(self._latencies, dtype='float64') / 1000.0
+        return {
+            'events': self.events,
+            'p50_us': float(np.percentile(us, 50)),
+            'p99_us': float(np.percentile(us, 99)),
+            'max_us': self.max_ns / 1000.0,
+            'over_budget': self.over_budget,
+            'late': self.late,
+        }
+
+
+def replay_events(repo, start_date: str, end_date: str, codes: List[str] = None) -> Iterator[tuple]:
+    """
+    用trade表的历史收盘价生成按日期排序的行情
+
+    Args:
+        repo: 财务数据仓库实例
+        start_date: 开始日期
+        end_date: 结束日期
+        codes: 股票代码列表，默认全部股票
+    """
+    df = repo.get_trade_history(start_date, end_date, codes)
+    if df.empty:
+        return
+    yield from zip(df['Stkcd'].astype(str), df['Trddt'].astype(str), df['Clsprc'].astype(float))
+
+
+def main():
+    """主函数：回放历史行情或监听实时行情"""
+    from config import DB_CONFIG
+    from miller_value import FinancialDataRepository, MillerStrategyRunner
+
+    parser = argparse.ArgumentParser(description='米勒策略行情信号流')
+    sub = parser.add_subparsers(dest='command', required=True)
+    replay = sub.add_parser('replay', help='用trade表历史收盘价回放')
+    replay.add_argument('start', help='开始日期，格式YYYY-MM-DD')
+    replay.add_argument('end', help='结束日期，格式YYYY-MM-DD')
+    listen = sub.add_parser('listen', help='从文件、管道或本地端口读取行情')
+    listen.add_argument('source', help='文件路径、-（标准输入）或tcp://host:port')
+    listen.add_argument('--until', default='2099-12-31', help='加载报表历史的截止日期')
+    parser.add_argument('--dry-run', action='store_true', help='只产生信号不写入trade_stocks表')
+    args = parser.parse_args()
+
+    repo = FinancialDataRepository(DB_CONFIG)
+    if not repo.connect():
+        return
+    try:
+        engine = BacktestEngine(MillerStrategyRunner(repo), write=not args.dry_run)
+        if args.command == 'replay':
+            engine.load(args.end)
+            events = replay_events(repo, args.start, args.end)
+        else:
+            engine.load(args.until)
+            events = parse_events(iter_lines(args.source))
+        stream = SignalStream(engine)
+        count = sum(1 for _ in stream.run(events))
+        logger.info(f"产生信号{count}条, 处理耗时统计: {stream.latency_stats()}")
+    finally:
+        repo.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,580 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地列式快照存储
+功能：
+1. 将profit、balance、cash_flow、trade、shares（以及inflation_cn）表镜像为本地列式文件
+2. 每列保存为一个.npy文件，读取时以内存映射方式打开
+3. 每张表按(Stkcd, 日期)排序，同一股票的数据在文件中连续存放，按股票分区
+4. 以Accper/Trddt/Reptdt的高水位线增量同步，每次从高水位线往前回看一段时间重新拉取，
+   补上快照之后才到的同日数据和往期报表的更正
+5. 提供与FinancialDataRepository同名的get_*方法，供离线回测直接读取
+
+用法：
+    python snapshot_store.py --root snapshot
+    repo = FinancialDataRepository(DB_CONFIG, snapshot=SnapshotStore('snapshot'))
+"""
+
+import os
+import json
+import shutil
+import logging
+import argparse
+from datetime import datetime
+from typing import List, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+from config import SNAPSHOT_CONFIG
+from asof_index import AsOfIndex
+from columnar_fetch import fetch_frame
+from market_averages import compute_market_averages, compute_pb_avg, BALANCE_COLUMNS, PROFIT_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# 需要镜像的表及其增量同步使用的日期列，None表示每次全量同步
+SNAPSHOT_TABLES = {
+    'profit': 'Accper',
+    'balance': 'Accper',
+    'cash_flow': 'Accper',
+    'trade': 'Trddt',
+    'shares': 'Reptdt',
+    'inflation_cn': None,
+}
+
+# 始终按字符串保存的列（代码、简称、报表类型等）
+STRING_COLUMNS = {'Stkcd', 'ShortName', 'Typrep', 'IfCorrect', 'DeclareDate'}
+
+
+def dedup_key(df: pd.DataFrame, date_column: Optional[str]) -> List[str]:
+    """
+    快照表去重的键列：Stkcd、日期列，表中有Typrep列时加上Typrep
+
+    Args:
+        df: 快照表数据
+        date_column: 日期列，没有日期列的表为None
+
+    Returns:
+        list: 键列，缺少Stkcd或日期列时为空列表（不去重）
+    """
+    if not date_column or 'Stkcd' not in df.columns or date_column not in df.columns:
+        return []
+    return ['Stkcd', date_column] + (['Typrep'] if 'Typrep' in df.columns else [])
+
+
+def lookback_bound(high_water_mark: str, days: int) -> str:
+    """
+    返回高水位线往前days天的日期，格式与高水位线一致（YYYY-MM-DD或YYYYMMDD）
+
+    Args:
+        high_water_mark: 高水位线
+        days: 回看天数
+
+    Returns:
+        str: 回看窗口的起点，高水位线无法解析为日期时原样返回
+    """
+    if not days:
+        return high_water_mark
+    date = pd.to_datetime(high_water_mark, errors='coerce')
+    if pd.isna(date):
+        return high_water_mark
+    fmt = '%Y-%m-%d' if '-' in high_water_mark else '%Y%m%d'
+    return (date - pd.Timedelta(days=days)).strftime(fmt)
+
+
+class SnapshotStore:
+    """本地列式快照存储类，负责同步数据库数据并提供离线查询"""
+
+    def __init__(self, root: str, fetch_size: int = 50000, lookback_days: Dict[str, int] = None):
+        """
+        初始化快照存储
+
+        Args:
+            root: 快照文件根目录
+            fetch_size: 同步时每批从数据库读取的行数
+            lookback_days: 表名 -> 增量同步时从高水位线往前重新拉取的天数，默认取SNAPSHOT_CONFIG['lookback_days']
+        """
+        self.root = root
+        self.fetch_size = fetch_size
+        self.lookback_days = SNAPSHOT_CONFIG['lookback_days'] if lookback_days is None else lookback_days
+        self._tables = {}  # 已加载的表，存储(table, 列内存映射及分区索引)键值对
+        self._quarters = None  # balance表中出现过的全部Accper，升序
+        self._asof_indexes = {}  # 存储((table, column), AsOfIndex)键值对
+        self._market_averages = None  # 全部报告期的市场平均值
+
+    # ------------------------------------------------------------------
+    # 存储与同步
+    # ------------------------------------------------------------------
+
+    def _table_dir(self, table: str) -> str:
+        return os.path.join(self.root, table)
+
+    def read_meta(self, table: str) -> Optional[dict]:
+        """
+        读取表的元数据
+
+        Args:
+            table: 表名
+
+        Returns:
+            dict: 元数据字典，快照不存在时返回None
+        """
+        path = os.path.join(self._table_dir(table), 'meta.json')
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def has_table(self, table: str) -> bool:
+        """判断快照中是否存在指定表"""
+        return self.read_meta(table) is not None
+
+    def _normalize(self, df: pd.DataFrame, date_column: Optional[str]) -> pd.DataFrame:
+        """
+        将数据库返回的数据转换为可列式存储的类型：数值列转为float64，其余列转为字符串
+
+        Args:
+            df: 原始数据
+            date_column: 日期列名
+
+        Returns:
+            pd.DataFrame: 转换后的数据
+        """
+        out = {}
+        for col in df.columns:
+            s = df[col]
+            if col in STRING_COLUMNS or col == date_column:
+                out[col] = s.where(s.notna(), '').astype(str)
+                continue
+            num = pd.to_numeric(s, errors='coerce')
+            raw = s.where(s.notna(), '').astype(str).str.strip()
+            if num.notna().sum() == (raw != '').sum():
+                out[col] = num.astype('float64')
+            else:
+                out[col] = raw
+        return pd.DataFrame(out, index=df.index)
+
+    def _write_table(self, table: str, df: pd.DataFrame, date_column: Optional[str]):
+        """
+        将整张表写入快照目录，先写临时目录再替换，避免中途失败留下半份快照
+
+        Args:
+            table: 表名
+            df: 已转换类型的数据
+            date_column: 日期列名
+        """
+        if 'Stkcd' in df.columns:
+            sort_cols = ['Stkcd', date_column] if date_column else ['Stkcd']
+            df = df.sort_values(sort_cols, kind='mergesort').reset_index(drop=True)
+        table_dir = self._table_dir(table)
+        tmp_dir = table_dir + '.tmp'
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+
+        columns = []
+        for i, col in enumerate(df.columns):
+            values = df[col].to_numpy()
+            if values.dtype.kind == 'f':
+                arr = values.astype('float64')
+                kind = 'float'
+            else:
+                arr = np.asarray(values, dtype=str)
+                kind = 'str'
+            file_name = f"c{i}.npy"
+            np.save(os.path.join(tmp_dir, file_name), arr)
+            columns.append({'name': col, 'file': file_name, 'kind': kind})
+
+        # 股票分区索引：codes[i]的数据位于[offsets[i], offsets[i+1])
+        if 'Stkcd' in df.columns and len(df) > 0:
+            stkcd = np.asarray(df['Stkcd'].to_numpy(), dtype=str)
+            codes, starts = np.unique(stkcd, return_index=True)
+            offsets = np.append(starts, len(df)).astype('int64')
+        else:
+            codes = np.array([], dtype=str)
+            offsets = np.array([0], dtype='int64')
+        np.save(os.path.join(tmp_dir, '_codes.npy'), codes)
+        np.save(os.path.join(tmp_dir, '_offsets.npy'), offsets)
+
+        high_water_mark = None
+        if date_column and len(df) > 0:
+            dates = df[date_column]
+            dates = dates[dates != '']
+            if len(dates) > 0:
+                high_water_mark = str(dates.max())
+        meta = {
+            'table': table,
+            'date_column': date_column,
+            'columns': columns,
+            'rows': int(len(df)),
+            'high_water_mark': high_water_mark,
+            'synced_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+
+        if os.path.exists(table_dir):
+            shutil.rmtree(table_dir)
+        os.replace(tmp_dir, table_dir)
+        self._tables.pop(table, None)
+        self._asof_indexes = {k: v for k, v in self._asof_indexes.items() if k[0] != table}
+        if table in ('balance', 'profit'):
+            self._quarters = None
+            self._market_averages = None
+
+    def read_table(self, table: str, columns: List[str] = None) -> pd.DataFrame:
+        """
+        读取整张快照表
+
+        Args:
+            table: 表名
+            columns: 需要的列，默认全部列
+
+        Returns:
+            pd.DataFrame: 整张表数据，快照不存在时返回空DataFrame
+        """
+        if not self.has_table(table):
+            return pd.DataFrame()
+        t = self._load(table)
+        return self._take(table, slice(0, t['rows']), columns)
+
+    def sync_table(self, connection, table: str) -> int:
+        """
+        增量同步一张表：重新拉取日期列不早于回看窗口起点（高水位线往前lookback_days天）的行，
+        替换快照中窗口内的行；高水位线当天晚到的数据和窗口内更正过的往期数据都会更新。
+        全量和增量同步都按dedup_key去重，报表的合并（A）和母公司（B）口径各保留一行
+
+        Args:
+            connection: pymysql数据库连接
+            table: 表名
+
+        Returns:
+            int: 本次从数据库拉取的行数（含窗口内重新拉取的行）
+        """
+        if table not in SNAPSHOT_TABLES:
+            raise ValueError(f"不支持的快照表: {table}")
+        date_column = SNAPSHOT_TABLES[table]
+        meta = self.read_meta(table)
+        high_water_mark = meta.get('high_water_mark') if meta else None
+
+        if date_column and high_water_mark:
+            bound = lookback_bound(high_water_mark, self.lookback_days.get(table, 0))
+            sql = f"SELECT * FROM {table} WHERE {date_column} >= %s"
+            params = (bound,)
+        else:
+            sql = f"SELECT * FROM {table}"
+            params = ()
+
+        new_df = fetch_frame(connection, sql, params, self.fetch_size)
+
+        if new_df.empty and meta is not None:
+            logger.info(f"快照表{table}没有新数据，高水位线={high_water_mark}")
+            return 0
+
+        if date_column and high_water_mark:
+            old_df = self.read_table(table)
+            old_df = old_df[old_df[date_column] < bound]
+            df = pd.concat([old_df, self._normalize(new_df, date_column)], ignore_index=True)
+        else:
+            df = new_df
+        key = dedup_key(df, date_column)
+        if key:
+            df = df.drop_duplicates(key, keep='last')
+        self._write_table(table, self._normalize(df, date_column), date_column)
+        logger.info(f"快照表{table}同步完成，拉取 {len(new_df)} 行，共 {len(df)} 行")
+        return len(new_df)
+
+    def sync(self, connection, tables: List[str] = None) -> Dict[str, int]:
+        """
+        同步多张表
+
+        Args:
+            connection: pymysql数据库连接
+            tables: 表名列表，默认同步SNAPSHOT_TABLES中的全部表
+
+        Returns:
+            dict: 存储(table, 拉取行数)键值对
+        """
+        result = {}
+        for table in (tables or list(SNAPSHOT_TABLES)):
+            try:
+                result[table] = self.sync_table(connection, table)
+            except Exception as e:
+                logger.error(f"同步快照表{table}失败: {e}")
+                result[table] = -1
+        return result
+
+    # ------------------------------------------------------------------
+    # 读取
+    # ------------------------------------------------------------------
+
+    def _load(self, table: str) -> dict:
+        """以内存映射方式加载表的全部列及分区索引"""
+        if table in self._tables:
+            return self._tables[table]
+        meta = self.read_meta(table)
+        if meta is None:
+            raise FileNotFoundError(f"快照中不存在表: {table}")
+        table_dir = self._table_dir(table)
+        columns = {}
+        for col in meta['columns']:
+            columns[col['name']] = np.load(os.path.join(table_dir, col['file']), mmap_mode='r')
+        codes = np.load(os.path.join(table_dir, '_codes.npy'))
+        offsets = np.load(os.path.join(table_dir, '_offsets.npy'))
+        t = {
+            'meta': meta,
+            'rows': meta['rows'],
+            'date_column': meta['date_column'],
+            'columns': columns,
+            'offsets': offsets,
+            'code_pos': {code: i for i, code in enumerate(codes.tolist())},
+        }
+        self._tables[table] = t
+        return t
+
+    def _partition(self, table: str, stock_code: str) -> tuple:
+        """返回股票在表中的行范围[start, stop)"""
+        t = self._load(table)
+        i = t['code_pos'].get(stock_code)
+        if i is None:
+            return 0, 0
+        return int(t['offsets'][i]), int(t['offsets'][i + 1])
+
+    def _take(self, table: str, rows, columns: List[str] = None) -> pd.DataFrame:
+        """按行位置（slice或索引数组）取出指定列，构造DataFrame"""
+        t = self._load(table)
+        names = columns if columns is not None else list(t['columns'])
+        return pd.DataFrame({name: np.asarray(t['columns'][name][rows]) for name in names if name in t['columns']})
+
+    def _asof_row(self, table: str, stock_code: str, end_date: str, strict: bool = False) -> int:
+        """
+        返回股票在end_date当日或之前（strict时为之前）最近一行的位置
+
+        Returns:
+            int: 行位置，不存在时返回-1
+        """
+        start, stop = self._partition(table, stock_code)
+        if start == stop:
+            return -1
+        t = self._load(table)
+        dates = t['columns'][t['date_column']][start:stop]
+        k = int(np.searchsorted(dates, end_date, side='left' if strict else 'right'))
+        return start + k - 1 if k > 0 else -1
+
+    def asof_index(self, table: str, column: str) -> AsOfIndex:
+        """返回(并缓存)指定表、列的as-of索引"""
+        key = (table, column)
+        if key not in self._asof_indexes:
+            self._asof_indexes[key] = AsOfIndex.from_snapshot(self, table, column)
+        return self._asof_indexes[key]
+
+    def _rows_at(self, table: str, date: str) -> np.ndarray:
+        """返回日期列等于date的全部行位置"""
+        t = self._load(table)
+        return np.flatnonzero(t['columns'][t['date_column']] == date)
+
+    def get_stock_codes(self) -> List[str]:
+        """从balance快照获取所有股票代码"""
+        t = self._load('balance')
+        return [code for code in t['code_pos'] if code != '']
+
+    def resolve_quarter(self, end_date: str) -> Optional[str]:
+        """
+        返回balance表中不晚于end_date的最近一个Accper
+
+        Args:
+            end_date: 日期，格式为'YYYY-MM-DD'
+
+        Returns:
+            str: 报告期，不存在时返回None
+        """
+        if self._quarters is None:
+            t = self._load('balance')
+            self._quarters = np.unique(np.asarray(t['columns']['Accper']))
+        k = int(np.searchsorted(self._quarters, end_date, side='right'))
+        return str(self._quarters[k - 1]) if k > 0 else None
+
+    @staticmethod
+    def _projection(columns: Optional[List[str]]) -> Optional[List[str]]:
+        """按列投影时总是包含Stkcd、Accper"""
+        if columns is None:
+            return None
+        return list(dict.fromkeys(['Stkcd', 'Accper'] + list(columns)))
+
+    def get_quarterly(self, table: str, stock_code: str, limit: int = 12, end_date: str = None,
+                      columns: List[str] = None) -> pd.DataFrame:
+        """
+        获取单只股票截止日期前最近limit个季度的报表数据，按Accper降序排列
+
+        Args:
+            table: 报表名
+            stock_code: 股票代码
+            limit: 获取的季度数量
+            end_date: 截止日期（格式：YYYY-MM-DD），默认为当前日期
+            columns: 需要的列，默认全部列
+
+        Returns:
+            pd.DataFrame: 季度报表数据
+        """
+        if end_date is None:
+            end_date = datetime.now().strftime('%Y-%m-%d')
+        start, _ = self._partition(table, stock_code)
+        stop = self._asof_row(table, stock_code, end_date) + 1
+        if stop <= 0:
+            return pd.DataFrame()
+        rows = np.arange(stop - 1, max(start, stop - limit) - 1, -1)
+        return self._take(table, rows, self._projection(columns))
+
+    def get_profit_quarterly(self, stock_code: str, limit: int = 12, end_date: str = None,
+                             columns: List[str] = None) -> pd.DataFrame:
+        return self.get_quarterly('profit', stock_code, limit, end_date, columns)
+
+    def get_balance_quarterly(self, stock_code: str, limit: int = 12, end_date: str = None,
+                              columns: List[str] = None) -> pd.DataFrame:
+        return self.get_quarterly('balance', stock_code, limit, end_date, columns)
+
+    def get_cashflow_quarterly(self, stock_code: str, limit: int = 12, end_date: str = None,
+                               columns: List[str] = None) -> pd.DataFrame:
+        return self.get_quarterly('cash_flow', stock_code, limit, end_date, columns)
+
+    def get_statement_panel(self, table: str, codes: List[str] = None, end_date: str = None, last_n: int = 12,
+                            columns: List[str] = None) -> pd.DataFrame:
+        """
+        获取多只股票最近last_n个季度的面板数据，格式与FinancialDataRepository.get_statement_panel一致
+
+        Args:
+            table: 报表名
+            codes: 股票代码列表，为None时获取全部股票
+            end_date: 截止日期（格式：YYYY-MM-DD），默认为当前日期
+            last_n: 每只股票获取的季度数量
+            columns: 需要的列，默认全部列
+
+        Returns:
+            pd.DataFrame: 以(Stkcd, Accper)为索引的面板数据
+        """
+        if end_date is None:
+            end_date = datetime.now().strftime('%Y-%m-%d')
+        t = self._load(table)
+        if codes is None:
+            codes = sorted(t['code_pos'])
+        parts = []
+        for code in sorted(set(codes)):
+            start, _ = self._partition(table, code)
+            stop = self._asof_row(table, code, end_date) + 1
+            if stop > 0:
+                parts.append(np.arange(stop - 1, max(start, stop - last_n) - 1, -1))
+        if not parts:
+            return pd.DataFrame()
+        return self._take(table, np.concatenate(parts), self._projection(columns)).set_index(['Stkcd', 'Accper'])
+
+    def market_averages(self) -> pd.DataFrame:
+        """返回(并缓存)全部报告期的市场平均roc、rooc和存货周转率"""
+        if self._market_averages is None:
+            self._market_averages = compute_market_averages(
+                self.read_table('balance')[BALANCE_COLUMNS], self.read_table('profit')[PROFIT_COLUMNS])
+        return self._market_averages
+
+    def _market_average(self, column: str, end_date: str) -> float:
+        quarter = self.resolve_quarter(end_date)
+        averages = self.market_averages()
+        if quarter is None or quarter not in averages.index:
+            return np.nan
+        return float(averages.loc[quarter, column])
+
+    def get_roc_avg(self, end_date: str) -> float:
+        """获取end_date所在报告期的市场平均roc"""
+        return self._market_average('roc_avg', end_date)
+
+    def get_rooc_avg(self, end_date: str) -> float:
+        """获取end_date所在报告期的市场平均rooc"""
+        return self._market_average('rooc_avg', end_date)
+
+    def get_avg_inventory_turnover(self, end_date: str) -> float:
+        """获取end_date所在报告期的市场平均存货周转率"""
+        return self._market_average('it_avg', end_date)
+
+    def get_pb_avg(self, end_date: str) -> float:
+        """计算市场平均pb，股价和股本取end_date当日或之前的最新值"""
+        quarter = self.resolve_quarter(end_date)
+        if quarter is None:
+            return np.nan
+        b = self._take('balance', self._rows_at('balance', quarter), ['Stkcd', 'ParOwnEquity'])
+        return compute_pb_avg(b, self.asof_index('trade', 'Clsprc'), self.asof_index('shares', 'Nshrttl'), end_date)
+
+    def get_inflation_rate(self, end_date: str) -> float:
+        """获取end_date所在年份的通货膨胀率，不存在时返回NaN"""
+        df = self.read_table('inflation_cn')
+        if df.empty:
+            return np.nan
+        hit = df[pd.to_numeric(df['year'], errors='coerce') == int(end_date[:4])]
+        if hit.empty:
+            return np.nan
+        return float(hit['rate'].iloc[0])
+
+    def get_market_cap(self, stock_code: str, end_date: str) -> float:
+        """获取股票市值：最新收盘价 * 最新总股本"""
+        return self.get_latest_close_price(stock_code, end_date) * self.get_total_shares(stock_code, end_date)
+
+    def get_total_shares(self, stock_code: str, end_date: str) -> float:
+        """获取end_date当日或之前的最新总股本"""
+        return self.asof_index('shares', 'Nshrttl').lookup(stock_code, end_date)
+
+    def get_latest_close_price(self, stock_code: str, end_date: str) -> float:
+        """获取end_date当日或之前的最新收盘价"""
+        return self.asof_index('trade', 'Clsprc').lookup(stock_code, end_date)
+
+    def get_five_year_avg_pe(self, stock_code: str, end_date: str) -> float:
+        """计算五年平均市盈率，口径与FinancialDataRepository.get_five_year_avg_pe一致"""
+        pe = 0.0
+        for year in range(5):
+            date = f"{int(end_date[:4]) - year}-{end_date[5:]}"
+            cap = self.get_market_cap(stock_code, date)
+            profit = self.get_quarterly('profit', stock_code, 4, date)
+            if np.isnan(cap) or profit.empty or profit['ParNetProfit'].isna().all():
+                return np.nan
+            total = float(profit['ParNetProfit'].sum())
+            if total == 0:
+                return np.nan
+            pe = pe + cap / total
+        return pe / 5
+
+    def get_discounted_10y_fcf(self, stock_code: str, end_date: str, discount_rate: float, growth_rate: float = 0.0) -> float:
+        """计算自由现金流折现值，口径与FinancialDataRepository.get_discounted_10y_fcf的SQL一致"""
+        start, stop = self._partition('cash_flow', stock_code)
+        if start == stop:
+            return np.nan
+        df = self._take('cash_flow', slice(start, stop), ['Accper', 'NetOpCF', 'AssetPurchase'])
+        df = df[df['Accper'].str.endswith('12-31')]
+        if df.empty:
+            return np.nan
+        years = int(end_date[:4]) - df['Accper'].str[:4].astype(int)
+        fcf = (df['NetOpCF'] - df['AssetPurchase']) * np.power(1.0 + growth_rate, years) / np.power(1.0 + discount_rate, years)
+        if fcf.isna().all():
+            return np.nan
+        return float(fcf.sum())
+
+
+def main():
+    """主函数：从config.DB_CONFIG同步快照到本地"""
+    from config import DB_CONFIG, SNAPSHOT_CONFIG
+    from miller_value import FinancialDataRepository
+
+    parser = argparse.ArgumentParser(description='将数据库表同步为本地列式快照')
+    parser.add_argument('--root', default=SNAPSHOT_CONFIG['root'], help='快照根目录')
+    parser.add_argument('--tables', nargs='*', default=None, help='需要同步的表，默认全部')
+    args = parser.parse_args()
+
+    repo = FinancialDataRepository(DB_CONFIG)
+    if not repo.connect():
+        return
+    try:
+        store = SnapshotStore(args.root, SNAPSHOT_CONFIG.get('fetch_size', 50000))
+        result = store.sync(repo.connection, args.tables)
+        logger.info(f"快照同步结果: {result}")
+    finally:
+        repo.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import numpy as np
+from asof_index import AsOfIndex
+
+
+def make_index():
+    return AsOfIndex(
+        ['000002', '000001', '000001', '000001'],
+        ['2024-01-02', '2024-01-05', '2024-01-02', '2024-01-03'],
+        ['5.0', 12.0, 10.0, None],
+    )
+
+
+def test_lookup():
+    index = make_index()
+    assert index.lookup('000001', '2024-01-02') == 10.0
+    assert np.isnan(index.lookup('000001', '2024-01-04'))
+    assert index.lookup('000001', '2024-02-01') == 12.0
+    assert np.isnan(index.lookup('000001', '2024-01-01'))
+    assert np.isnan(index.lookup('600000', '2024-01-02'))
+    assert index.lookup('000002', '2030-01-01') == 5.0
+
+
+def test_lookup_many_matches_lookup():
+    index = make_index()
+    codes = ['000001', '000002', '000001', '600000', '000002']
+    dates = ['2024-01-05', '2024-01-01', '2024-01-02', '2024-01-02', '2024-01-09']
+    result = index.lookup_many(codes, dates)
+    expected = [index.lookup(c, d) for c, d in zip(codes, dates)]
+    np.testing.assert_array_equal(result, expected)
+    np.testing.assert_array_equal(index.lookup_many(['000001', '000002'], '2024-01-02'), [10.0, 5.0])
@@ -0,0 +1,68 @@
+import pandas as pd
+from backtest import RollingPanel, BacktestEngine
+from miller_value import FinancialDataRepository, MillerStrategyRunner
+from test_batch_engine import make_buy_snapshot
+
+
+def test_rolling_panel_matches_statement_panel(tmp_path):
+    store, codes = make_buy_snapshot(tmp_path)
+    repo = FinancialDataRepository({}, snapshot=store)
+    rolling = RollingPanel(repo.get_statement_history('profit', None, ['ParNetProfit']))
+    assert not rolling.advance('2015-12-31') and rolling.panel.empty
+    for date in ('2019-03-31', '2019-04-15', '2021-12-31', '2023-12-31'):
+        changed = rolling.advance(date)
+        assert changed == (date != '2019-04-15')
+        expected = repo.get_statement_panel('profit', None, date, 12, ['ParNetProfit'])
+        pd.testing.assert_frame_equal(rolling.panel.sort_index(), expected.sort_index(), check_dtype=False)
+
+
+def test_backtest_matches_single_date_runs(tmp_path):
+    store, codes = make_buy_snapshot(tmp_path)
+    runner = MillerStrategyRunner(FinancialDataRepository({}, snapshot=store))
+    engine = BacktestEngine(runner, write=False)
+    dates = ['2022-12-31', '2023-03-31', '2023-04-10', '2023-06-30']
+    selections = engine.run(dates, 'sel')
+    buys = engine.run(dates, 'buy', codes)
+    for date in dates:
+        expected = runner.strategy.evaluate_selection_batch(engine.stock_codes, runner.repo, date)
+        pd.testing.assert_frame_equal(selections[date], expected)
+        expected = runner.strategy.evaluate_buy_batch(codes, runner.repo, date)
+        pd.testing.assert_frame_equal(buys[date], expected)
+    # 报表窗口和报告期都未变化时复用上一次的选股结果
+    assert selections['2023-04-10'] is selections['2023-03-31']
+
+
+def test_buy_fundamentals_cached_within_quarter(tmp_path):
+    store, codes = make_buy_snapshot(tmp_path)
+    runner = MillerStrategyRunner(FinancialDataRepository({}, snapshot=store))
+    engine = BacktestEngine(runner, write=False)
+    engine.load('2023-12-31')
+    engine.buy('2023-10-09', codes[:10])
+    first = engine._fundamentals
+    engine.buy('2023-10-10', codes[:5])
+    assert engine._fundamentals is first
+    engine.buy('2023-10-11', codes[5:15])
+    assert len(engine._fundamentals) == 15
+    engine.buy('2023-12-31', codes[:5])
+    assert len(engine._fundamentals) == 5
+
+    # 逐只评估同一季度内只查询一次报表
+    strategy = runner.strategy
+    calls = []
+    repo = runner.repo
+    original = repo.get_profit_quarterly
+    repo.get_profit_quarterly = lambda *args: calls.append(args) or original(*args)
+    for date in ('2023-10-09', '2023-10-10', '2023-11-15'):
+        strategy.evaluate_buy(codes[0], repo, date)
+    assert len(calls) == 1
+
+
+def test_trigger_mode_matches_buy_mode(tmp_path):
+    store, codes = make_buy_snapshot(tmp_path)
+    engine = BacktestEngine(MillerStrategyRunner(FinancialDataRepository({}, snapshot=store)), write=False)
+    # 同一季度内的连续交易日：市场平均pb、股本和往年股价逐日变化，价格区间需随之重新求解
+    dates = ['2023-03-28'] + [d.strftime('%Y-%m-%d') for d in pd.bdate_range('2023-04-01', '2023-06-30')]
+    buys = engine.run(dates, 'buy', codes)
+    triggers = engine.run(dates, 'trigger', codes)
+    for date in dates:
+        assert triggers[date]['count'].tolist() == buys[date]['count'].tolist()
@@ -0,0 +1,186 @@
+import numpy as np
+import pandas as pd
+from asof_index import AsOfIndex
+from snapshot_store import SnapshotStore
+from batch_engine import (shift_years, build_ttm_index, five_year_avg_pe, five_year_avg_pe_grid, SELECTION_CRITERIA,
+                          BUY_CRITERIA, buy_fundamentals_batch, evaluate_buy_prices, buy_price_triggers, classify_prices)
+from miller_value import FinancialDataRepository, MillerValueStrategy, MillerStrategyRunner
+
+
+def make_history():
+    rows = []
+    for code, base in (('000001', 10.0), ('000002', -3.0)):
+        for year in range(2017, 2024):
+            for q, md in enumerate(('03-31', '06-30', '09-30', '12-31')):
+                rows.append((code, f"{year}-{md}", base + year - 2017 + q))
+    profit = pd.DataFrame(rows, columns=['Stkcd', 'Accper', 'ParNetProfit'])
+    trade = pd.DataFrame({
+        'Stkcd': ['000001'] * 7 + ['000002'] * 7,
+        'Trddt': [f"{y}-06-28" for y in range(2017, 2024)] * 2,
+        'Clsprc': [float(i + 1) for i in range(14)],
+    })
+    shares = pd.DataFrame({'Stkcd': ['000001', '000002'], 'Reptdt': ['2015-01-01'] * 2, 'Nshrttl': [1000.0, 500.0]})
+    return profit, trade, shares
+
+
+def test_shift_years():
+    assert shift_years('2024-03-31', 1) == '2023-03-31'
+    assert shift_years('2024-02-29', 1) == '2023-02-28'
+    assert shift_years('2024-02-29', 4) == '2020-02-29'
+
+
+def test_five_year_avg_pe_matches_per_stock(tmp_path):
+    profit, trade, shares = make_history()
+    store = SnapshotStore(str(tmp_path))
+    for table, date_column, df in (('profit', 'Accper', profit), ('trade', 'Trddt', trade), ('shares', 'Reptdt', shares)):
+        store._write_table(table, store._normalize(df, date_column), date_column)
+
+    price = AsOfIndex.from_frame(trade, 'Trddt', 'Clsprc')
+    share = AsOfIndex.from_frame(shares, 'Reptdt', 'Nshrttl')
+    ttm = build_ttm_index(profit)
+    codes = ['000001', '000002', '600000']
+    dates = ['2023-06-30', '2022-12-31', '2020-01-01']
+
+    grid = five_year_avg_pe_grid(codes, dates, price, share, ttm)
+    for date in dates:
+        expected = [store.get_five_year_avg_pe(code, date) for code in codes]
+        np.testing.assert_allclose(grid.loc[date].to_numpy(), expected, equal_nan=True)
+        np.testing.assert_allclose(five_year_avg_pe(codes, date, price, share, ttm), expected, equal_nan=True)
+    assert np.isnan(grid.loc['2020-01-01', '000001'])
+
+
+class ConstantAveragesRepo:
+    slice_panel = staticmethod(FinancialDataRepository.slice_panel)
+
+    def get_roc_avg(self, end_date):
+        return 0.02
+
+    def get_deposit_rate(self, end_date=None):
+        return 0.015
+
+    def get_rooc_avg(self, end_date):
+        return 0.05
+
+    def get_avg_inventory_turnover(self, end_date):
+        return 0.4
+
+
+def make_panels(seed=1):
+    rng = np.random.default_rng(seed)
+    quarters = [f"{y}-{md}" for y in range(2021, 2024) for md in ('12-31', '09-30', '06-30', '03-31')]
+    quarters = sorted(quarters, reverse=True)
+    profit_rows, balance_rows = [], []
+    strategy = MillerValueStrategy()
+    for i in range(60):
+        code = f"{i:06d}"
+        n, m = rng.integers(0, 13), rng.integers(0, 13)
+        for q in quarters[:n]:
+            profit_rows.append({'Stkcd': code, 'Accper': q, 'OpProfit': rng.uniform(-20, 100),
+                                'IncomeTax': rng.uniform(0, 30), 'ProfitBefTax': rng.choice([0.0, rng.uniform(-10, 120)]),
+                                'OpCost': rng.uniform(50, 300)})
+        for q in quarters[:m]:
+            row = {'Stkcd': code, 'Accper': q}
+            row.update({c: rng.uniform(0, 200) for c in strategy.required_columns('balance', 'evaluate_selection')})
+            row['InventNet'] = rng.choice([np.nan, rng.uniform(0, 500)])
+            balance_rows.append(row)
+    profit = pd.DataFrame(profit_rows).set_index(['Stkcd', 'Accper'])
+    balance = pd.DataFrame(balance_rows).set_index(['Stkcd', 'Accper'])
+    codes = [f"{i:06d}" for i in range(62)]
+    return profit, balance, codes
+
+
+def test_evaluate_selection_batch_matches_per_stock():
+    strategy = MillerValueStrategy()
+    repo = ConstantAveragesRepo()
+    for seed in range(3):
+        profit, balance, codes = make_panels(seed)
+        batch = strategy.evaluate_selection_batch(codes, repo, '2023-12-31', profit, balance)
+        assert list(batch.columns) == SELECTION_CRITERIA + ['selected']
+        for code in codes:
+            expected = strategy.selection_criteria(code, repo, '2023-12-31', profit, balance)
+            assert batch.loc[code, SELECTION_CRITERIA].tolist() == list(expected.values()), code
+            assert batch.loc[code, 'selected'] == strategy.evaluate_selection(code, repo, '2023-12-31', profit, balance)
+
+
+def make_buy_snapshot(tmp_path):
+    rng = np.random.default_rng(7)
+    quarters = [f"{y}-{md}" for y in range(2016, 2024) for md in ('03-31', '06-30', '09-30', '12-31')]
+    codes = [f"{i:06d}" for i in range(30)]
+    tables = {'profit': [], 'balance': [], 'cash_flow': [], 'trade': []}
+    for code in codes:
+        n = rng.integers(0, len(quarters) + 1)
+        for q in quarters[len(quarters) - n:]:
+            tables['profit'].append({'Stkcd': code, 'Accper': q, 'ParNetProfit': rng.choice([np.nan, rng.uniform(-20, 80)])})
+            tables['balance'].append({'Stkcd': code, 'Accper': q, 'ParOwnEquity': rng.uniform(-100, 2000)})
+            tables['cash_flow'].append({'Stkcd': code, 'Accper': q, 'NetOpCF': rng.uniform(-50, 200),
+                                        'AssetPurchase': rng.choice([np.nan, rng.uniform(0, 100)])})
+            tables['trade'].append({'Stkcd': code, 'Trddt': q[:8] + '28', 'Clsprc': rng.uniform(1, 30)})
+    frames = {name: pd.DataFrame(rows) for name, rows in tables.items()}
+    # 选股评估需要的其余报表列
+    strategy = MillerValueStrategy()
+    for table in ('profit', 'balance'):
+        for column in strategy.required_columns(table, 'evaluate_selection'):
+            if column not in frames[table]:
+                frames[table][column] = rng.uniform(1, 300, len(frames[table]))
+    frames['shares'] = pd.DataFrame({'Stkcd': codes, 'Reptdt': ['2015-01-01'] * len(codes),
+                                     'Nshrttl': rng.choice([0.0, 100.0, 1000.0], len(codes))})
+    frames['inflation_cn'] = pd.DataFrame({'year': [2023], 'rate': [0.02]})
+    store = SnapshotStore(str(tmp_path))
+    for name, df in frames.items():
+        date_column = {'profit': 'Accper', 'balance': 'Accper', 'cash_flow': 'Accper',
+                       'trade': 'Trddt', 'shares': 'Reptdt'}.get(name)
+        store._write_table(name, store._normalize(df, date_column), date_column)
+    return store, codes
+
+
+def test_evaluate_buy_batch_matches_per_stock(tmp_path):
+    store, codes = make_buy_snapshot(tmp_path)
+    repo = FinancialDataRepository({}, snapshot=store)
+    strategy = MillerValueStrategy()
+    end_date = '2023-11-15'
+    batch = strategy.evaluate_buy_batch(codes + ['999999'], repo, end_date)
+    assert list(batch.columns[-6:]) == BUY_CRITERIA + ['count']
+    for code in codes + ['999999']:
+        count, price = strategy.evaluate_buy(code, repo, end_date)
+        assert batch.loc[code, 'count'] == count, code
+        np.testing.assert_allclose(batch.loc[code, 'price'], price, equal_nan=True)
+    assert batch['count'].nunique() > 1
+
+
+def test_runner_parallel_matches_serial(tmp_path):
+    store, codes = make_buy_snapshot(tmp_path)
+    codes = codes + ['999999']
+    serial = MillerStrategyRunner(FinancialDataRepository({}, snapshot=store))
+    parallel = MillerStrategyRunner(FinancialDataRepository({}, snapshot=store), workers=3)
+    for method in ('evaluate_selection_batch', 'evaluate_buy_batch'):
+        expected = serial.evaluate_batch(method, codes, '2023-11-15')
+        result = parallel.evaluate_batch(method, codes, '2023-11-15')
+        assert list(result.index) == codes
+        pd.testing.assert_frame_equal(result, expected)
+        assert parallel.failed_codes == []
+
+
+def test_buy_price_triggers_match_evaluation(tmp_path):
+    store, codes = make_buy_snapshot(tmp_path)
+    repo = FinancialDataRepository({}, snapshot=store)
+    repo.load_asof_indexes()
+    end_date = '2023-11-15'
+    panels = {t: repo.get_statement_panel(t, codes, end_date, 12, MillerValueStrategy.required_columns(t, 'evaluate_buy'))
+              for t in ('profit', 'balance', 'cash_flow')}
+    fundamentals = buy_fundamentals_batch(codes, end_date, panels['profit'], panels['balance'], panels['cash_flow'],
+                                          repo.get_annual_cash_flows(codes), 0.09)
+    triggers = buy_price_triggers(fundamentals, end_date, repo.price_index, repo.shares_index, repo.profit_ttm_index,
+                                  1.5, 0.015, 0.02)
+    trade = store.read_table('trade')
+    rng = np.random.default_rng(3)
+    for _ in range(20):
+        prices = rng.choice([np.nan, 0.5, 5.0, 50.0, 500.0], len(codes)) * rng.uniform(0.5, 2.0, len(codes))
+        day = pd.DataFrame({'Stkcd': codes, 'Trddt': end_date, 'Clsprc': prices})
+        price_index = AsOfIndex.from_frame(pd.concat([trade, day], ignore_index=True), 'Trddt', 'Clsprc')
+        expected = evaluate_buy_prices(fundamentals, end_date, price_index, repo.shares_index, repo.profit_ttm_index,
+                                       1.5, 0.015, 0.02)
+        count = classify_prices(triggers, prices)
+        assert count.tolist() == expected['count'].tolist()
+        monotone = triggers['monotone'].to_numpy() & ~np.isnan(prices)
+        assert ((prices < triggers['buy_below'].to_numpy()) == (count >= 3))[monotone].all()
+        assert ((prices >= triggers['sell_from'].to_numpy()) == (count <= 1))[monotone].all()
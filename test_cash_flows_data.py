@@ -0,0 +1,192 @@
+import importlib
+
+import pandas as pd
+
+from backends import create_backend
+from exchange_resolver import ExchangeResolver
+from response_cache import ResponseCache
+from schema import SchemaManager
+from test_response_cache import PARAMS, make_report
+
+
+def load_processor(tmp_path, monkeypatch, db_config=None):
+    # cash_flows_data在导入时创建日志文件，内容哈希文件也写在当前目录，切换到临时目录后再导入
+    monkeypatch.chdir(tmp_path)
+    module = importlib.import_module('cash_flows_data')
+    cache = ResponseCache(str(tmp_path / 'cache'), offline=True)
+    processor = module.StockCashFlowProcessor(db_config or {}, resolver=ExchangeResolver(''), cache=cache)
+    return processor, cache
+
+
+def connect_sqlite(tmp_path, monkeypatch):
+    config = {'backend': 'sqlite', 'path': str(tmp_path / 'stock.db')}
+    manager = SchemaManager(config)
+    assert manager.connect() and manager.create_tables(['cash_flow'])
+    manager.close()
+    processor, _ = load_processor(tmp_path, monkeypatch, config)
+    processor.connection = create_backend(config).connect()
+    return processor
+
+
+def count_rows(processor):
+    with processor.connection.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) AS n FROM cash_flow")
+        return cursor.fetchone()['n']
+
+
+REPORT = pd.DataFrame({'报告日': ['20230930', '20230331'], '经营活动产生的现金流量净额': [1.5, None],
+                       '购建固定资产、无形资产和其他长期资产支付的现金': ['2', '3'], 'stock_code': '600000'})
+
+
+def test_offline_fetch_from_cache(tmp_path, monkeypatch):
+    processor, cache = load_processor(tmp_path, monkeypatch)
+    cache.put('stock_financial_report_sina', 'sh600000', PARAMS, make_report())
+    # 推断的前缀没有数据时回退到其他前缀，并记住成功的前缀
+    cache.put('stock_financial_report_sina', 'sh600519', PARAMS, make_report().iloc[:0])
+    cache.put('stock_financial_report_sina', 'sz600519', PARAMS, make_report(2))
+
+    df = processor.get_cash_flow_data('600000')
+    assert len(df) == 4 and (df['stock_code'] == '600000').all()
+    assert len(processor.filter_data(df)) == 4
+    assert len(processor.get_cash_flow_data('600519')) == 2
+    assert processor.resolver.candidates('600519')[0] == 'sz600519'
+    assert processor.get_cash_flow_data('300750') is None
+
+
+def test_rows_batched_across_stocks(tmp_path, monkeypatch):
+    module = importlib.import_module('cash_flows_data')
+    report = REPORT
+    # 缺失值写为NULL，不写成'nan'
+    assert module.build_cash_flow_rows(report) == [('600000', '20230930', '1.5', '2'), ('600000', '20230331', None, '3')]
+    assert module.build_cash_flow_rows(report.drop(columns=report.columns[2]))[0][3] == '0'
+    assert module.build_cash_flow_rows(report.drop(columns='报告日')) == []
+
+    processor = connect_sqlite(tmp_path, monkeypatch)
+    processor.batch_size = 5
+    for code in ('600000', '600001', '600002'):
+        assert processor.insert_cash_flow_data(report.assign(stock_code=code))
+    # 第三只股票加入后达到batch_size，6行一次写入
+    assert processor.pending_rows() == 0 and processor.inserted_rows == 6
+    assert processor.insert_cash_flow_data(report.assign(stock_code='600003')) and processor.pending_rows() == 2
+    assert processor.flush_cash_flow_data() and processor.inserted_rows == 8
+    assert count_rows(processor) == 8
+    processor.close_connection()
+
+
+def test_incremental_ingest(tmp_path, monkeypatch):
+    module = importlib.import_module('cash_flows_data')
+    assert module.next_report_period('2023-03-31') == '20230930'
+    assert module.next_report_period('20230930') == '20240331'
+    assert module.next_report_period('20231231') == '20240331'
+    assert module.may_have_new_report(None, '20240101')
+    assert not module.may_have_new_report('2023-09-30', '2024-03-31')
+    assert module.may_have_new_report('2023-09-30', '2024-04-01')
+
+    processor = connect_sqlite(tmp_path, monkeypatch)
+    assert processor.insert_cash_flow_data(REPORT) and processor.flush_cash_flow_data()
+    assert processor.get_watermarks() == {'600000': '20230930'}
+    # 内容未变化的行不再写入；修订过的行按主键覆盖，不产生重复行
+    assert processor.insert_cash_flow_data(REPORT) and processor.pending_rows() == 0
+    assert processor.unchanged_rows == 2
+    revised = REPORT.assign(**{'经营活动产生的现金流量净额': [1.5, 9.0]})
+    assert processor.insert_cash_flow_data(revised) and processor.pending_rows() == 1
+    assert processor.flush_cash_flow_data() and count_rows(processor) == 2
+
+    # 增量模式只写入最大Accper之后的报告期；内容哈希在重新打开同一数据库后仍然有效
+    config = processor.db_config
+    processor.close_connection()
+    processor, _ = load_processor(tmp_path, monkeypatch, config)
+    newer = pd.concat([revised, REPORT.iloc[:1].assign(**{'报告日': '20240331'})], ignore_index=True)
+    assert processor.insert_cash_flow_data(newer, watermark='20230930')
+    assert processor._rows == [('600000', '20240331', '1.5', '2')]
+    assert processor.insert_cash_flow_data(revised) is True and processor.pending_rows() == 1
+
+    # 换到另一个数据库时不使用原库的内容哈希
+    other, _ = load_processor(tmp_path, monkeypatch, {'backend': 'sqlite', 'path': str(tmp_path / 'other.db')})
+    assert other.digests == {}
+
+    # 目标表被清空后内容哈希作废，全部行重新写入
+    processor = connect_sqlite(tmp_path, monkeypatch)
+    assert processor.digests and processor.reconcile_digests() == 0
+    with processor.connection.cursor() as cursor:
+        cursor.execute("DELETE FROM cash_flow WHERE Accper = '20230331'")
+    processor.connection.commit()
+    assert processor.reconcile_digests() == 1
+    assert processor.insert_cash_flow_data(revised) and processor._rows == [('600000', '20230331', '9.0', '3')]
+    with processor.connection.cursor() as cursor:
+        cursor.execute("DELETE FROM cash_flow")
+    processor.connection.commit()
+    assert processor.reconcile_digests() == 1 and processor.digests == {}
+    processor.close_connection()
+
+
+def test_failed_fetches_not_marked_done(tmp_path, monkeypatch):
+    from checkpoint import CheckpointLedger
+    processor = connect_sqlite(tmp_path, monkeypatch)
+    cache = processor.cache
+    cache.put('stock_financial_report_sina', 'sh600000', PARAMS, make_report())
+    for prefix in ('sh', 'sz', 'bj', ''):
+        cache.put('stock_financial_report_sina', f'{prefix}600001', PARAMS, make_report().iloc[:0])
+    # 600002不在缓存中（离线未命中），600003请求超时
+    fetch = processor._fetch_report
+
+    def fetch_report(symbol):
+        if symbol.endswith('600003'):
+            raise TimeoutError('请求超时')
+        return fetch(symbol)
+    processor._fetch_report = fetch_report
+    processor.get_stock_codes = lambda: ['600000', '600001', '600002', '600003']
+
+    assert processor.get_cash_flow_data('600001').empty
+    assert processor.get_cash_flow_data('600003') is None
+    ledger = CheckpointLedger('cash_flow', root=str(tmp_path / 'checkpoints'))
+    assert not processor.process_all_stocks(delay=0.001, ledger=ledger, workers=2)
+    assert ledger.done() == {'600000', '600001'} and count_rows(processor) == 4
+    resumed = CheckpointLedger('cash_flow', resume=True, root=str(tmp_path / 'checkpoints'))
+    assert resumed.run_id == ledger.run_id
+    assert resumed.pending(processor.get_stock_codes()) == ['600002', '600003']
+    processor.close_connection()
+
+
+def test_bad_stock_does_not_block_batch(tmp_path, monkeypatch):
+    processor = connect_sqlite(tmp_path, monkeypatch)
+    with processor.connection.cursor() as cursor:
+        cursor.execute("CREATE TRIGGER reject_bad BEFORE INSERT ON cash_flow WHEN NEW.NetOpCF = 'bad' "
+                       "BEGIN SELECT RAISE(ABORT, 'bad value'); END")
+    processor.connection.commit()
+    processor.batch_size = 100
+    bad = REPORT.assign(stock_code='600001', **{'经营活动产生的现金流量净额': ['bad', 1.0]})
+    for report in (REPORT, bad, REPORT.assign(stock_code='600002')):
+        assert processor.insert_cash_flow_data(report)
+    # 整批失败后逐只写入，只有600001被丢弃，其内容哈希不记录，下次仍会重写
+    assert not processor.flush_cash_flow_data() and processor.failed_stocks == {'600001'}
+    assert count_rows(processor) == 4 and processor.inserted_rows == 4
+    assert '600001' not in processor.digests
+    with processor.connection.cursor() as cursor:
+        cursor.execute("SELECT COUNT(*) AS n FROM cash_flow WHERE NetOpCF IS NULL")
+        assert cursor.fetchone()['n'] == 2
+    processor.close_connection()
+
+
+def test_prefix_fallback_only_when_symbol_not_found(tmp_path, monkeypatch):
+    processor, cache = load_processor(tmp_path, monkeypatch)
+    cache.put('stock_financial_report_sina', 'sz600519', PARAMS, make_report(2))
+    requested = []
+
+    def fetch_report(symbol, error):
+        requested.append(symbol)
+        if symbol == 'sz600519':
+            return cache.get('stock_financial_report_sina', symbol, PARAMS)
+        raise error
+
+    # 代码不存在（解析响应出错）时回退到下一个前缀
+    processor._fetch_report = lambda symbol: fetch_report(symbol, KeyError('result'))
+    assert len(processor.get_cash_flow_data('600519')) == 2
+    assert requested == ['sh600519', 'sz600519']
+
+    # 连接中断、超时等网络错误只请求一次
+    for error in (ConnectionResetError('Connection reset by peer'), TimeoutError('请求超时')):
+        requested.clear()
+        processor._fetch_report = lambda symbol: fetch_report(symbol, error)
+        assert processor.get_cash_flow_data('600036') is None
+        assert len(requested) == 1
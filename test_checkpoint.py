@@ -0,0 +1,70 @@
+from checkpoint import CheckpointLedger
+from backtest import BacktestEngine
+from miller_value import FinancialDataRepository, MillerStrategyRunner
+from test_batch_engine import make_buy_snapshot
+
+
+def test_ledger_resume(tmp_path):
+    root = str(tmp_path / 'checkpoints')
+    ledger = CheckpointLedger('sel', root=root)
+    ledger.mark(['000001', '000002'], '2023-12-31')
+    ledger.mark(['600000'])
+    # 模拟写入中途退出留下的不完整行
+    with open(ledger.path, 'a', encoding='utf-8') as f:
+        f.write('{"end_date": "2023-12-31", "co')
+
+    resumed = CheckpointLedger('sel', resume=True, root=root)
+    assert resumed.run_id == ledger.run_id
+    assert resumed.pending(['000001', '000003', '000002'], '2023-12-31') == ['000003']
+    assert resumed.done() == {'600000'}
+    resumed.complete()
+    assert CheckpointLedger.last_incomplete('sel', root) is None
+    assert CheckpointLedger('sel', resume=True, root=root).run_id != ledger.run_id
+
+
+class RecordingWriter:
+    def __init__(self):
+        self.rows = []
+
+    def add_sel_stock(self, stock_code, end_date):
+        self.rows.append((stock_code, end_date))
+
+    def commit(self):
+        return True
+
+
+def test_runner_skips_completed_units(tmp_path, monkeypatch):
+    store, codes = make_buy_snapshot(tmp_path)
+    monkeypatch.setitem(__import__('config').CHECKPOINT_CONFIG, 'chunk_size', 7)
+    ledger = CheckpointLedger('sel', root=str(tmp_path / 'checkpoints'))
+    runner = MillerStrategyRunner(FinancialDataRepository({}, snapshot=store), ledger=ledger)
+    runner.writer = RecordingWriter()
+    ledger.mark(runner.get_stock_codes()[:10], '2023-06-30')
+    result = runner.sel_for_stocks('2023-06-30')
+    assert list(result.index) == runner.get_stock_codes()[10:]
+    assert ledger.pending(runner.get_stock_codes(), '2023-06-30') == []
+    assert runner.sel_for_stocks('2023-06-30').empty
+
+    # 回测引擎按日期记录进度，接续时跳过已完成的日期
+    engine = BacktestEngine(runner)
+    results = engine.run(['2023-06-30', '2023-09-30'], 'sel')
+    assert list(results) == ['2023-09-30']
+    assert ledger.pending(runner.get_stock_codes(), '2023-09-30') == []
+    assert runner.unfinished == 0
+
+
+def test_failed_commit_leaves_units_pending(tmp_path, monkeypatch):
+    store, codes = make_buy_snapshot(tmp_path)
+    monkeypatch.setitem(__import__('config').CHECKPOINT_CONFIG, 'chunk_size', 7)
+    ledger = CheckpointLedger('sel', root=str(tmp_path / 'checkpoints'))
+    runner = MillerStrategyRunner(FinancialDataRepository({}, snapshot=store), ledger=ledger)
+    runner.writer = RecordingWriter()
+    runner.writer.commit = lambda: False
+    stock_codes = runner.get_stock_codes()
+    runner.sel_for_stocks('2023-06-30')
+    assert runner.unfinished == len(stock_codes)
+    assert ledger.pending(stock_codes, '2023-06-30') == stock_codes
+
+    BacktestEngine(runner).run(['2023-09-30'], 'sel')
+    assert runner.unfinished == 2 * len(stock_codes)
+    assert ledger.pending(stock_codes, '2023-09-30') == stock_codes
@@ -0,0 +1,53 @@
+import numpy as np
+from pymysql.constants import FIELD_TYPE
+from columnar_fetch import fetch_columns, fetch_frame
+
+
+class FakeCursor:
+    def __init__(self, description, rows):
+        self.description = description
+        self.rows = list(rows)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchmany(self, size):
+        batch, self.rows = self.rows[:size], self.rows[size:]
+        return tuple(batch)
+
+
+class FakeConnection:
+    def __init__(self, description, rows):
+        self.description = description
+        self.rows = rows
+
+    def cursor(self, cursorclass=None):
+        return FakeCursor(self.description, self.rows)
+
+
+def make_connection():
+    description = [('Stkcd', FIELD_TYPE.VAR_STRING), ('Accper', FIELD_TYPE.DATE), ('ParNetProfit', FIELD_TYPE.NEWDECIMAL)]
+    rows = [('000001', '2023-12-31', 30.0), ('000001', '2023-09-30', None), ('000002', None, 5.0)]
+    return FakeConnection(description, rows)
+
+
+def test_fetch_columns():
+    columns = fetch_columns(make_connection(), "SELECT 1", fetch_size=2)
+    assert columns['ParNetProfit'].dtype == np.float64
+    assert np.isnan(columns['ParNetProfit'][1])
+    assert columns['Accper'].dtype == 'datetime64[D]'
+    assert np.isnat(columns['Accper'][2])
+    assert list(columns['Stkcd']) == ['000001', '000001', '000002']
+
+
+def test_fetch_frame():
+    df = fetch_frame(make_connection(), "SELECT 1")
+    assert list(df['Accper']) == ['2023-12-31', '2023-09-30', None]
+    assert df['ParNetProfit'].dtype == np.float64
+    assert fetch_frame(FakeConnection(make_connection().description, []), "SELECT 1").empty
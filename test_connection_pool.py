@@ -0,0 +1,64 @@
+import pytest
+from connection_pool import ConnectionPool
+
+
+class FakeConnection:
+    def __init__(self):
+        self.closed = False
+        self.pings = 0
+
+    def ping(self, reconnect=True):
+        self.pings += 1
+
+    def close(self):
+        self.closed = True
+
+
+def make_pool(max_size=2):
+    pool = ConnectionPool({}, max_size=max_size, checkout_timeout=0.05,
+                          health_check_after=0.0, keepalive_interval=0)
+    pool._create = FakeConnection
+    return pool
+
+
+def test_bounded_checkout_and_reuse():
+    pool = make_pool(2)
+    a = pool.acquire()
+    b = pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+    pool.release(a)
+    c = pool.acquire()
+    assert c is a
+    assert c.pings == 1
+    pool.release(b, broken=True)
+    assert b.closed
+    pool.release(c)
+    pool.close()
+    assert c.closed
+
+
+def test_repository_reclaims_connections_of_finished_threads(tmp_path):
+    import threading
+    from miller_value import FinancialDataRepository
+    repo = FinancialDataRepository({'backend': 'sqlite', 'path': str(tmp_path / 'stock.db')}, pool_size=2)
+    assert repo.connect()
+    repo.pool.checkout_timeout = 0.05
+    errors = []
+
+    def work():
+        # 线程只使用连接，结束前没有调用release
+        try:
+            repo.connection.cursor().execute("SELECT 1")
+        except TimeoutError as e:
+            errors.append(e)
+
+    for _ in range(3):
+        thread = threading.Thread(target=work)
+        thread.start()
+        thread.join()
+    assert errors == []
+    with repo.session():
+        repo.connection
+    assert getattr(repo._local, 'held', None) is None
+    repo.close()
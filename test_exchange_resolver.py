@@ -0,0 +1,29 @@
+from exchange_resolver import ExchangeResolver, exchange_prefix
+
+
+def test_exchange_prefix():
+    assert exchange_prefix('600000') == 'sh'
+    assert exchange_prefix('688981') == 'sh'
+    assert exchange_prefix('000001') == 'sz'
+    assert exchange_prefix('300750') == 'sz'
+    assert exchange_prefix('830799') == 'bj'
+    assert exchange_prefix('123456') is None
+
+
+def test_resolver_learns_and_persists(tmp_path):
+    path = str(tmp_path / 'prefix.json')
+    resolver = ExchangeResolver(path, save_every=2)
+    assert resolver.candidates('600000') == ['sh600000', 'sz600000', 'bj600000', '600000']
+    assert resolver.candidates('123456') == ['sh123456', 'sz123456', 'bj123456', '123456']
+    # 推断错误时记录实际成功的前缀
+    resolver.learn('600000', 'sz600000')
+    resolver.learn('123456', '123456')
+    reloaded = ExchangeResolver(path)
+    assert len(reloaded) == 2
+    assert reloaded.candidates('600000')[0] == 'sz600000'
+    assert reloaded.candidates('123456')[0] == '123456'
+
+    resolver.learn('000001', 'sz000001')
+    assert len(ExchangeResolver(path)) == 2
+    resolver.save()
+    assert len(ExchangeResolver(path)) == 3
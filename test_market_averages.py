@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+from asof_index import AsOfIndex
+from market_averages import compute_market_averages, BALANCE_COLUMNS
+
+
+def make_frames():
+    balance = pd.DataFrame(0.0, index=range(3), columns=BALANCE_COLUMNS)
+    balance['Stkcd'] = ['000001', '000001', '000002']
+    balance['Accper'] = ['2023-09-30', '2023-12-31', '2023-12-31']
+    balance['ParOwnEquity'] = [100.0, 100.0, 200.0]
+    balance['InventNet'] = [10.0, 30.0, 5.0]
+    balance['AcctRecNet'] = [1.0, 1.0, 1.0]
+    balance['PrepayNet'] = [1.0, 1.0, 1.0]
+    profit = pd.DataFrame({
+        'Stkcd': ['000001', '000002'],
+        'Accper': ['2023-12-31', '2023-12-31'],
+        'OpProfit': ['10', '20'],
+        'IncomeTax': ['0', '0'],
+        'ProfitBefTax': ['10', '20'],
+        'OpCost': ['40', '7'],
+    })
+    return balance, profit
+
+
+def test_compute_market_averages():
+    balance, profit = make_frames()
+    price = AsOfIndex(['000001', '000002'], ['2023-12-29', '2023-12-29'], [2.0, 4.0])
+    shares = AsOfIndex(['000001', '000002'], ['2023-01-01', '2023-01-01'], [100.0, 100.0])
+    averages = compute_market_averages(balance, profit, price, shares)
+    assert list(averages.index) == ['2023-09-30', '2023-12-31']
+    row = averages.loc['2023-12-31']
+    assert np.isclose(row['roc_avg'], 0.1)
+    assert np.isclose(row['rooc_avg'], (10 / 32 + 20 / 7) / 2)
+    # 000002没有上一季存货，不参与平均
+    assert np.isclose(row['it_avg'], 2.0)
+    assert np.isclose(row['pb_avg'], 2.0)
+    assert np.isnan(averages.loc['2023-09-30', 'roc_avg'])
+
+
+def test_refresh_recomputes_changed_quarters(tmp_path):
+    from market_averages import refresh_market_averages, load_market_averages, source_state, stale_quarters
+    from miller_value import FinancialDataRepository
+    from snapshot_store import SnapshotStore
+    from test_snapshot_store import write
+    balance, profit = make_frames()
+    profit['ParNetProfit'] = profit['OpProfit']
+    store = SnapshotStore(str(tmp_path))
+    write(store, 'balance', 'Accper', balance)
+    write(store, 'profit', 'Accper', profit)
+    write(store, 'trade', 'Trddt', pd.DataFrame({'Stkcd': ['000001', '000002', '000003'], 'Trddt': '2023-12-29',
+                                                  'Clsprc': [2.0, 4.0, 1.0]}))
+    write(store, 'shares', 'Reptdt', pd.DataFrame({'Stkcd': ['000001', '000002', '000003'], 'Reptdt': '2023-01-01',
+                                                    'Nshrttl': [100.0, 100.0, 100.0]}))
+    repo = FinancialDataRepository({}, snapshot=store)
+    first = refresh_market_averages(repo)
+    assert stale_quarters(load_market_averages(repo), source_state(repo)) == []
+    assert np.isclose(first.loc['2023-12-31', 'roc_avg'], 0.1)
+
+    # 预计算之后又有股票披露了2023-12-31的报表，并出现了新的报告期
+    late = balance.iloc[[2, 2]].assign(Stkcd='000003', Accper=['2023-12-31', '2024-03-31'], ParOwnEquity=100.0)
+    write(store, 'balance', 'Accper', pd.concat([balance, late], ignore_index=True))
+    write(store, 'profit', 'Accper', pd.concat([profit, profit.iloc[[1]].assign(Stkcd='000003', OpProfit='40',
+                                                                                ProfitBefTax='40')], ignore_index=True))
+    assert stale_quarters(load_market_averages(repo), source_state(repo)) == ['2023-12-31', '2024-03-31']
+    refreshed = refresh_market_averages(repo)
+    assert np.isclose(refreshed.loc['2023-12-31', 'roc_avg'], 0.2)
+    assert '2024-03-31' in refreshed.index
+    assert stale_quarters(load_market_averages(repo), source_state(repo)) == []
+
+    # 行数不变的报表更正和股价修订同样触发重新计算；股价修订影响所在月及之后的报告期
+    restated = pd.concat([balance, late], ignore_index=True)
+    restated.loc[0, 'InventNet'] = 20.0
+    write(store, 'balance', 'Accper', restated)
+    assert stale_quarters(load_market_averages(repo), source_state(repo)) == ['2023-09-30']
+    refresh_market_averages(repo)
+    write(store, 'trade', 'Trddt', pd.DataFrame({'Stkcd': ['000001', '000002', '000003'], 'Trddt': '2023-12-29',
+                                                  'Clsprc': [3.0, 4.0, 1.0]}))
+    assert stale_quarters(load_market_averages(repo), source_state(repo)) == ['2023-12-31', '2024-03-31']
+    assert np.isclose(refresh_market_averages(repo).loc['2023-12-31', 'pb_avg'], (3.0 + 2.0 + 1.0) / 3)
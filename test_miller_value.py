@@ -59,7 +59,30 @@ def test_compute():
     assert not np.isnan(pe_ttm)
     assert not np.isnan(pfcf_ttm)
 
+def test_slice_panel():
+    panel = pd.DataFrame({
+        'Stkcd': ['000001', '000001', '000002'],
+        'Accper': ['2023-12-31', '2023-09-30', '2023-12-31'],
+        'OpProfit': ['10', '8', '5'],
+    }).set_index(['Stkcd', 'Accper'])
+    df = FinancialDataRepository.slice_panel(panel, '000001')
+    assert list(df['Accper']) == ['2023-12-31', '2023-09-30']
+    assert list(df['Stkcd']) == ['000001', '000001']
+    assert list(df.index) == [0, 1]
+    assert FinancialDataRepository.slice_panel(panel, '600000').empty
+    assert FinancialDataRepository.slice_panel(pd.DataFrame(), '000001').empty
+
+def test_required_columns_projection():
+    cols = MillerValueStrategy.required_columns('balance')
+    assert 'ParOwnEquity' in cols and len(cols) == len(set(cols))
+    assert MillerValueStrategy.required_columns('cash_flow', 'evaluate_selection') == []
+    sql = FinancialDataRepository.select_list(['ParNetProfit', 'Accper'], 't')
+    assert sql == "t.`Stkcd`, t.`Accper`, t.`ParNetProfit`"
+    assert FinancialDataRepository.select_list(None) == "*"
+
 if __name__ == '__main__':
+    test_slice_panel()
+    test_required_columns_projection()
     test_compute()
     print('OK')
 
@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from rate_limiter import TokenBucket, ThroughputMeter, call_with_timeout, is_throttled, orphaned_calls
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def test_token_bucket_rate_and_backoff():
+    clock = FakeClock()
+    bucket = TokenBucket(2.0, burst=2, min_rate=0.5, backoff=0.5, recover=2.0, recover_after=3,
+                         clock=clock, sleep=clock.sleep)
+    # 桶内的2个令牌立即可用，之后每0.5秒一个
+    for _ in range(6):
+        bucket.acquire()
+    assert clock.now == pytest.approx(2.0)
+
+    bucket.throttled()
+    bucket.throttled()
+    bucket.throttled()
+    assert bucket.rate == 0.5
+    start = clock.now
+    bucket.acquire()
+    assert clock.now - start == pytest.approx(2.0)
+
+    # 连续成功recover_after次后逐步恢复，不超过设定速率
+    for _ in range(6):
+        bucket.succeeded()
+    assert bucket.rate == 2.0
+    for _ in range(3):
+        bucket.succeeded()
+    assert bucket.rate == 2.0
+
+
+def test_throttle_detection_and_timeout(monkeypatch):
+    assert is_throttled(Exception("HTTP Error 456: Client Error"))
+    assert not is_throttled(TimeoutError())
+    assert not is_throttled(ConnectionResetError("Connection reset by peer"))
+    assert is_throttled(RuntimeError("访问过于频繁"))
+    assert not is_throttled(ValueError("stock code not found"))
+
+    assert call_with_timeout(lambda x: x + 1, 1, 1) == 2
+    with pytest.raises(TimeoutError):
+        call_with_timeout(time.sleep, 0.05, 1)
+    with pytest.raises(KeyError):
+        call_with_timeout({}.__getitem__, 1, 'a')
+
+    # 超时后仍未返回的调用达到上限时，不再发出新调用；先等上面超时的调用返回
+    time.sleep(1)
+    assert orphaned_calls() == 0
+    monkeypatch.setitem(__import__('config').FETCH_CONFIG, 'max_orphaned', 1)
+    with pytest.raises(TimeoutError):
+        call_with_timeout(time.sleep, 0.05, 0.5)
+    assert orphaned_calls() == 1
+    calls = []
+    with pytest.raises(TimeoutError):
+        call_with_timeout(calls.append, 0.05, 1)
+    assert calls == []
+    assert call_with_timeout(calls.append, 1, 1) is None
+    assert calls == [1] and orphaned_calls() == 0
+
+
+def test_throughput_meter():
+    clock = FakeClock()
+    meter = ThroughputMeter(10, interval=5, clock=clock)
+    clock.now = 1
+    assert not meter.update()
+    clock.now = 6
+    assert meter.update(4)
+    assert meter.count == 5
+    clock.now = 7
+    assert meter.update(5)
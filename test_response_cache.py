@@ -0,0 +1,61 @@
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from response_cache import ResponseCache, CacheMiss, cache_key
+
+PARAMS = {'symbol': '现金流量表'}
+
+
+def make_report(n=4):
+    return pd.DataFrame({'报告日': [f"20{20 + i}0930" for i in range(n)],
+                         '经营活动产生的现金流量净额': np.arange(n, dtype='float64') * 1.5,
+                         '备注': ['a', None, 'c', None][:n] + [None] * max(0, n - 4),
+                         '行数': np.arange(n)})
+
+
+def test_cache_roundtrip_and_offline(tmp_path):
+    root = str(tmp_path / 'cache')
+    cache = ResponseCache(root, ttl=3600)
+    calls = []
+
+    def loader():
+        calls.append(1)
+        return make_report()
+
+    assert cache_key('e', 's', {'a': 1, 'b': 2}) == cache_key('e', 's', {'b': 2, 'a': 1})
+    df = cache.fetch('stock_financial_report_sina', 'sh600000', PARAMS, loader)
+    cached = cache.fetch('stock_financial_report_sina', 'sh600000', PARAMS, loader)
+    assert len(calls) == 1
+    pd.testing.assert_frame_equal(cached, df, check_dtype=False)
+    assert cached['经营活动产生的现金流量净额'].dtype == np.float64
+    assert cached['备注'].tolist() == ['a', None, 'c', None]
+
+    # 过期后重新请求；离线模式不检查有效期，缓存中没有时不调用loader
+    path = cache._path(cache_key('stock_financial_report_sina', 'sh600000', PARAMS))
+    os.utime(path, (time.time(), time.time() - 7200))
+    cache.fetch('stock_financial_report_sina', 'sh600000', PARAMS, loader)
+    assert len(calls) == 2
+    offline = ResponseCache(root, ttl=0, offline=True)
+    assert len(offline.fetch('stock_financial_report_sina', 'sh600000', PARAMS, loader)) == 4
+    with pytest.raises(CacheMiss):
+        offline.fetch('stock_financial_report_sina', 'sz000001', PARAMS, loader)
+    assert len(calls) == 2
+
+
+def test_cache_eviction(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache'), max_bytes=10 ** 9)
+    now = time.time()
+    for i in range(5):
+        cache.put('e', str(i), None, make_report(200))
+        os.utime(cache._path(cache_key('e', str(i))), (now - 100 + i, now))
+    size = os.path.getsize(cache._path(cache_key('e', '0')))
+    # 最近读取过的0号文件保留，最久未使用的1、2号被淘汰
+    assert cache.get('e', '0') is not None
+    cache.max_bytes = size * 3 + size // 2
+    assert cache.evict() == 2
+    assert cache.get('e', '1') is None and cache.get('e', '2') is None
+    assert cache.get('e', '0') is not None and cache.get('e', '4') is not None
@@ -0,0 +1,19 @@
+from schema import build_create_table_sql, build_migration_sql, column_type
+
+
+def test_create_table_sql():
+    sql = build_create_table_sql('profit', ['Stkcd', 'Accper', 'Typrep', 'ParNetProfit'])
+    assert "`Stkcd` VARCHAR(20) NOT NULL" in sql
+    assert "`Accper` DATE NOT NULL" in sql
+    assert "`ParNetProfit` DECIMAL(26,6)" in sql
+    assert "PRIMARY KEY (`Stkcd`, `Accper`)" in sql
+    assert "KEY `idx_profit_Accper` (`Accper`)" in sql
+    assert column_type('Clsprc') == 'DECIMAL(26,6)'
+
+
+def test_migration_sql():
+    statements = build_migration_sql('trade', ['Stkcd', 'Trddt', 'Clsprc', 'Capchgdt'])
+    assert statements[0].startswith("UPDATE `trade` SET `Clsprc` = IF(")
+    assert "`Capchgdt` = IF(STR_TO_DATE" in statements[0]
+    assert statements[-1].count("MODIFY COLUMN") == 4
+    assert "ADD PRIMARY KEY (`Stkcd`, `Trddt`)" in statements[-1]
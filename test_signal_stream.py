@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+from backtest import BacktestEngine
+from miller_value import FinancialDataRepository, MillerStrategyRunner
+from signal_stream import SignalStream, replay_events, parse_events
+from test_batch_engine import make_buy_snapshot
+
+
+def test_parse_events():
+    lines = ['Stkcd,Trddt,Clsprc\n', '000001,2024-01-02 09:30:00,10.5\n', '\n', '000002,2024-01-02,bad\n']
+    assert list(parse_events(lines)) == [('000001', '2024-01-02 09:30:00', 10.5)]
+
+
+def test_replay_matches_buy_mode(tmp_path):
+    store, codes = make_buy_snapshot(tmp_path)
+    repo = FinancialDataRepository({}, snapshot=store)
+    engine = BacktestEngine(MillerStrategyRunner(repo), write=False)
+    engine.load('2023-12-31')
+    events = list(replay_events(repo, '2021-01-01', '2022-12-31', codes))
+    # 之后每个交易日都以最近收盘价推送行情，价格区间需随市场平均pb、股本和往年股价逐日刷新
+    for date in pd.bdate_range('2023-01-01', '2023-12-31').strftime('%Y-%m-%d'):
+        for code in codes:
+            price = repo.price_index.lookup(code, date)
+            if not np.isnan(price):
+                events.append((code, date, price))
+    stream = SignalStream(engine, codes)
+    signals = list(stream.run(events))
+
+    # 参照逐日完整计算估值指标的buy模式，不经过价格区间
+    reference = BacktestEngine(MillerStrategyRunner(repo), write=False)
+    reference.load('2023-12-31')
+    counts = {}
+    expected, state = [], {}
+    for code, date, price in events:
+        if date not in counts:
+            counts[date] = reference.buy(date, codes)['count']
+        count = counts[date].loc[code]
+        op = '1' if count >= 3 else '0' if count <= 1 else None
+        if op is not None and state.get(code) != op:
+            state[code] = op
+            expected.append((code, date, op, count))
+    assert [(s['Stkcd'], s['timestamp'], s['op'], s['score']) for s in signals] == expected
+    assert signals and stream.latency_stats()['events'] == len(events)
+
+
+def test_late_ticks_are_dropped(tmp_path, monkeypatch):
+    store, codes = make_buy_snapshot(tmp_path)
+    monkeypatch.setitem(__import__('config').STREAM_CONFIG, 'latency_window', 2)
+    repo = FinancialDataRepository({}, snapshot=store)
+    engine = BacktestEngine(MillerStrategyRunner(repo), write=False)
+    engine.load('2023-12-31')
+    stream = SignalStream(engine, codes)
+    events = [(codes[0], '2023-06-30', 10.0), (codes[1], '2023-06-30', 10.0),
+              (codes[0], '2023-03-31 14:59:59', 10.0), (codes[1], '2023-07-03', 10.0)]
+    list(stream.run(events))
+    assert stream.date == '2023-07-03'
+    stats = stream.latency_stats()
+    assert stats['events'] == 3 and stats['late'] == 1
+    assert len(stream._latencies) == 2
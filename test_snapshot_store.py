@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+from snapshot_store import SnapshotStore
+from miller_value import FinancialDataRepository
+
+
+def write(store, table, date_column, df):
+    store._write_table(table, store._normalize(df, date_column), date_column)
+
+
+def make_store(tmp_path):
+    store = SnapshotStore(str(tmp_path))
+    write(store, 'profit', 'Accper', pd.DataFrame({
+        'Stkcd': ['000002', '000001', '000001', '000001'],
+        'Accper': ['2023-12-31', '2023-06-30', '2023-12-31', '2023-09-30'],
+        'ParNetProfit': ['5', '10', '30', '20'],
+    }))
+    write(store, 'trade', 'Trddt', pd.DataFrame({
+        'Stkcd': ['000001', '000001', '000002'],
+        'Trddt': ['2024-01-02', '2024-01-03', '2024-01-02'],
+        'Clsprc': [10.0, 11.0, 5.0],
+    }))
+    write(store, 'shares', 'Reptdt', pd.DataFrame({
+        'Stkcd': ['000001', '000002'],
+        'Reptdt': ['2023-01-01', '2023-01-01'],
+        'Nshrttl': [100.0, 200.0],
+    }))
+    return store
+
+
+def test_quarterly_and_panel(tmp_path):
+    store = make_store(tmp_path)
+    df = store.get_profit_quarterly('000001', 2, '2023-12-31')
+    assert list(df['Accper']) == ['2023-12-31', '2023-09-30']
+    assert list(df['ParNetProfit']) == [30.0, 20.0]
+    assert store.get_profit_quarterly('000001', 12, '2023-01-01').empty
+    assert store.get_profit_quarterly('600000', 12, '2023-12-31').empty
+
+    panel = store.get_statement_panel('profit', ['000001', '000002'], '2023-09-30', 12)
+    sliced = FinancialDataRepository.slice_panel(panel, '000001')
+    assert list(sliced['Accper']) == ['2023-09-30', '2023-06-30']
+    assert FinancialDataRepository.slice_panel(panel, '000002').empty
+
+    projected = store.get_profit_quarterly('000001', 2, '2023-12-31', columns=['ParNetProfit'])
+    assert list(projected.columns) == ['Stkcd', 'Accper', 'ParNetProfit']
+
+
+def test_asof_lookups(tmp_path):
+    store = make_store(tmp_path)
+    repo = FinancialDataRepository({}, snapshot=store)
+    assert repo.get_latest_close_price('000001', '2024-01-02') == 10.0
+    assert repo.get_latest_close_price('000001', '2024-06-30') == 11.0
+    assert np.isnan(repo.get_latest_close_price('000001', '2023-12-31'))
+    assert repo.get_market_cap('000002', '2024-01-05') == 1000.0
+    assert repo.get_total_shares('000001', '2024-01-05') == 100.0
+
+
+def test_sync_repulls_lookback_window(tmp_path):
+    from backends import create_backend
+    connection = create_backend({'backend': 'sqlite', 'path': str(tmp_path / 'stock.db')}).connect()
+
+    def execute(sql, rows=()):
+        with connection.cursor() as cursor:
+            if rows:
+                cursor.executemany(sql, rows)
+            else:
+                cursor.execute(sql)
+        connection.commit()
+    execute("CREATE TABLE trade (Stkcd TEXT, Trddt TEXT, Clsprc REAL, PRIMARY KEY (Stkcd, Trddt))")
+    execute("CREATE TABLE profit (Stkcd TEXT, Accper TEXT, ParNetProfit REAL, PRIMARY KEY (Stkcd, Accper))")
+    execute("INSERT INTO trade VALUES (%s, %s, %s)", [('000001', '2024-01-02', 10.0), ('000001', '2024-01-03', 11.0)])
+    execute("INSERT INTO profit VALUES (%s, %s, %s)", [('000001', '2023-06-30', 10.0), ('000001', '2023-09-30', 20.0)])
+    store = SnapshotStore(str(tmp_path / 'snapshot'), lookback_days={'profit': 120, 'trade': 0})
+    assert store.sync(connection, ['trade', 'profit']) == {'trade': 2, 'profit': 2}
+
+    # 高水位线当天晚到的行情、回看窗口内更正的往期报表和新报告期都同步到快照，不产生重复行
+    execute("INSERT INTO trade VALUES (%s, %s, %s)", [('000002', '2024-01-03', 5.0)])
+    execute("UPDATE profit SET ParNetProfit = 15.0 WHERE Accper = '2023-06-30'")
+    execute("INSERT INTO profit VALUES (%s, %s, %s)", [('000001', '2023-12-31', 30.0)])
+    assert store.sync(connection, ['trade', 'profit']) == {'trade': 2, 'profit': 3}
+    trade = store.read_table('trade')
+    assert list(zip(trade['Stkcd'], trade['Trddt'])) == [('000001', '2024-01-02'), ('000001', '2024-01-03'),
+                                                         ('000002', '2024-01-03')]
+    profit = store.read_table('profit')
+    assert list(profit['ParNetProfit']) == [15.0, 20.0, 30.0]
+
+    # 合并报表（A）和母公司报表（B）同一报告期的两行在全量和增量同步后都保留
+    execute("CREATE TABLE balance (Stkcd TEXT, Accper TEXT, Typrep TEXT, ParOwnEquity REAL)")
+    execute("INSERT INTO balance VALUES (%s, %s, %s, %s)", [('000001', '2023-09-30', 'A', 100.0),
+                                                           ('000001', '2023-09-30', 'B', 80.0)])
+    store.lookback_days['balance'] = 120
+    assert store.sync(connection, ['balance']) == {'balance': 2}
+    execute("INSERT INTO balance VALUES (%s, %s, %s, %s)", [('000001', '2023-12-31', 'A', 110.0)])
+    assert store.sync(connection, ['balance']) == {'balance': 3}
+    balance = store.read_table('balance')
+    assert list(zip(balance['Accper'], balance['Typrep'])) == [('2023-09-30', 'A'), ('2023-09-30', 'B'),
+                                                               ('2023-12-31', 'A')]
+    connection.close()
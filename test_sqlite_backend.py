@@ -0,0 +1,134 @@
+import importlib
+import numpy as np
+import pandas as pd
+from market_averages import compute_market_averages, compute_pb_avg, BALANCE_COLUMNS
+from miller_value import FinancialDataRepository, MillerStrategyRunner
+from schema import SchemaManager
+from result_writer import ResultWriter
+
+QUARTERS = [f"{y}-{md}" for y in range(2018, 2024) for md in ('03-31', '06-30', '09-30', '12-31')]
+CODES = ['000001', '000002']
+
+
+def make_tables():
+    rng = np.random.default_rng(0)
+    n = len(QUARTERS) * len(CODES)
+    keys = pd.DataFrame({'Stkcd': np.repeat(CODES, len(QUARTERS)), 'Accper': QUARTERS * len(CODES)})
+    profit = keys.assign(Typrep='A', OpProfit=rng.uniform(50, 150, n).round(2), IncomeTax=rng.uniform(5, 20, n).round(2),
+                         ProfitBefTax=rng.uniform(80, 160, n).round(2), OpCost=rng.uniform(200, 400, n).round(2),
+                         ParNetProfit=rng.uniform(40, 120, n).round(2))
+    balance = keys.assign(Typrep='A', **{c: rng.uniform(10, 100, n).round(2) for c in BALANCE_COLUMNS[2:]})
+    balance['ParOwnEquity'] = rng.uniform(800, 1200, n).round(2)
+    for c in ('AcctRecNet', 'PrepayNet', 'InventNet', 'NotesRecNet'):
+        balance[c] = rng.uniform(100, 300, n).round(2)
+    cash_flow = keys.assign(Typrep='A', NetOpCF=rng.uniform(100, 200, n).round(2), AssetPurchase=rng.uniform(10, 60, n).round(2))
+    trade = pd.DataFrame({'Stkcd': keys['Stkcd'], 'Trddt': [q[:8] + '28' for q in keys['Accper']],
+                          'Clsprc': rng.uniform(5, 20, n).round(2)})
+    shares = pd.DataFrame({'Stkcd': CODES, 'Reptdt': ['2015-01-01'] * 2, 'Nshrttl': [1000.0, 500.0]})
+    return {'profit': profit, 'balance': balance, 'cash_flow': cash_flow, 'trade': trade, 'shares': shares}
+
+
+def load_sqlite(tmp_path, monkeypatch):
+    # load_datas在导入时创建日志文件，切换到临时目录后再导入
+    monkeypatch.chdir(tmp_path)
+    load_datas = importlib.import_module('load_datas')
+    config = {'backend': 'sqlite', 'path': str(tmp_path / 'stock.db')}
+    tables = make_tables()
+    for name, df in tables.items():
+        path = tmp_path / f"{name}.csv"
+        df.to_csv(path, index=False)
+        assert load_datas.CSVDataLoader(config).load_file_to_mysql(str(path), name, 'csv')
+    return config, tables
+
+
+def test_repository_on_sqlite(tmp_path, monkeypatch):
+    config, tables = load_sqlite(tmp_path, monkeypatch)
+    repo = FinancialDataRepository(config)
+    assert repo.connect()
+    try:
+        df = repo.get_profit_quarterly('000001', 4, '2023-10-15', ['ParNetProfit'])
+        assert list(df['Accper']) == ['2023-09-30', '2023-06-30', '2023-03-31', '2022-12-31']
+        assert df['ParNetProfit'].dtype == np.float64
+        panel = repo.get_statement_panel('balance', CODES, '2023-12-31', 12, ['ParOwnEquity'])
+        assert len(panel) == 24
+
+        averages = compute_market_averages(tables['balance'], tables['profit'])
+        assert np.isclose(repo.get_roc_avg('2023-11-01'), averages.loc['2023-09-30', 'roc_avg'])
+        assert np.isclose(repo.get_rooc_avg('2023-11-01'), averages.loc['2023-09-30', 'rooc_avg'])
+        assert np.isclose(repo.get_avg_inventory_turnover('2023-11-01'), averages.loc['2023-09-30', 'it_avg'])
+
+        # 逐条SQL查询与as-of索引批量计算的结果一致
+        date = '2023-11-01'
+        sql_values = [repo.get_pb_avg(date), repo.get_market_cap('000002', date),
+                      repo.get_latest_close_price('000002', date), repo.get_five_year_avg_pe('000001', date)]
+        assert not np.isnan(repo.get_discounted_10y_fcf('000001', date, 0.09))
+        repo.load_asof_indexes()
+        balance_q = tables['balance'][tables['balance']['Accper'] == '2023-09-30']
+        index_values = [compute_pb_avg(balance_q, repo.price_index, repo.shares_index, date),
+                        repo.get_market_cap('000002', date), repo.get_latest_close_price('000002', date),
+                        repo.get_five_year_avg_pe('000001', date)]
+        np.testing.assert_allclose(sql_values, index_values)
+    finally:
+        repo.close()
+
+
+def test_runner_on_sqlite(tmp_path, monkeypatch):
+    config, _ = load_sqlite(tmp_path, monkeypatch)
+    manager = SchemaManager(config)
+    assert manager.connect()
+    assert manager.create_tables(['sel_stocks', 'trade_stocks'])
+    manager.close()
+
+    repo = FinancialDataRepository(config)
+    assert repo.connect()
+    try:
+        runner = MillerStrategyRunner(repo)
+        assert sorted(runner.get_stock_codes()) == CODES
+        assert runner.insert_sel_stock('000002', '2023-12-31')
+        assert runner.get_sel_codes('2024-01-15') == ['000002']
+        assert runner.insert_trade_stock('000002', '2024-01-15', 12.5, '1', 3)
+        # 重复写入同一主键时覆盖而不报错
+        assert runner.insert_trade_stock('000002', '2024-01-15', 13.0, '0', 1)
+        writer = ResultWriter(repo, batch_size=1)
+        for _ in range(2):
+            writer.add_sel_stock('000001', '2023-12-31')
+            writer.add_trade_stock('000001', '2024-01-15', np.float64('nan'), '1', np.int64(4))
+            writer.add_trade_stock('000002', '2024-01-15', 14.0, '1', 3)
+            assert writer.commit() and writer.pending() == 0
+        rows = repo._fetchall("SELECT Stkcd, price, op, score FROM trade_stocks ORDER BY Stkcd")
+        assert [(r['Stkcd'], r['price'], r['op'], r['score']) for r in rows] == [
+            ('000001', None, '1', '4'), ('000002', 14.0, '1', '3')]
+        assert sorted(runner.get_sel_codes('2024-01-15')) == ['000001', '000002']
+    finally:
+        repo.close()
+
+
+def test_market_averages_on_sqlite(tmp_path, monkeypatch):
+    from market_averages import (MARKET_AVG_TABLE, refresh_market_averages, load_market_averages,
+                                 source_state, stale_quarters, save_market_averages)
+    config, _ = load_sqlite(tmp_path, monkeypatch)
+    repo = FinancialDataRepository(config)
+    assert repo.connect()
+    try:
+        # 旧版本保存的汇总表缺少指纹列，加载为空并在重新计算时升级
+        with repo.connection.cursor() as cursor:
+            cursor.execute(f"CREATE TABLE {MARKET_AVG_TABLE} (Accper varchar(30), roc_avg double)")
+        repo.connection.commit()
+        assert load_market_averages(repo).empty
+        first = refresh_market_averages(repo)
+        assert len(load_market_averages(repo)) == len(QUARTERS)
+        assert stale_quarters(load_market_averages(repo), source_state(repo)) == []
+
+        # 股价原地修订：行数不变，指纹变化，修订所在月及之后的报告期需要重新计算
+        repo._execute("UPDATE trade SET Clsprc = Clsprc + 1 WHERE Stkcd = '000001' AND Trddt = '2023-06-28'")
+        repo.connection.commit()
+        assert stale_quarters(load_market_averages(repo), source_state(repo)) == QUARTERS[-3:]
+        refreshed = refresh_market_averages(repo)
+        assert refreshed.loc['2023-06-30', 'pb_avg'] > first.loc['2023-06-30', 'pb_avg']
+        assert stale_quarters(load_market_averages(repo), source_state(repo)) == []
+
+        # 写入暂存表失败（主键重复）时保留原表
+        save_market_averages(repo, pd.concat([refreshed, refreshed.iloc[[0]]]))
+        assert len(load_market_averages(repo)) == len(QUARTERS)
+    finally:
+        repo.close()
@@ -0,0 +1,84 @@
+import multiprocessing
+
+from miller_value import FinancialDataRepository, MillerStrategyRunner
+from schema import SchemaManager
+from test_sqlite_backend import CODES, load_sqlite
+from work_queue import TaskQueue, QueueWorker, worker_main
+
+DATES = ['2023-06-30', '2023-09-30', '2023-12-31']
+
+
+def make_queue_db(tmp_path, monkeypatch):
+    config, _ = load_sqlite(tmp_path, monkeypatch)
+    manager = SchemaManager(config)
+    assert manager.connect()
+    assert manager.create_tables(['sel_stocks', 'trade_stocks'])
+    manager.close()
+    return config
+
+
+def test_workers_drain_queue(tmp_path, monkeypatch):
+    config = make_queue_db(tmp_path, monkeypatch)
+    repo = FinancialDataRepository(config)
+    assert repo.connect()
+    try:
+        runner = MillerStrategyRunner(repo)
+        run_id = runner.distribute('sel', DATES, chunk_size=1)
+        # 同一运行ID不重复入队
+        assert runner.distribute('sel', DATES, chunk_size=1, run_id=run_id) == run_id
+        queue = TaskQueue(repo)
+        assert queue.status(run_id)['pending'] == len(DATES) * len(CODES)
+
+        ctx = multiprocessing.get_context('spawn')
+        workers = [ctx.Process(target=worker_main, args=(config, run_id), kwargs={'poll_interval': 0.1})
+                   for _ in range(3)]
+        for p in workers:
+            p.start()
+        for p in workers:
+            p.join(120)
+            assert p.exitcode == 0
+        assert queue.status(run_id) == {'pending': 0, 'running': 0, 'done': len(DATES) * len(CODES), 'failed': 0}
+
+        for end_date in DATES:
+            result = runner.strategy.evaluate_selection_batch(CODES, repo, end_date)
+            expected = sorted(result.index[result['selected']])
+            rows = repo._fetchall("SELECT Stkcd FROM sel_stocks WHERE end_date = %s", (end_date,))
+            assert sorted(r['Stkcd'] for r in rows) == expected
+    finally:
+        repo.close()
+
+
+def test_stale_task_requeued(tmp_path, monkeypatch):
+    config = make_queue_db(tmp_path, monkeypatch)
+    repo = FinancialDataRepository(config)
+    assert repo.connect()
+    try:
+        queue = TaskQueue(repo)
+        assert queue.create_table()
+        assert queue.enqueue('r1', 'sel', {'2023-12-31': CODES}, chunk_size=1) == 2
+        first = queue.claim('dead-worker', 'r1')
+        assert first['task_no'] == 0 and first['attempts'] == 1
+        # 心跳未过期时不重新入队
+        assert queue.requeue_stale(stale_after=60, run_id='r1') == 0
+        repo._fetchall("UPDATE strategy_tasks SET heartbeat = heartbeat - 120 WHERE task_no = 0")
+        repo.connection.commit()
+        assert queue.requeue_stale(stale_after=60, run_id='r1') == 1
+        # 原持有者的心跳和完成都不再生效
+        assert not queue.heartbeat(first)
+        assert not queue.finish(first)
+
+        worker = QueueWorker(MillerStrategyRunner(repo), 'r1', max_attempts=2, poll_interval=0.01)
+        assert worker.run() == 2
+        rows = repo._fetchall("SELECT task_no, status, attempts FROM strategy_tasks ORDER BY task_no")
+        assert [(r['task_no'], r['status'], r['attempts']) for r in rows] == [(0, 'done', 2), (1, 'done', 1)]
+
+        # 领取次数达到上限的失效任务标记为failed
+        queue.enqueue('r2', 'sel', {'2023-12-31': CODES[:1]})
+        task = queue.claim('dead-worker', 'r2')
+        assert not queue.finish(dict(task, token='other'))
+        repo._fetchall("UPDATE strategy_tasks SET heartbeat = heartbeat - 120 WHERE run_id = 'r2'")
+        repo.connection.commit()
+        assert queue.requeue_stale(stale_after=60, max_attempts=1, run_id='r2') == 1
+        assert queue.status('r2')['failed'] == 1
+    finally:
+        repo.close()
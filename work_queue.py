@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分布式任务队列
+功能：
+1. 协调进程把(end_date, 股票分块)任务写入共享数据库的strategy_tasks表，多台机器上的工作进程从同一张表领取任务
+2. MySQL上用SELECT ... FOR UPDATE SKIP LOCKED领取，并发的工作进程互不等待；SQLite上用单条条件UPDATE领取，
+   便于在单机上用多个工作进程和本地数据库文件测试
+3. 工作进程处理任务期间由后台线程定期更新心跳，结果通过MillerStrategyRunner的ResultWriter写入结果表
+4. 心跳超时的任务自动重新入队，领取次数超过上限的任务标记为failed；结果写入是幂等的，重做的任务不会产生重复行
+5. 心跳时间取数据库服务器的时钟，不受各节点本地时钟偏差影响
+
+任务状态：pending（待领取）-> running（已领取）-> done（完成）或failed（失败次数超过上限）
+
+用法：
+    python work_queue.py enqueue sel 2023-12-31 2024-03-31 --chunk-size 500
+    python work_queue.py worker --run-id 20240101120000
+    python work_queue.py status 20240101120000
+    python work_queue.py --sqlite stock.db enqueue sel 2023-12-31 --wait
+"""
+
+import os
+import sys
+import time
+import uuid
+import socket
+import logging
+import argparse
+import threading
+from typing import Dict, List, Optional
+
+from config import WORK_QUEUE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+TASK_TABLE = 'strategy_tasks'
+# 任务方法 -> (策略的批量评估方法名, 执行器的结果写入方法名)
+TASK_METHODS = {
+    'sel': ('evaluate_selection_batch', '_write_selection'),
+    'buy': ('evaluate_buy_batch', '_write_buy'),
+}
+TASK_STATUSES = ('pending', 'running', 'done', 'failed')
+# 数据库服务器当前时间（Unix秒）
+_NOW_SQL = {
+    'mysql': "UNIX_TIMESTAMP(NOW(6))",
+    'sqlite': "((julianday('now') - 2440587.5) * 86400.0)",
+}
+
+
+def build_task_table_sql(dialect: str = 'mysql') -> List[str]:
+    """生成strategy_tasks表的建表和索引语句，SQLite不支持字段注释，索引单独创建"""
+    columns = [('run_id', 'varchar(32) NOT NULL', '运行ID'),
+               ('task_no', 'int NOT NULL', '任务序号'),
+               ('method', 'varchar(10) NOT NULL', '任务方法：sel或buy'),
+               ('end_date', 'varchar(10) NOT NULL', '截止日期'),
+               ('codes', 'text NOT NULL', '逗号分隔的股票代码'),
+               ('status', "varchar(10) NOT NULL DEFAULT 'pending'", '任务状态'),
+               ('worker', 'varchar(100)', '领取任务的工作进程'),
+               ('token', 'varchar(32)', '本次领取的令牌'),
+               ('heartbeat', 'double', '最近一次心跳（Unix秒）'),
+               ('attempts', 'int NOT NULL DEFAULT 0', '已领取次数'),
+               ('error', 'text', '最近一次失败原因')]
+    lines = [f"{name} {type_} COMMENT '{comment}'" if dialect == 'mysql' else f"{name} {type_}"
+             for name, type_, comment in columns]
+    lines.append("primary key(run_id, task_no)")
+    if dialect == 'mysql':
+        lines.append(f"KEY idx_{TASK_TABLE}_status (status, run_id)")
+    statements = [f"CREATE TABLE IF NOT EXISTS {TASK_TABLE} (\n    " + ",\n    ".join(lines) + "\n)"]
+    if dialect != 'mysql':
+        statements.append(f"CREATE INDEX IF NOT EXISTS idx_{TASK_TABLE}_status ON {TASK_TABLE} (status, run_id)")
+    return statements
+
+
+class TaskQueue:
+    """任务队列类，封装strategy_tasks表上的入队、领取、心跳、完成和失效重入队操作"""
+
+    def __init__(self, repo):
+        """
+        初始化任务队列
+
+        Args:
+            repo: 财务数据仓库实例，使用其当前线程的连接和数据库后端
+        """
+        self.repo = repo
+        self.dialect = repo.backend.name
+        self.now_sql = _NOW_SQL[self.dialect]
+
+    def _run(self, sql: str, params=None, fetch: str = None):
+        """
+        执行一条语句并立即提交；读取语句同样提交，使MySQL的可重复读事务看到其他节点的最新状态
+
+        Args:
+            sql: SQL语句
+            params: 查询参数
+            fetch: None返回影响行数，'all'返回全部行，'one'返回第一行
+        """
+        connection = self.repo.connection
+        try:
+            with connection.cursor() as cursor:
+                count = cursor.execute(sql, params)
+                result = count if fetch is None else cursor.fetchall() if fetch == 'all' else cursor.fetchone()
+            connection.commit()
+            return result
+        except Exception:
+            connection.rollback()
+            raise
+
+    def create_table(self) -> bool:
+        """创建strategy_tasks表，已存在时不做修改"""
+        connection = self.repo.connection
+        try:
+            with connection.cursor() as cursor:
+                for sql in build_task_table_sql(self.dialect):
+                    cursor.execute(sql)
+            connection.commit()
+            return True
+        except Exception as e:
+            logger.error(f"创建{TASK_TABLE}表失败: {e}")
+            connection.rollback()
+            return False
+
+    def enqueue(self, run_id: str, method: str, tasks: Dict[str, List[str]], chunk_size: int = None) -> int:
+        """
+        把每个截止日期的股票按chunk_size分块写入任务表；运行ID已有任务时不重复入队
+
+        Args:
+            run_id: 运行ID
+            method: 任务方法，sel或buy
+            tasks: 截止日期 -> 股票代码列表
+            chunk_size: 每个任务的股票数，默认取WORK_QUEUE_CONFIG['chunk_size']
+
+        Returns:
+            int: 该运行的任务数
+        """
+        if method not in TASK_METHODS:
+            raise ValueError(f"不支持的任务方法: {method}")
+        existing = self._run(f"SELECT COUNT(*) AS n FROM {TASK_TABLE} WHERE run_id = %s", (run_id,), 'one')['n']
+        if existing:
+            logger.info(f"运行{run_id}已有{existing}个任务，不重复入队")
+            return int(existing)
+        size = chunk_size or WORK_QUEUE_CONFIG['chunk_size']
+        rows = []
+        for end_date, codes in tasks.items():
+            for start in range(0, len(codes), size):
+                rows.append((run_id, len(rows), method, end_date, ','.join(str(c) for c in codes[start:start + size])))
+        if not rows:
+            return 0
+        connection = self.repo.connection
+        try:
+            with connection.cursor() as cursor:
+                cursor.executemany(f"INSERT INTO {TASK_TABLE}(run_id, task_no, method, end_date, codes) "
+                                   f"VALUES (%s, %s, %s, %s, %s)", rows)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        logger.info(f"运行{run_id}: {len(tasks)}个日期, {len(rows)}个任务入队")
+        return len(rows)
+
+    def claim(self, worker: str, run_id: str = None) -> Optional[dict]:
+        """
+        领取一个待处理任务，领取次数加1
+
+        Args:
+            worker: 工作进程标识
+            run_id: 只领取该运行的任务，默认领取任意运行的任务
+
+        Returns:
+            dict: 任务行（含token），没有可领取的任务时返回None
+        """
+        token = uuid.uuid4().hex
+        where = "status = 'pending'" + (" AND run_id = %s" if run_id else "")
+        where_params = (run_id,) if run_id else ()
+        update = (f"UPDATE {TASK_TABLE} SET status = 'running', worker = %s, token = %s, "
+                  f"heartbeat = {self.now_sql}, attempts = attempts + 1")
+        connection = self.repo.connection
+        try:
+            with connection.cursor() as cursor:
+                if self.dialect == 'mysql':
+                    # 其他事务已锁定的行直接跳过，多个节点同时领取时互不等待
+                    cursor.execute(f"SELECT run_id, task_no FROM {TASK_TABLE} WHERE {where} "
+                                   f"ORDER BY run_id, task_no LIMIT 1 FOR UPDATE SKIP LOCKED", where_params)
+                    row = cursor.fetchone()
+                    if row is not None:
+                        cursor.execute(update + " WHERE run_id = %s AND task_no = %s",
+                                       (worker, token, row['run_id'], row['task_no']))
+                else:
+                    # SQLite的写操作串行执行，单条UPDATE内的选取和更新是原子的
+                    cursor.execute(update + f" WHERE rowid = (SELECT rowid FROM {TASK_TABLE} WHERE {where} "
+                                            f"ORDER BY run_id, task_no LIMIT 1)", (worker, token, *where_params))
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        return self._run(f"SELECT * FROM {TASK_TABLE} WHERE token = %s", (token,), 'one')
+
+    def heartbeat(self, task: dict) -> bool:
+        """更新任务心跳；任务已被重新入队或由其他进程领取时返回False"""
+        return self._run(f"UPDATE {TASK_TABLE} SET heartbeat = {self.now_sql} "
+                         f"WHERE run_id = %s AND task_no = %s AND token = %s AND status = 'running'",
+                         (task['run_id'], task['task_no'], task['token'])) > 0
+
+    def finish(self, task: dict, error: str = None, max_attempts: int = None) -> bool:
+        """
+        结束任务：成功时标记为done；失败时重新入队，领取次数达到上限时标记为failed
+
+        Args:
+            task: claim返回的任务行
+            error: 失败原因，None表示成功
+            max_attempts: 领取次数上限，默认取WORK_QUEUE_CONFIG['max_attempts']
+
+        Returns:
+            bool: 任务仍由本次领取持有并更新成功返回True
+        """
+        if error is None:
+            status, params = "'done'", ()
+        else:
+            status = "CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END"
+            params = (max_attempts or WORK_QUEUE_CONFIG['max_attempts'],)
+        return self._run(f"UPDATE {TASK_TABLE} SET status = {status}, error = %s, heartbeat = {self.now_sql} "
+                         f"WHERE run_id = %s AND task_no = %s AND token = %s AND status = 'running'",
+                         (*params, error, task['run_id'], task['task_no'], task['token'])) > 0
+
+    def requeue_stale(self, stale_after: float = None, max_attempts: int = None, run_id: str = None) -> int:
+        """
+        把心跳超时的running任务重新入队，领取次数达到上限的标记为failed
+
+        Args:
+            stale_after: 心跳超时时间（秒），默认取WORK_QUEUE_CONFIG['stale_after']
+            max_attempts: 领取次数上限，默认取WORK_QUEUE_CONFIG['max_attempts']
+            run_id: 只处理该运行的任务，默认全部
+
+        Returns:
+            int: 重新入队或标记为failed的任务数
+        """
+        stale_after = stale_after if stale_after is not None else WORK_QUEUE_CONFIG['stale_after']
+        params = [max_attempts or WORK_QUEUE_CONFIG['max_attempts'], stale_after]
+        sql = (f"UPDATE {TASK_TABLE} SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'pending' END, "
+               f"worker = NULL, token = NULL, error = '心跳超时' "
+               f"WHERE status = 'running' AND heartbeat < {self.now_sql} - %s")
+        if run_id:
+            sql += " AND run_id = %s"
+            params.append(run_id)
+        count = self._run(sql, tuple(params))
+        if count:
+            logger.warning(f"{count}个任务心跳超时，已重新入队")
+        return count
+
+    def status(self, run_id: str = None) -> Dict[str, int]:
+        """
+        统计各状态的任务数
+
+        Args:
+            run_id: 运行ID，默认统计全部运行
+
+        Returns:
+            dict: 状态 -> 任务数，包含TASK_STATUSES中的全部状态
+        """
+        sql = f"SELECT status, COUNT(*) AS n FROM {TASK_TABLE}"
+        params = None
+        if run_id:
+            sql += " WHERE run_id = %s"
+            params = (run_id,)
+        counts = dict.fromkeys(TASK_STATUSES, 0)
+        for row in self._run(sql + " GROUP BY status", params, 'all'):
+            counts[row['status']] = int(row['n'])
+        return counts
+
+    def wait(self, run_id: str, poll_interval: float = None) -> Dict[str, int]:
+        """
+        等待运行的全部任务结束，期间把心跳超时的任务重新入队
+
+        Args:
+            run_id: 运行ID
+            poll_interval: 轮询间隔（秒），默认取WORK_QUEUE_CONFIG['poll_interval']
+
+        Returns:
+            dict: 结束时各状态的任务数
+        """
+        while True:
+            self.requeue_stale(run_id=run_id)
+            counts = self.status(run_id)
+            if counts['pending'] == 0 and counts['running'] == 0:
+                logger.info(f"运行{run_id}结束: {counts}")
+                return counts
+            time.sleep(poll_interval or WORK_QUEUE_CONFIG['poll_interval'])
+
+
+class QueueWorker:
+    """工作进程类：循环领取任务，用执行器评估并写入结果，处理期间后台线程维持心跳"""
+
+    def __init__(self, runner, run_id: str = None, worker_id: str = None, heartbeat_interval: float = None,
+                 stale_after: float = None, max_attempts: int = None, poll_interval: float = None):
+        """
+        初始化工作进程
+
+        Args:
+            runner: MillerStrategyRunner实例，在本进程内串行评估，结果通过其writer写入
+            run_id: 只处理该运行的任务，默认处理任意运行的任务
+            worker_id: 工作进程标识，默认为主机名:进程号
+            heartbeat_interval、stale_after、max_attempts、poll_interval: 默认取WORK_QUEUE_CONFIG
+        """
+        self.runner = runner
+        self.queue = TaskQueue(runner.repo)
+        self.run_id = run_id
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+        self.heartbeat_interval = heartbeat_interval or WORK_QUEUE_CONFIG['heartbeat_interval']
+        self.stale_after = stale_after or WORK_QUEUE_CONFIG['stale_after']
+        self.max_attempts = max_attempts or WORK_QUEUE_CONFIG['max_attempts']
+        self.poll_interval = poll_interval or WORK_QUEUE_CONFIG['poll_interval']
+        self._stop = threading.Event()
+
+    def _beat(self, task: dict, done: threading.Event):
+        # 心跳线程从连接池取自己的连接，不与主线程的评估和写入共用，线程结束前归还
+        with self.runner.repo.session():
+            try:
+                while not done.wait(self.heartbeat_interval):
+                    if not self.queue.heartbeat(task):
+                        logger.warning(f"任务{task['run_id']}/{task['task_no']}已被重新入队")
+                        break
+            except Exception as e:
+                logger.error(f"更新任务{task['run_id']}/{task['task_no']}心跳失败: {e}")
+
+    def process(self, task: dict) -> bool:
+        """
+        处理一个已领取的任务
+
+        Args:
+            task: claim返回的任务行
+
+        Returns:
+            bool: 评估和写入成功返回True
+        """
+        method, write = TASK_METHODS[task['method']]
+        codes = task['codes'].split(',')
+        done = threading.Event()
+        beat = threading.Thread(target=self._beat, args=(task, done), daemon=True)
+        beat.start()
+        error = None
+        try:
+            result = self.runner.evaluate_batch(method, codes, task['end_date'])
+            if not getattr(self.runner, write)(result, task['end_date']):
+                error = '写入结果失败'
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        finally:
+            done.set()
+            beat.join()
+        if error is not None:
+            logger.error(f"任务{task['run_id']}/{task['task_no']}失败: {error}")
+        if not self.queue.finish(task, error, self.max_attempts):
+            logger.warning(f"任务{task['run_id']}/{task['task_no']}已不由本进程持有，结果已写入（幂等）")
+        return error is None
+
+    def run(self, exit_when_idle: bool = True) -> int:
+        """
+        循环领取并处理任务
+
+        Args:
+            exit_when_idle: 为True时在没有pending和running任务后退出；为False时一直等待新任务，直到stop()
+
+        Returns:
+            int: 成功处理的任务数
+        """
+        processed = 0
+        logger.info(f"工作进程{self.worker_id}启动, 运行ID={self.run_id or '全部'}")
+        while not self._stop.is_set():
+            self.queue.requeue_stale(self.stale_after, self.max_attempts, self.run_id)
+            task = self.queue.claim(self.worker_id, self.run_id)
+            if task is None:
+                counts = self.queue.status(self.run_id)
+                # 其他进程仍在处理的任务可能心跳超时后重新入队，等它们结束再退出
+                if exit_when_idle and counts['pending'] == 0 and counts['running'] == 0:
+                    break
+                self._stop.wait(self.poll_interval)
+                continue
+            start = time.perf_counter()
+            codes = task['codes'].count(',') + 1
+            if self.process(task):
+                processed += 1
+                elapsed = time.perf_counter() - start
+                logger.info(f"任务{task['run_id']}/{task['task_no']}: {task['method']} {task['end_date']}, "
+                            f"{codes}只股票, 耗时{elapsed:.2f}秒")
+        logger.info(f"工作进程{self.worker_id}退出, 完成{processed}个任务")
+        return processed
+
+    def stop(self):
+        """通知run在当前任务结束后退出"""
+        self._stop.set()
+
+
+def worker_main(db_config: dict, run_id: str = None, exit_when_idle: bool = True, **options) -> int:
+    """
+    工作进程入口：建立自己的数据库连接并处理任务，可作为multiprocessing的target
+
+    Args:
+        db_config: 数据库配置
+        run_id: 只处理该运行的任务
+        exit_when_idle: 见QueueWorker.run
+        **options: 传给QueueWorker的其他参数
+
+    Returns:
+        int: 成功处理的任务数
+    """
+    from miller_value import FinancialDataRepository, MillerStrategyRunner
+
+    repo = FinancialDataRepository(db_config)
+    if not repo.connect():
+        return 0
+    try:
+        return QueueWorker(MillerStrategyRunner(repo), run_id, **options).run(exit_when_idle)
+    finally:
+        repo.close()
+
+
+def main():
+    """主函数：入队、启动工作进程或查看运行状态"""
+    from config import DB_CONFIG, SQLITE_CONFIG
+    from miller_value import FinancialDataRepository, MillerStrategyRunner
+
+    parser = argparse.ArgumentParser(description='米勒策略分布式任务队列')
+    sub = parser.add_subparsers(dest='command', required=True)
+    enqueue = sub.add_parser('enqueue', help='协调进程：把各日期的股票分块写入任务表')
+    enqueue.add_argument('mode', choices=list(TASK_METHODS), help='sel为选股评估，buy为买入评估')
+    enqueue.add_argument('dates', nargs='+', help='截止日期，格式YYYY-MM-DD')
+    enqueue.add_argument('--chunk-size', type=int, default=None, help='每个任务的股票数')
+    enqueue.add_argument('--run-id', default=None, help='运行ID，默认按当前时间生成')
+    enqueue.add_argument('--wait', action='store_true', help='等待全部任务结束，期间把心跳超时的任务重新入队')
+    worker = sub.add_parser('worker', help='工作进程：领取并处理任务')
+    worker.add_argument('--run-id', default=None, help='只处理该运行的任务')
+    worker.add_argument('--forever', action='store_true', help='没有任务时继续等待新任务')
+    status = sub.add_parser('status', help='查看运行的任务状态')
+    status.add_argument('run_id', nargs='?', default=None)
+    parser.add_argument('--sqlite', nargs='?', const=SQLITE_CONFIG['path'], default=None,
+                        help='使用本地SQLite数据库文件，默认路径取SQLITE_CONFIG')
+    args = parser.parse_args()
+    db_config = dict(SQLITE_CONFIG, path=args.sqlite) if args.sqlite else DB_CONFIG
+
+    if args.command == 'worker':
+        worker_main(db_config, args.run_id, exit_when_idle=not args.forever)
+        return
+
+    repo = FinancialDataRepository(db_config)
+    if not repo.connect():
+        sys.exit(1)
+    try:
+        queue = TaskQueue(repo)
+        if args.command == 'status':
+            print(queue.status(args.run_id))
+            return
+        run_id = MillerStrategyRunner(repo).distribute(args.mode, args.dates, args.chunk_size, args.run_id)
+        print(run_id)
+        if args.wait:
+            queue.wait(run_id)
+    finally:
+        repo.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    main()